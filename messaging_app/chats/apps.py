@@ -4,3 +4,11 @@ from django.apps import AppConfig
 class ChatsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'chats'
+
+    def ready(self):
+        from django.db.models.signals import post_migrate
+
+        from . import checks, signals  # noqa: F401
+        from .search import install_sqlite_triggers
+
+        post_migrate.connect(install_sqlite_triggers, sender=self)
@@ -0,0 +1,52 @@
+from django.conf import settings
+from django.core.checks import Error, Warning, register
+
+LOCAL_CACHE_BACKENDS = {"django.core.cache.backends.locmem.LocMemCache"}
+LOCAL_BROKERS = {"chats.realtime.InMemoryBroker"}
+
+
+@register()
+def check_shared_cache(app_configs, **kwargs):
+    """
+    Membership versions, conditional-GET markers and message fragments are
+    invalidated in the cache by whichever process handles a write. With a
+    per-process cache the other workers keep serving stale 304s and
+    memberships, so refuse to run on one unless explicitly allowed.
+    """
+    backend = settings.CACHES.get("default", {}).get("BACKEND")
+    if backend in LOCAL_CACHE_BACKENDS and not getattr(settings, "CHATS_ALLOW_LOCAL_CACHE", False):
+        return [
+            Error(
+                "The default cache is local to each process.",
+                hint=(
+                    "Use a cache shared by all workers (database, Redis, Memcached), "
+                    "or set CHATS_ALLOW_LOCAL_CACHE = True for a single-process setup."
+                ),
+                obj="CACHES['default']",
+                id="chats.E001",
+            )
+        ]
+    return []
+
+
+@register()
+def check_shared_broker(app_configs, **kwargs):
+    """
+    With a per-process broker a message only wakes the WebSockets, event
+    streams and long polls of the process that saved it. With several
+    workers the others see it at their next keepalive or poll timeout.
+    """
+    broker = getattr(settings, "CHATS_REALTIME_BROKER", "chats.realtime.InMemoryBroker")
+    if broker in LOCAL_BROKERS and not settings.DEBUG:
+        return [
+            Warning(
+                "Realtime events only reach connections of the process that saved the message.",
+                hint=(
+                    "Set CHATS_REALTIME_BROKER to a broker shared by all workers, "
+                    "or run a single worker process."
+                ),
+                obj="CHATS_REALTIME_BROKER",
+                id="chats.W001",
+            )
+        ]
+    return []
@@ -0,0 +1,67 @@
+"""
+Validators for conditional GETs of a conversation's messages.
+
+The ETag combines the conversation's newest message with a change marker
+(bumped in the cache on every message write, so edits and deletes are
+seen too) and the request's query string and media type. Computing it is
+one indexed ``LIMIT 1`` query, which lets an unchanged page be answered
+with ``304`` before any page query or serialization.
+
+No ``Last-Modified`` is sent: at one-second resolution it would answer
+``If-Modified-Since`` with a stale ``304`` after a second write within
+the same second.
+"""
+import hashlib
+import time
+
+from django.core.cache import cache
+from django.utils.cache import get_conditional_response
+from django.utils.http import quote_etag
+
+from .models import Message
+
+MARKER_TIMEOUT = 24 * 60 * 60
+
+
+def marker_key(conversation_id):
+    return f"chats:conversation:{conversation_id}:changed"
+
+
+def touch(conversation_id):
+    """Record that a message of ``conversation_id`` was written."""
+    cache.set(marker_key(conversation_id), time.time_ns(), MARKER_TIMEOUT)
+
+
+def change_marker(conversation_id):
+    key = marker_key(conversation_id)
+    marker = cache.get(key)
+    if marker is None:
+        # a lost marker restarts at "now": one needless full response, never a stale 304
+        cache.add(key, time.time_ns(), MARKER_TIMEOUT)
+        marker = cache.get(key) or time.time_ns()
+    return marker
+
+
+def etag(request, conversation_id):
+    """The ETag of the messages of ``conversation_id`` as ``request`` sees them."""
+    latest = (
+        Message.objects.filter(conversation_id=conversation_id)
+        .order_by("-sent_at", "-message_id")
+        .values_list("message_id", "sent_at")
+        .first()
+    )
+    marker = change_marker(conversation_id)
+    media_type = getattr(request, "accepted_media_type", "")
+    digest = hashlib.blake2b(
+        f"{latest}|{marker}|{request.get_full_path()}|{media_type}".encode(), digest_size=16
+    ).hexdigest()
+    return quote_etag(digest)
+
+
+def not_modified(request, etag):
+    """A ``304`` response if the client's copy is current, else None."""
+    return get_conditional_response(request, etag=etag)
+
+
+def http_headers(etag):
+    return {"ETag": etag, "Cache-Control": "private, no-cache"}
@@ -0,0 +1,144 @@
+"""
+Read-only serializers for list endpoints, built on ``.values()`` rows.
+
+They produce the same JSON as their DRF counterparts in
+``chats.serializers``. The database returns plain dicts, with no model
+instances, and each class builds one function that turns a row into
+an output dict. This avoids DRF's per-field, per-object dispatch on hot
+read paths. Writes and detail views keep using the DRF serializers.
+"""
+from collections import defaultdict
+
+from django.utils import timezone
+
+from .models import Conversation
+
+
+def datetime_to_json(value):
+    """DRF's ``DateTimeField`` output (ISO 8601, ``Z`` for UTC)."""
+    if value is None:
+        return None
+    text = timezone.localtime(value).isoformat()
+    return text[:-6] + "Z" if text.endswith("+00:00") else text
+
+
+def optional_str(value):
+    return None if value is None else str(value)
+
+
+def row_converter(fields):
+    """Turn ``{key: (lookup, convert)}`` into a ``row -> dict`` function."""
+    columns = tuple((key, lookup, convert) for key, (lookup, convert) in fields.items())
+
+    def to_representation(row):
+        return {
+            key: row[lookup] if convert is None else convert(row[lookup])
+            for key, lookup, convert in columns
+        }
+
+    return to_representation
+
+
+class ValuesSerializer:
+    """
+    Base class: ``fields`` maps each output key to ``(lookup, convert)``,
+    where ``lookup`` is passed to ``.values()`` and ``convert`` (or None)
+    turns the database value into its JSON form.
+    """
+
+    fields = {}
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls.lookups = tuple(lookup for lookup, _ in cls.fields.values())
+        cls.to_representation = staticmethod(row_converter(cls.fields))
+
+    @classmethod
+    def values(cls, queryset, *extra):
+        return queryset.values(*cls.lookups, *extra)
+
+    @classmethod
+    def serialize(cls, rows):
+        to_representation = cls.to_representation
+        return [to_representation(row) for row in rows]
+
+
+class MessageValuesSerializer(ValuesSerializer):
+    """Same output as ``MessageSerializer``; the sender is joined, not fetched per row."""
+
+    fields = {
+        "message_id": ("message_id", str),
+        "conversation": ("conversation_id", str),
+        "sender": ("sender__username", None),
+        "message_body": ("message_body", None),
+        "sent_at": ("sent_at", datetime_to_json),
+    }
+
+
+class ParticipantValuesSerializer(ValuesSerializer):
+    """``UserSerializer`` output, read from the participants table."""
+
+    fields = {
+        "user_id": ("user__user_id", str),
+        "username": ("user__username", None),
+        "first_name": ("user__first_name", None),
+        "last_name": ("user__last_name", None),
+        "email": ("user__email", None),
+        "phone_number": ("user__phone_number", None),
+        "role": ("user__role", None),
+    }
+
+
+class LastMessageValuesSerializer(ValuesSerializer):
+    """The ``last_message`` of a conversation annotated by ``with_last_message()``."""
+
+    fields = {
+        "message_id": ("last_message_id", optional_str),
+        "conversation": ("conversation_id", str),
+        "sender": ("last_message_sender", None),
+        "message_body": ("last_message_body", None),
+        "sent_at": ("last_message_sent_at", datetime_to_json),
+    }
+
+
+class ConversationListValuesSerializer(ValuesSerializer):
+    """
+    Same output as ``ConversationListSerializer`` for a queryset built
+    with ``with_last_message()``: two queries for any number of rows.
+    """
+
+    fields = {
+        "conversation_id": ("conversation_id", str),
+        "created_at": ("created_at", datetime_to_json),
+    }
+
+    @classmethod
+    def values(cls, queryset, *extra):
+        lookups = dict.fromkeys((*cls.lookups, *LastMessageValuesSerializer.lookups, *extra))
+        return queryset.values(*lookups)
+
+    @classmethod
+    def serialize(cls, rows):
+        rows = list(rows)
+        participants = defaultdict(list)
+        memberships = ParticipantValuesSerializer.values(
+            Conversation.participants.through.objects.filter(
+                conversation_id__in=[row["conversation_id"] for row in rows]
+            ),
+            "conversation_id",
+        )
+        for membership in memberships:
+            participants[membership["conversation_id"]].append(
+                ParticipantValuesSerializer.to_representation(membership)
+            )
+
+        last_message = LastMessageValuesSerializer.to_representation
+        return [
+            {
+                "conversation_id": str(row["conversation_id"]),
+                "participants": participants[row["conversation_id"]],
+                "created_at": datetime_to_json(row["created_at"]),
+                "last_message": None if row["last_message_id"] is None else last_message(row),
+            }
+            for row in rows
+        ]
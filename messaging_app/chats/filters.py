@@ -1,5 +1,6 @@
 import django_filters
 from .models import Message
+from .search import filter_messages
 
 class MessageFilter(django_filters.FilterSet):
     """
@@ -9,8 +10,11 @@ class MessageFilter(django_filters.FilterSet):
     # Filter messages by sender username (case-insensitive contains search)
     sender = django_filters.CharFilter(field_name="sender__username", lookup_expr="icontains")
 
+    # Filter messages by sender id (exact, served by the sender + sent_at index)
+    sender_id = django_filters.UUIDFilter(field_name="sender")
+
     # Filter messages belonging to a specific conversation (by UUID)
-    conversation = django_filters.UUIDFilter(field_name="conversation__id")
+    conversation = django_filters.UUIDFilter(field_name="conversation")
 
     # Filter messages sent after a given datetime
     sent_after = django_filters.DateTimeFilter(field_name="sent_at", lookup_expr="gte")
@@ -18,9 +22,12 @@ class MessageFilter(django_filters.FilterSet):
     # Filter messages sent before a given datetime
     sent_before = django_filters.DateTimeFilter(field_name="sent_at", lookup_expr="lte")
 
-    # Search inside the message body (case-insensitive)
-    search = django_filters.CharFilter(field_name="message_body", lookup_expr="icontains")
+    # Full-text prefix search inside the message body (see chats.search)
+    search = django_filters.CharFilter(method="filter_search")
 
     class Meta:
         model = Message
-        fields = ["sender", "conversation", "sent_after", "sent_before", "search"]
+        fields = ["sender", "sender_id", "conversation", "sent_after", "sent_before", "search"]
+
+    def filter_search(self, queryset, name, value):
+        return filter_messages(queryset, value)
@@ -0,0 +1,76 @@
+"""
+Cache of serialized messages, keyed by message id and version.
+
+A page is selected with a narrow query (id, sent_at, version). Its
+serialized messages are then fetched from the cache with a single
+``get_many``. Only the misses are loaded, serialized and stored back with
+``set_many``. Edits bump ``Message.version``, so stale fragments are
+never read; the signal handlers also delete the old fragments of edited
+and deleted messages. A renamed sender shows up in old fragments until
+``FRAGMENT_TIMEOUT`` expires them.
+
+Fragments live in the ``fragments`` cache when one is configured, so
+their volume cannot evict membership versions and change markers from
+the default cache. They are not cached at all in a ``DatabaseCache``:
+it counts its table on every write, so storing a cold page would cost
+more queries than loading the page does.
+"""
+from django.conf import settings
+from django.core.cache import DEFAULT_CACHE_ALIAS, caches
+from django.core.cache.backends.db import DatabaseCache
+from django.core.cache.backends.dummy import DummyCache
+
+from .fast_serializers import MessageValuesSerializer
+from .models import Message
+
+FRAGMENT_TIMEOUT = 24 * 60 * 60
+FRAGMENT_CACHE = "fragments"
+
+
+def fragment_cache():
+    """The cache holding fragments, or None when they are not cached."""
+    cache = caches[FRAGMENT_CACHE if FRAGMENT_CACHE in settings.CACHES else DEFAULT_CACHE_ALIAS]
+    if isinstance(cache, (DatabaseCache, DummyCache)):
+        return None
+    return cache
+
+
+def fragment_key(message_id, version):
+    return f"chats:message:{message_id}:v{version}"
+
+
+def page_values(queryset):
+    """The columns needed to paginate and to find the fragments."""
+    return queryset.values("message_id", "sent_at", "version")
+
+
+def serialize_page(rows):
+    """Serialized messages for ``page_values`` rows, in the same order."""
+    cache = fragment_cache()
+    keys = [fragment_key(row["message_id"], row["version"]) for row in rows]
+    fragments = cache.get_many(keys) if cache is not None else {}
+    missing = [row["message_id"] for row, key in zip(rows, keys) if key not in fragments]
+
+    fresh = {}
+    if missing:
+        loaded = {}
+        queryset = Message.objects.filter(message_id__in=missing)
+        for row in MessageValuesSerializer.values(queryset, "version"):
+            fresh[row["message_id"]] = MessageValuesSerializer.to_representation(row)
+            loaded[fragment_key(row["message_id"], row["version"])] = fresh[row["message_id"]]
+        if cache is not None:
+            cache.set_many(loaded, FRAGMENT_TIMEOUT)
+
+    data = []
+    for row, key in zip(rows, keys):
+        # an edit racing this request may have loaded a newer version
+        fragment = fragments.get(key) or fresh.get(row["message_id"])
+        if fragment is not None:
+            data.append(fragment)
+    return data
+
+
+def forget(message, version=None):
+    cache = fragment_cache()
+    if cache is not None:
+        cache.delete(fragment_key(message.message_id, message.version if version is None else version))
@@ -0,0 +1,39 @@
+"""Shared helpers for the benchmark management commands."""
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from chats.models import Conversation, Message, User
+
+
+class Rollback(Exception):
+    """Raised to discard the benchmark data once timings are taken."""
+
+
+class BenchmarkCommand(BaseCommand):
+    """Runs ``run(options)`` in a transaction that is always rolled back."""
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                self.run(options)
+                raise Rollback
+        except Rollback:
+            pass
+
+    def run(self, options):
+        raise NotImplementedError
+
+
+def seed_conversation(username, count):
+    """A conversation of one user holding ``count`` messages, bulk inserted."""
+    user = User.objects.create_user(username=username)
+    conversation = Conversation.objects.create()
+    conversation.participants.add(user)
+    Message.objects.bulk_create(
+        (
+            Message(sender=user, conversation=conversation, message_body=f"message {i}")
+            for i in range(count)
+        ),
+        batch_size=5000,
+    )
+    return conversation
@@ -0,0 +1,56 @@
+import statistics
+import time
+
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from chats.management.benchmark import BenchmarkCommand, seed_conversation
+from chats.models import Message
+from chats.pagination import MessageCursorPagination, MessagePagination
+
+
+class Command(BenchmarkCommand):
+    help = (
+        "Compare per-page latency of OFFSET (page number) and keyset (cursor) "
+        "pagination over one long conversation. Seeded data is rolled back."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--messages", type=int, default=200_000)
+        parser.add_argument("--pages", type=int, nargs="+", default=[1, 100, 1000, 10_000])
+        parser.add_argument("--repeat", type=int, default=5)
+
+    def time_page(self, paginator, queryset, params, repeat):
+        factory = APIRequestFactory()
+        timings = []
+        for _ in range(repeat):
+            # an allowed host, since the pagination links are absolute URLs
+            request = Request(factory.get("/api/messages/", params, SERVER_NAME="localhost"))
+            start = time.perf_counter()
+            list(paginator.paginate_queryset(queryset, request))
+            timings.append(time.perf_counter() - start)
+        return statistics.median(timings) * 1000
+
+    def run(self, options):
+        page_size = MessageCursorPagination.page_size
+        max_page = options["messages"] // page_size
+        pages = [page for page in options["pages"] if page <= max_page]
+        self.stdout.write(f"Seeding {options['messages']:,} messages...")
+        conversation = seed_conversation("bench-pagination", options["messages"])
+        queryset = Message.objects.filter(conversation=conversation)
+        ordered = queryset.order_by("-sent_at", "-message_id")
+
+        self.stdout.write(f"{'page':>8} {'offset ms':>12} {'keyset ms':>12}")
+        for page in pages:
+            offset_ms = self.time_page(
+                MessagePagination(), ordered, {"page": page}, options["repeat"]
+            )
+            keyset_params = {}
+            if page > 1:
+                # cursor a client would hold after scrolling to this page
+                last_seen = ordered[(page - 1) * page_size - 1]
+                keyset_params = {"cursor": MessageCursorPagination.cursor_token(last_seen)}
+            keyset_ms = self.time_page(
+                MessageCursorPagination(), queryset, keyset_params, options["repeat"]
+            )
+            self.stdout.write(f"{page:>8} {offset_ms:>12.2f} {keyset_ms:>12.2f}")
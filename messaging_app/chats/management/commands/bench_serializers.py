@@ -0,0 +1,73 @@
+import statistics
+import time
+
+from rest_framework.renderers import JSONRenderer
+
+from chats.fast_serializers import MessageValuesSerializer
+from chats.management.benchmark import BenchmarkCommand, seed_conversation
+from chats.models import Message
+from chats.renderers import FastJSONRenderer, orjson
+from chats.serializers import MessageSerializer
+
+
+class Command(BenchmarkCommand):
+    help = (
+        "Compare messages/sec serialized and rendered by MessageSerializer + "
+        "JSONRenderer and by the .values() serializers + FastJSONRenderer. "
+        "Seeded data is rolled back."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--messages", type=int, default=20_000)
+        parser.add_argument("--repeat", type=int, default=5)
+
+    def measure(self, serialize, renderer, repeat):
+        """Median seconds to (query and) serialize, and to render."""
+        serialize_times, render_times = [], []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            data = serialize()
+            middle = time.perf_counter()
+            renderer.render(data)
+            serialize_times.append(middle - start)
+            render_times.append(time.perf_counter() - middle)
+        return statistics.median(serialize_times), statistics.median(render_times)
+
+    def run(self, options):
+        count = options["messages"]
+        self.stdout.write(f"Seeding {count:,} messages...")
+        conversation = seed_conversation("bench-serializers", count)
+        messages = Message.objects.filter(conversation=conversation).order_by(
+            "-sent_at", "-message_id"
+        )
+
+        variants = {
+            # select_related keeps the stock serializer from issuing a query per sender
+            "MessageSerializer + JSONRenderer": (
+                lambda: MessageSerializer(messages.select_related("sender"), many=True).data,
+                JSONRenderer(),
+            ),
+            "values() + JSONRenderer": (
+                lambda: MessageValuesSerializer.serialize(MessageValuesSerializer.values(messages)),
+                JSONRenderer(),
+            ),
+            "values() + FastJSONRenderer": (
+                lambda: MessageValuesSerializer.serialize(MessageValuesSerializer.values(messages)),
+                FastJSONRenderer(),
+            ),
+        }
+        if orjson is None:
+            self.stdout.write("orjson is not installed: FastJSONRenderer uses the stock encoder")
+
+        self.stdout.write(
+            f"{'variant':<34} {'serialize/s':>14} {'render/s':>14} {'total/s':>14} {'speedup':>8}"
+        )
+        baseline = None
+        for name, (serialize, renderer) in variants.items():
+            serialize_s, render_s = self.measure(serialize, renderer, options["repeat"])
+            total = count / (serialize_s + render_s)
+            baseline = baseline or total
+            self.stdout.write(
+                f"{name:<34} {count / serialize_s:>14,.0f} {count / render_s:>14,.0f} "
+                f"{total:>14,.0f} {total / baseline:>7.1f}x"
+            )
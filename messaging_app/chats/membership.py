@@ -0,0 +1,58 @@
+"""
+Cached conversation membership.
+
+Each user's conversation ids are cached as one frozenset under a key that
+includes a per-user version number. Changing a user's participants bumps
+the version (see ``chats.signals``), so stale sets are never read again
+and simply expire.
+"""
+import time
+import uuid
+
+from django.core.cache import cache
+
+from .models import Conversation
+
+MEMBERSHIP_TIMEOUT = 60 * 60
+
+
+def version_key(user_id):
+    return f"chats:membership:{user_id}:version"
+
+
+def membership_version(user_id):
+    version = cache.get(version_key(user_id))
+    if version is None:
+        # never restart from a small number: an evicted version key must not
+        # resurrect a set cached under an older version
+        cache.add(version_key(user_id), time.time_ns(), None)
+        version = cache.get(version_key(user_id))
+    return version
+
+
+def conversation_ids(user_id):
+    """Ids of the conversations ``user_id`` takes part in, from the cache if possible."""
+    key = f"chats:membership:{user_id}:{membership_version(user_id)}"
+    ids = cache.get(key)
+    if ids is None:
+        ids = frozenset(
+            Conversation.participants.through.objects.filter(user_id=user_id).values_list(
+                "conversation_id", flat=True
+            )
+        )
+        cache.set(key, ids, MEMBERSHIP_TIMEOUT)
+    return ids
+
+
+def is_participant(user, conversation_id):
+    if not isinstance(conversation_id, uuid.UUID):
+        conversation_id = uuid.UUID(str(conversation_id))
+    return conversation_id in conversation_ids(user.pk)
+
+
+def invalidate(user_ids):
+    for user_id in user_ids:
+        try:
+            cache.incr(version_key(user_id))
+        except ValueError:
+            cache.add(version_key(user_id), time.time_ns(), None)
@@ -0,0 +1,56 @@
+# Generated by Django 5.2.7 on 2026-10-18 04:05
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def backfill_inbox(apps, schema_editor):
+    Conversation = apps.get_model("chats", "Conversation")
+    InboxEntry = apps.get_model("chats", "InboxEntry")
+    Message = apps.get_model("chats", "Message")
+    for conversation in Conversation.objects.prefetch_related("participants").iterator(chunk_size=500):
+        last = (
+            Message.objects.filter(conversation=conversation)
+            .order_by("-sent_at", "-message_id")
+            .first()
+        )
+        InboxEntry.objects.bulk_create(
+            [
+                InboxEntry(
+                    user=user,
+                    conversation=conversation,
+                    last_message=last,
+                    last_activity_at=last.sent_at if last else conversation.created_at,
+                )
+                for user in conversation.participants.all()
+            ],
+            ignore_conflicts=True,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chats', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InboxEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('last_activity_at', models.DateTimeField()),
+                ('last_read_at', models.DateTimeField(blank=True, null=True)),
+                ('unread_count', models.PositiveIntegerField(default=0)),
+                ('conversation', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='inbox_entries', to='chats.conversation')),
+                ('last_message', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='chats.message')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='inbox_entries', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user', '-last_activity_at'], name='inbox_user_activity_idx')],
+                'constraints': [models.UniqueConstraint(fields=('user', 'conversation'), name='unique_inbox_entry')],
+            },
+        ),
+        migrations.RunPython(backfill_inbox, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.2.7 on 2026-10-18 04:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chats', '0002_inbox_entry'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['conversation', '-sent_at', '-message_id'], name='msg_conversation_sent_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['sender', 'sent_at'], name='msg_sender_sent_idx'),
+        ),
+    ]
@@ -0,0 +1,65 @@
+from django.db import migrations
+
+SQLITE_CREATE = [
+    "CREATE VIRTUAL TABLE chats_message_fts USING fts5("
+    "message_body, content='chats_message', content_rowid='rowid', "
+    "tokenize='unicode61 remove_diacritics 2', prefix='2 3')",
+    "CREATE TRIGGER chats_message_fts_insert AFTER INSERT ON chats_message BEGIN "
+    "INSERT INTO chats_message_fts(rowid, message_body) VALUES (new.rowid, new.message_body); "
+    "END",
+    "CREATE TRIGGER chats_message_fts_delete AFTER DELETE ON chats_message BEGIN "
+    "INSERT INTO chats_message_fts(chats_message_fts, rowid, message_body) "
+    "VALUES ('delete', old.rowid, old.message_body); "
+    "END",
+    "CREATE TRIGGER chats_message_fts_update AFTER UPDATE OF message_body ON chats_message BEGIN "
+    "INSERT INTO chats_message_fts(chats_message_fts, rowid, message_body) "
+    "VALUES ('delete', old.rowid, old.message_body); "
+    "INSERT INTO chats_message_fts(rowid, message_body) VALUES (new.rowid, new.message_body); "
+    "END",
+    # index the messages that already exist
+    "INSERT INTO chats_message_fts(chats_message_fts) VALUES ('rebuild')",
+]
+
+SQLITE_DROP = [
+    "DROP TRIGGER IF EXISTS chats_message_fts_insert",
+    "DROP TRIGGER IF EXISTS chats_message_fts_delete",
+    "DROP TRIGGER IF EXISTS chats_message_fts_update",
+    "DROP TABLE IF EXISTS chats_message_fts",
+]
+
+
+def sqlite_has_fts5(connection):
+    with connection.cursor() as cursor:
+        cursor.execute("PRAGMA compile_options")
+        return any(option == "ENABLE_FTS5" for option, in cursor.fetchall())
+
+
+def create_search_index(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor == "mysql":
+        schema_editor.execute(
+            "ALTER TABLE chats_message ADD FULLTEXT INDEX msg_body_fulltext (message_body)"
+        )
+    elif connection.vendor == "sqlite" and sqlite_has_fts5(connection):
+        for statement in SQLITE_CREATE:
+            schema_editor.execute(statement)
+
+
+def drop_search_index(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor == "mysql":
+        schema_editor.execute("ALTER TABLE chats_message DROP INDEX msg_body_fulltext")
+    elif connection.vendor == "sqlite":
+        for statement in SQLITE_DROP:
+            schema_editor.execute(statement)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("chats", "0003_message_access_path_indexes"),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,51 @@
+# Generated by Django 5.2.7 on 2026-10-18 04:17
+
+from django.db import migrations, models
+
+# the rowid-keyed triggers of 0004, as they were when this migration ran
+SQLITE_TRIGGERS = [
+    "DROP TRIGGER IF EXISTS chats_message_fts_insert",
+    "DROP TRIGGER IF EXISTS chats_message_fts_delete",
+    "DROP TRIGGER IF EXISTS chats_message_fts_update",
+    "CREATE TRIGGER chats_message_fts_insert AFTER INSERT ON chats_message BEGIN "
+    "INSERT INTO chats_message_fts(rowid, message_body) VALUES (new.rowid, new.message_body); "
+    "END",
+    "CREATE TRIGGER chats_message_fts_delete AFTER DELETE ON chats_message BEGIN "
+    "INSERT INTO chats_message_fts(chats_message_fts, rowid, message_body) "
+    "VALUES ('delete', old.rowid, old.message_body); "
+    "END",
+    "CREATE TRIGGER chats_message_fts_update AFTER UPDATE OF message_body ON chats_message BEGIN "
+    "INSERT INTO chats_message_fts(chats_message_fts, rowid, message_body) "
+    "VALUES ('delete', old.rowid, old.message_body); "
+    "INSERT INTO chats_message_fts(rowid, message_body) VALUES (new.rowid, new.message_body); "
+    "END",
+    "INSERT INTO chats_message_fts(chats_message_fts) VALUES ('rebuild')",
+]
+
+
+def reinstall_search_triggers(apps, schema_editor):
+    # SQLite adds the column by rebuilding chats_message, which drops the
+    # FTS triggers and renumbers rowids: recreate them and reindex
+    connection = schema_editor.connection
+    if connection.vendor != "sqlite":
+        return
+    if "chats_message_fts" not in connection.introspection.table_names():
+        return
+    for statement in SQLITE_TRIGGERS:
+        schema_editor.execute(statement)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chats', '0004_message_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='version',
+            field=models.PositiveIntegerField(default=1, editable=False),
+        ),
+        migrations.RunPython(reinstall_search_triggers, migrations.RunPython.noop),
+    ]
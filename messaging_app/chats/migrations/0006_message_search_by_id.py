@@ -0,0 +1,96 @@
+from django.db import migrations
+
+# A regular FTS5 table keyed by message_id instead of an external-content
+# table keyed by chats_message's implicit rowid, which VACUUM and every
+# table rebuild renumber. message_id is a tokenized column so the triggers
+# find a message's row through the full-text index rather than a scan;
+# searches restrict MATCH to message_body.
+SQLITE_TABLE = (
+    "CREATE VIRTUAL TABLE chats_message_fts USING fts5("
+    "message_id, message_body, "
+    "tokenize='unicode61 remove_diacritics 2', prefix='2 3')"
+)
+
+# chats.search.SQLITE_TRIGGERS repeats these and reinstalls them after every
+# migrate, since SQLite table rebuilds drop the triggers of the rebuilt table
+SQLITE_TRIGGERS = [
+    "CREATE TRIGGER IF NOT EXISTS chats_message_fts_insert AFTER INSERT ON chats_message BEGIN "
+    "INSERT INTO chats_message_fts(message_id, message_body) "
+    "VALUES (new.message_id, new.message_body); "
+    "END",
+    "CREATE TRIGGER IF NOT EXISTS chats_message_fts_delete AFTER DELETE ON chats_message BEGIN "
+    "DELETE FROM chats_message_fts "
+    "WHERE chats_message_fts MATCH 'message_id:\"' || old.message_id || '\"'; "
+    "END",
+    "CREATE TRIGGER IF NOT EXISTS chats_message_fts_update "
+    "AFTER UPDATE OF message_body ON chats_message BEGIN "
+    "UPDATE chats_message_fts SET message_body = new.message_body "
+    "WHERE chats_message_fts MATCH 'message_id:\"' || old.message_id || '\"'; "
+    "END",
+]
+
+# index the messages that already exist
+SQLITE_POPULATE = (
+    "INSERT INTO chats_message_fts(message_id, message_body) "
+    "SELECT message_id, message_body FROM chats_message"
+)
+
+SQLITE_DROP = [
+    "DROP TRIGGER IF EXISTS chats_message_fts_insert",
+    "DROP TRIGGER IF EXISTS chats_message_fts_delete",
+    "DROP TRIGGER IF EXISTS chats_message_fts_update",
+    "DROP TABLE IF EXISTS chats_message_fts",
+]
+
+# the rowid-keyed index of 0004, restored when unapplying
+SQLITE_ROWID_INDEX = [
+    "CREATE VIRTUAL TABLE chats_message_fts USING fts5("
+    "message_body, content='chats_message', content_rowid='rowid', "
+    "tokenize='unicode61 remove_diacritics 2', prefix='2 3')",
+    "CREATE TRIGGER chats_message_fts_insert AFTER INSERT ON chats_message BEGIN "
+    "INSERT INTO chats_message_fts(rowid, message_body) VALUES (new.rowid, new.message_body); "
+    "END",
+    "CREATE TRIGGER chats_message_fts_delete AFTER DELETE ON chats_message BEGIN "
+    "INSERT INTO chats_message_fts(chats_message_fts, rowid, message_body) "
+    "VALUES ('delete', old.rowid, old.message_body); "
+    "END",
+    "CREATE TRIGGER chats_message_fts_update AFTER UPDATE OF message_body ON chats_message BEGIN "
+    "INSERT INTO chats_message_fts(chats_message_fts, rowid, message_body) "
+    "VALUES ('delete', old.rowid, old.message_body); "
+    "INSERT INTO chats_message_fts(rowid, message_body) VALUES (new.rowid, new.message_body); "
+    "END",
+    "INSERT INTO chats_message_fts(chats_message_fts) VALUES ('rebuild')",
+]
+
+
+def sqlite_has_fts5(connection):
+    with connection.cursor() as cursor:
+        cursor.execute("PRAGMA compile_options")
+        return any(option == "ENABLE_FTS5" for option, in cursor.fetchall())
+
+
+def key_search_index_by_id(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor != "sqlite" or not sqlite_has_fts5(connection):
+        return
+    for statement in [*SQLITE_DROP, SQLITE_TABLE, *SQLITE_TRIGGERS, SQLITE_POPULATE]:
+        schema_editor.execute(statement)
+
+
+def key_search_index_by_rowid(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor != "sqlite" or not sqlite_has_fts5(connection):
+        return
+    for statement in SQLITE_DROP + SQLITE_ROWID_INDEX:
+        schema_editor.execute(statement)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("chats", "0005_message_version"),
+    ]
+
+    operations = [
+        migrations.RunPython(key_search_index_by_id, key_search_index_by_rowid),
+    ]
@@ -23,6 +23,37 @@ class User(AbstractUser):
     def __str__(self):
         return self.username
 
+def participant_of(user, conversation):
+    """``Exists`` subquery: is ``user`` a participant of ``conversation`` (an OuterRef)?"""
+    return models.Exists(
+        Conversation.participants.through.objects.filter(
+            conversation_id=conversation, user_id=user.pk
+        )
+    )
+
+
+class ConversationQuerySet(models.QuerySet):
+    def with_membership(self, user):
+        """Annotate ``is_participant`` so loading and authorizing take one query."""
+        return self.annotate(is_participant=participant_of(user, models.OuterRef("pk")))
+
+    def with_last_message(self):
+        """
+        Annotate each conversation with its newest message's id, body,
+        timestamp and sender username, computed by correlated subqueries
+        instead of one extra query per conversation.
+        """
+        latest = Message.objects.filter(conversation=models.OuterRef("pk")).order_by(
+            "-sent_at", "-message_id"
+        )
+        return self.annotate(
+            last_message_id=models.Subquery(latest.values("message_id")[:1]),
+            last_message_body=models.Subquery(latest.values("message_body")[:1]),
+            last_message_sent_at=models.Subquery(latest.values("sent_at")[:1]),
+            last_message_sender=models.Subquery(latest.values("sender__username")[:1]),
+        )
+
+
 class Conversation(models.Model):
     """
     Tracks which users are involved in a conversation.
@@ -33,10 +64,30 @@ class Conversation(models.Model):
     participants = models.ManyToManyField(User, related_name="conversations")
     created_at = models.DateTimeField(auto_now_add=True)
 
+    objects = ConversationQuerySet.as_manager()
+
     def __str__(self):
         return f"Conversation {self.conversation_id}"
 
 
+class MessageQuerySet(models.QuerySet):
+    def update(self, **kwargs):
+        """
+        Bump ``version`` with every bulk edit so cached serializations of
+        the rows are never read again. ``update`` sends no signals, so
+        callers changing what a page shows must also call
+        ``chats.signals.touch_conversations``.
+        """
+        kwargs.setdefault("version", models.F("version") + 1)
+        return super().update(**kwargs)
+
+    def with_membership(self, user):
+        """Annotate ``is_participant`` for the message's conversation."""
+        return self.annotate(
+            is_participant=participant_of(user, models.OuterRef("conversation_id"))
+        )
+
+
 class Message(models.Model):
     """
     Represents a single message within a conversation.
@@ -51,9 +102,72 @@ class Message(models.Model):
     )
     message_body = models.TextField()
     sent_at = models.DateTimeField(auto_now_add=True)
+    # bumped on every edit; cached serializations are keyed by it (chats.fragments)
+    version = models.PositiveIntegerField(default=1, editable=False)
+
+    objects = MessageQuerySet.as_manager()
 
     def __str__(self):
         return f"Message from {self.sender} at {self.sent_at}"
 
+    def save(self, *args, **kwargs):
+        edited = not self._state.adding
+        if edited:
+            # incremented by the UPDATE itself, so concurrent edits of a
+            # stale instance still each get a version of their own
+            self.version = models.F("version") + 1
+            update_fields = kwargs.get("update_fields")
+            if update_fields is not None:
+                kwargs["update_fields"] = {*update_fields, "version"}
+        super().save(*args, **kwargs)
+        if edited:
+            self.refresh_version()
+
+    def refresh_version(self):
+        """Replace the pending ``F("version") + 1`` with the value saved."""
+        if isinstance(self.version, models.Expression):
+            self.refresh_from_db(fields=["version"])
+
     class Meta:
         ordering = ["-sent_at"]
+        indexes = [
+            # message lists: WHERE conversation = ? ORDER BY sent_at DESC, message_id DESC
+            models.Index(
+                fields=["conversation", "-sent_at", "-message_id"], name="msg_conversation_sent_idx"
+            ),
+            # sender filters, optionally bounded by sent_after / sent_before
+            models.Index(fields=["sender", "sent_at"], name="msg_sender_sent_idx"),
+        ]
+
+
+class InboxEntry(models.Model):
+    """
+    One row per (participant, conversation): a denormalized inbox kept up
+    to date by the signal handlers in ``chats.signals``.
+
+    A user's inbox is read newest first with a single range scan over the
+    ``(user, -last_activity_at)`` index, instead of joining participants
+    and looking up the last message of every conversation.
+    """
+
+    user = models.ForeignKey(User, related_name="inbox_entries", on_delete=models.CASCADE)
+    conversation = models.ForeignKey(
+        Conversation, related_name="inbox_entries", on_delete=models.CASCADE
+    )
+    last_message = models.ForeignKey(
+        Message, related_name="+", null=True, blank=True, on_delete=models.SET_NULL
+    )
+    last_activity_at = models.DateTimeField()
+    last_read_at = models.DateTimeField(null=True, blank=True)
+    unread_count = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f"Inbox of {self.user} for {self.conversation}"
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["user", "conversation"], name="unique_inbox_entry")
+        ]
+        indexes = [
+            models.Index(fields=["user", "-last_activity_at"], name="inbox_user_activity_idx")
+        ]
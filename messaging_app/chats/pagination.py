@@ -1,5 +1,15 @@
-from rest_framework.pagination import PageNumberPagination
+import base64
+import binascii
+import json
+import uuid
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
 from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
 
 class MessagePagination(PageNumberPagination):
     page_size = 20
@@ -10,4 +20,158 @@ class MessagePagination(PageNumberPagination):
             'next': self.get_next_link(),
             'previous': self.get_previous_link(),
             'results': data
-        })
\ No newline at end of file
+        })
+
+
+def before(sent_at, message_id):
+    """
+    ``(sent_at, message_id) < (cursor)``. The leading ``sent_at <=`` bound
+    is implied by the OR, but lets the database seek the index to the
+    cursor instead of scanning the conversation's messages up to it.
+    """
+    return Q(sent_at__lte=sent_at) & (
+        Q(sent_at__lt=sent_at) | Q(sent_at=sent_at, message_id__lt=message_id)
+    )
+
+
+def after(sent_at, message_id):
+    """``(sent_at, message_id) > (cursor)``, bounded like ``before``."""
+    return Q(sent_at__gte=sent_at) & (
+        Q(sent_at__gt=sent_at) | Q(sent_at=sent_at, message_id__gt=message_id)
+    )
+
+
+class MessageCursorPagination(BasePagination):
+    """
+    Keyset pagination over messages, newest first.
+
+    Pages are selected with ``WHERE (sent_at, message_id) < (cursor)``
+    instead of OFFSET, so page 10,000 costs the same as page 1, and
+    messages arriving while a client scrolls never shift or repeat rows.
+    Cursors are opaque base64 tokens. The total ``count`` is only computed
+    when the client asks for it with ``?count=true``.
+
+    The first page also carries a ``since`` token for its newest message;
+    ``paginate_since`` returns what arrived after such a token, oldest
+    first, for clients that poll for new messages.
+    """
+
+    page_size = 20
+    max_page_size = 100
+    page_size_query_param = "page_size"
+    cursor_query_param = "cursor"
+    since_query_param = "since"
+    count_query_param = "count"
+    invalid_cursor_message = "Invalid cursor"
+
+    @staticmethod
+    def cursor_token(message, reverse=False):
+        """Opaque token for the position just past ``message`` (an instance or ``.values()`` row)."""
+        if isinstance(message, dict):
+            sent_at, message_id = message["sent_at"], message["message_id"]
+        else:
+            sent_at, message_id = message.sent_at, message.message_id
+        position = {"t": sent_at.isoformat(), "id": str(message_id), "r": int(reverse)}
+        return base64.urlsafe_b64encode(json.dumps(position).encode()).decode().rstrip("=")
+
+    def encode_cursor(self, message, reverse=False):
+        return replace_query_param(
+            self.request.build_absolute_uri(),
+            self.cursor_query_param,
+            self.cursor_token(message, reverse),
+        )
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        return self.decode_token(encoded)
+
+    def decode_token(self, encoded):
+        try:
+            padded = encoded + "=" * (-len(encoded) % 4)
+            position = json.loads(base64.urlsafe_b64decode(padded.encode()))
+            sent_at = parse_datetime(position["t"])
+            message_id = uuid.UUID(position["id"])
+            reverse = bool(position.get("r"))
+        except (binascii.Error, ValueError, KeyError, TypeError):
+            raise NotFound(self.invalid_cursor_message)
+        if sent_at is None:
+            raise NotFound(self.invalid_cursor_message)
+        return sent_at, message_id, reverse
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return max(1, min(size, self.max_page_size))
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        page_size = self.get_page_size(request)
+        cursor = self.decode_cursor(request)
+
+        self.count = None
+        if request.query_params.get(self.count_query_param) in ("1", "true", "True"):
+            self.count = queryset.count()
+
+        reverse = False
+        queryset = queryset.order_by("-sent_at", "-message_id")
+        if cursor is not None:
+            sent_at, message_id, reverse = cursor
+            if reverse:
+                # walking back towards newer messages
+                queryset = queryset.filter(after(sent_at, message_id)).order_by(
+                    "sent_at", "message_id"
+                )
+            else:
+                queryset = queryset.filter(before(sent_at, message_id))
+
+        rows = list(queryset[: page_size + 1])
+        has_more = len(rows) > page_size
+        rows = rows[:page_size]
+        if reverse:
+            rows.reverse()
+
+        # older messages follow the last row, newer ones precede the first
+        self.next_link = None
+        self.previous_link = None
+        self.since = None
+        if rows and cursor is None:
+            self.since = self.cursor_token(rows[0])
+        if rows:
+            if has_more or reverse:
+                self.next_link = self.encode_cursor(rows[-1])
+            if cursor is not None and (has_more or not reverse):
+                self.previous_link = self.encode_cursor(rows[0], reverse=True)
+        return rows
+
+    def paginate_since(self, queryset, request, token):
+        """Messages newer than the position in ``token``, oldest first."""
+        self.request = request
+        self.count = None
+        self.next_link = None
+        self.previous_link = None
+        sent_at, message_id, _ = self.decode_token(token)
+        rows = list(
+            queryset.filter(after(sent_at, message_id)).order_by("sent_at", "message_id")[
+                : self.get_page_size(request)
+            ]
+        )
+        self.since = self.cursor_token(rows[-1]) if rows else token
+        return rows
+
+    def get_next_link(self):
+        return self.next_link
+
+    def get_previous_link(self):
+        return self.previous_link
+
+    def get_paginated_response(self, data):
+        body = {"next": self.next_link, "previous": self.previous_link, "results": data}
+        if self.count is not None:
+            body = {"count": self.count, **body}
+        if self.since is not None:
+            body["since"] = self.since
+        return Response(body)
@@ -1,8 +1,14 @@
 from rest_framework import permissions
 
+from . import membership
+
 class IsParticipantOfConversation(permissions.BasePermission):
     """
     Custom permission to only allow participants of a conversation to access it.
+
+    Objects loaded with ``with_membership(user)`` carry an ``is_participant``
+    annotation and are checked without a query; anything else is checked
+    against the user's cached conversation ids.
     """
     def has_permission(self, request, view):
         return request.user and request.user.is_authenticated
@@ -12,9 +18,13 @@ class IsParticipantOfConversation(permissions.BasePermission):
             return False
 
         if request.method in [*permissions.SAFE_METHODS, "PUT", "PATCH", "DELETE"]:
+            is_participant = getattr(obj, "is_participant", None)
+            if is_participant is not None:
+                return is_participant
+
             if not hasattr(obj, 'participants'):
                 return False
 
-            return obj.participants.filter(id=request.user.id).exists()
+            return membership.is_participant(request.user, obj.pk)
         
         return True
\ No newline at end of file
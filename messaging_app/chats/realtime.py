@@ -0,0 +1,563 @@
+"""
+Push new messages to connected participants over WebSockets or SSE.
+
+``hub`` fans events out to the connections held by this process. Events
+reach it through a broker: ``InMemoryBroker`` delivers straight to the hub
+and is enough for a single process and for tests; deployments running
+several ASGI processes plug in a shared transport (Redis pub/sub, ...)
+with the ``CHATS_REALTIME_BROKER`` setting.
+
+Endpoints, both authenticated with a JWT access token in the
+``Authorization: Bearer`` header or a ``token`` query parameter:
+
+* ``ws://.../ws/conversations/<id>/`` sends one text frame per event.
+* ``GET /api/conversations/<id>/events/`` is a ``text/event-stream``.
+
+Long polls of the message list (``?since=``) also wait here, on the event
+loop, rather than in the view; see ``RealtimeRouter.long_poll``.
+
+Membership is checked when a stream opens, again whenever the
+conversation's participants change and every ``KEEPALIVE_SECONDS``; a
+stream whose user is no longer a participant is closed.
+"""
+import abc
+import asyncio
+import json
+import re
+import threading
+import uuid
+from collections import defaultdict
+from contextlib import asynccontextmanager, contextmanager
+from urllib.parse import parse_qs, urlencode
+
+from asgiref.sync import SyncToAsync
+from django.conf import settings
+from django.db import connections, transaction
+from django.http.request import split_domain_port, validate_host
+from django.utils.module_loading import import_string
+from rest_framework.utils.encoders import JSONEncoder
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+
+from . import membership
+
+KEEPALIVE_SECONDS = 15
+PARTICIPANTS_CHANGED = "participants.changed"
+LONG_POLL_DEFAULT_WAIT = 25
+LONG_POLL_MAX_WAIT = 30
+
+
+def close_old_connections():
+    """
+    ``django.db.close_old_connections`` for code running outside the
+    request cycle. Connections inside an atomic block are left alone: they
+    belong to a caller's transaction (e.g. a test case), not to us.
+    """
+    for connection in connections.all(initialized_only=True):
+        if not connection.in_atomic_block:
+            connection.close_if_unusable_or_obsolete()
+
+
+class DatabaseSyncToAsync(SyncToAsync):
+    """
+    ``sync_to_async`` for database access from the ASGI router: like
+    Channels' ``database_sync_to_async``, it drops unusable or expired
+    connections (``CONN_MAX_AGE``, a server-side ``wait_timeout``) before
+    and after each call, as Django does around every request.
+    """
+
+    def thread_handler(self, loop, *args, **kwargs):
+        close_old_connections()
+        try:
+            return super().thread_handler(loop, *args, **kwargs)
+        finally:
+            close_old_connections()
+
+
+database_sync_to_async = DatabaseSyncToAsync
+
+
+class Broker(abc.ABC):
+    """
+    Transport carrying events between processes.
+
+    ``publish`` may be called from any thread. ``start`` is called once
+    with the local hub's ``deliver`` callback, which must then receive
+    every event published by any process.
+    """
+
+    @abc.abstractmethod
+    def start(self, deliver):
+        ...
+
+    @abc.abstractmethod
+    def publish(self, channel, event):
+        ...
+
+    def has_listeners(self, channel):
+        """
+        False when no process can be listening on ``channel``, so
+        publishers may skip building the event. Brokers that cannot tell
+        (other processes are out of sight) answer True.
+        """
+        return True
+
+    def stop(self):
+        pass
+
+
+class InMemoryBroker(Broker):
+    """Single-process broker: publishing is delivering."""
+
+    def __init__(self):
+        self._deliver = None
+
+    def start(self, deliver):
+        self._deliver = deliver
+
+    def publish(self, channel, event):
+        if self._deliver is not None:
+            self._deliver(channel, event)
+
+    def has_listeners(self, channel):
+        # every listener is in this process
+        return hub.has_listeners(channel)
+
+    def stop(self):
+        self._deliver = None
+
+
+class Subscription:
+    """
+    Events of one channel for one connection.
+
+    The queue is bounded: a consumer that falls ``max_pending`` events
+    behind loses the oldest ones rather than growing memory without limit.
+    """
+
+    def __init__(self, loop, max_pending):
+        self.loop = loop
+        self.queue = asyncio.Queue(max_pending)
+        self.dropped = 0
+
+    def push(self, event):
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.dropped += 1
+        self.queue.put_nowait(event)
+
+    async def get(self):
+        return await self.queue.get()
+
+
+class Hub:
+    """
+    In-process fan-out from channels to subscribed connections, and to
+    blocked threads waiting for the next event (long polls).
+    """
+
+    def __init__(self, max_pending=100):
+        self.max_pending = max_pending
+        self._subscribers = defaultdict(set)
+        self._waiters = defaultdict(set)
+        self._lock = threading.Lock()
+
+    def deliver(self, channel, event):
+        """Hand ``event`` to every local subscriber of ``channel``; thread-safe."""
+        with self._lock:
+            subscribers = list(self._subscribers.get(channel, ()))
+            for waiter in self._waiters.get(channel, ()):
+                waiter.set()
+        for subscription in subscribers:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.push, event)
+            except RuntimeError:
+                # the connection's event loop is already closed
+                pass
+
+    def subscriber_count(self, channel):
+        with self._lock:
+            return len(self._subscribers.get(channel, ()))
+
+    def has_listeners(self, channel):
+        """Whether a connection or a long poll of this process waits on ``channel``."""
+        with self._lock:
+            return bool(self._subscribers.get(channel) or self._waiters.get(channel))
+
+    @asynccontextmanager
+    async def subscribe(self, channel):
+        subscription = Subscription(asyncio.get_running_loop(), self.max_pending)
+        with self._lock:
+            self._subscribers[channel].add(subscription)
+        try:
+            yield subscription
+        finally:
+            with self._lock:
+                subscribers = self._subscribers.get(channel)
+                if subscribers is not None:
+                    subscribers.discard(subscription)
+                    if not subscribers:
+                        del self._subscribers[channel]
+
+    @contextmanager
+    def waiter(self, channel):
+        """A ``threading.Event`` set by the next event on ``channel``."""
+        event = threading.Event()
+        with self._lock:
+            self._waiters[channel].add(event)
+        try:
+            yield event
+        finally:
+            with self._lock:
+                waiters = self._waiters.get(channel)
+                if waiters is not None:
+                    waiters.discard(event)
+                    if not waiters:
+                        del self._waiters[channel]
+
+
+hub = Hub()
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def get_broker():
+    global _broker
+    with _broker_lock:
+        if _broker is None:
+            path = getattr(settings, "CHATS_REALTIME_BROKER", "chats.realtime.InMemoryBroker")
+            _broker = import_string(path)()
+            _broker.start(hub.deliver)
+        return _broker
+
+
+def conversation_channel(conversation_id):
+    return f"conversation:{conversation_id}"
+
+
+def publish_messages(messages):
+    """
+    Announce newly created messages once the current transaction commits.
+
+    Messages are serialized after the commit and only for channels the
+    broker may have listeners on, so writes that are rolled back or that
+    nobody is watching (most bulk sends) cost no serialization.
+    """
+    from .serializers import MessageSerializer
+
+    messages = list(messages)
+
+    def send():
+        broker = get_broker()
+        for message in messages:
+            channel = conversation_channel(message.conversation_id)
+            if not broker.has_listeners(channel):
+                continue
+            event = json.dumps(
+                {"type": "message.created", "message": MessageSerializer(message).data},
+                cls=JSONEncoder,
+            )
+            broker.publish(channel, event)
+
+    transaction.on_commit(send)
+
+
+def publish_participants_changed(conversation_ids):
+    """Tell open streams of ``conversation_ids`` to re-check membership once committed."""
+    events = [
+        (conversation_channel(conversation_id), json.dumps({"type": PARTICIPANTS_CHANGED}))
+        for conversation_id in conversation_ids
+    ]
+
+    def send():
+        broker = get_broker()
+        for channel, event in events:
+            broker.publish(channel, event)
+
+    transaction.on_commit(send)
+
+
+def is_membership_event(event):
+    return json.loads(event).get("type") == PARTICIPANTS_CHANGED
+
+
+def long_poll_wait(value):
+    """Seconds a long poll may wait for ``?wait=value``, within ``LONG_POLL_MAX_WAIT``."""
+    try:
+        wait = LONG_POLL_DEFAULT_WAIT if value is None else float(value)
+    except ValueError:
+        wait = LONG_POLL_DEFAULT_WAIT
+    return max(0.0, min(wait, LONG_POLL_MAX_WAIT))
+
+
+def host_allowed(scope):
+    """
+    ``HttpRequest.get_host``'s ``ALLOWED_HOSTS`` check for the push
+    endpoints, which never reach Django's request handling.
+    """
+    host = dict(scope.get("headers", ())).get(b"host", b"").decode("latin-1")
+    if not host and scope.get("server"):
+        host = "%s:%s" % tuple(scope["server"])
+    allowed_hosts = settings.ALLOWED_HOSTS
+    if settings.DEBUG and not allowed_hosts:
+        allowed_hosts = [".localhost", "127.0.0.1", "[::1]"]
+    domain, _ = split_domain_port(host)
+    return bool(domain) and validate_host(domain, allowed_hosts)
+
+
+async def authenticate(scope):
+    """The user for the JWT in the request headers or query string, or None."""
+    raw = None
+    for name, value in scope.get("headers", ()):
+        if name == b"authorization":
+            parts = value.split()
+            if len(parts) == 2 and parts[0].decode() in settings.SIMPLE_JWT["AUTH_HEADER_TYPES"]:
+                raw = parts[1]
+    if raw is None:
+        raw = parse_qs(scope.get("query_string", b"").decode()).get("token", [None])[0]
+    if not raw:
+        return None
+    auth = JWTAuthentication()
+    try:
+        return await database_sync_to_async(auth.get_user)(auth.get_validated_token(raw))
+    except (InvalidToken, AuthenticationFailed):
+        return None
+
+
+async def wait_for_disconnect(receive):
+    while (await receive())["type"] != "http.disconnect":
+        pass
+
+
+async def read_body(receive):
+    """The request body, or None if the client disconnected first."""
+    body = b""
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            return None
+        body += message.get("body", b"")
+        if not message.get("more_body"):
+            return body
+
+
+def nothing_new(response):
+    """Whether the buffered answer to a ``wait=0`` long poll had no messages."""
+    start, body = response[0], b"".join(message.get("body", b"") for message in response[1:])
+    if start["status"] == 304:
+        return True
+    content_type = dict(start.get("headers", ())).get(b"content-type", b"")
+    if start["status"] != 200 or not content_type.startswith(b"application/json"):
+        return False
+    try:
+        return json.loads(body).get("results") == []
+    except (ValueError, AttributeError):
+        return False
+
+
+class RealtimeRouter:
+    """
+    ASGI application serving the push endpoints and passing every other
+    request to ``application`` (the Django ASGI handler).
+    """
+
+    websocket_path = re.compile(r"^/ws/conversations/(?P<conversation_id>[^/]+)/$")
+    events_path = re.compile(r"^/api/conversations/(?P<conversation_id>[^/]+)/events/$")
+    messages_path = re.compile(r"^/api/conversations/(?P<conversation_id>[^/]+)/messages/$")
+
+    def __init__(self, application, hub=hub):
+        self.application = application
+        self.hub = hub
+
+    @staticmethod
+    def conversation_id(pattern, path):
+        match = pattern.match(path)
+        if match is None:
+            return None
+        try:
+            return uuid.UUID(match["conversation_id"])
+        except ValueError:
+            return None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "websocket":
+            conversation_id = self.conversation_id(self.websocket_path, scope["path"])
+            if conversation_id is None:
+                await receive()
+                await send({"type": "websocket.close", "code": 4404})
+                return
+            return await self.websocket(scope, receive, send, conversation_id)
+        if scope["type"] == "http" and scope["method"] == "GET":
+            conversation_id = self.conversation_id(self.events_path, scope["path"])
+            if conversation_id is not None:
+                return await self.event_stream(scope, receive, send, conversation_id)
+            conversation_id = self.conversation_id(self.messages_path, scope["path"])
+            params = parse_qs(scope.get("query_string", b"").decode(), keep_blank_values=True)
+            if conversation_id is not None and "since" in params:
+                return await self.long_poll(scope, receive, send, conversation_id, params)
+        return await self.application(scope, receive, send)
+
+    async def call_application(self, scope, body):
+        """Run ``application`` for a request with ``body``; returns the messages it sent."""
+        pending = [{"type": "http.request", "body": body, "more_body": False}]
+        response = []
+
+        async def receive():
+            if pending:
+                return pending.pop()
+            # Django listens for a disconnect until the response is complete
+            await asyncio.Event().wait()
+
+        async def send(message):
+            response.append(message)
+
+        await self.application(scope, receive, send)
+        return response
+
+    async def long_poll(self, scope, receive, send, conversation_id, params):
+        """
+        Under ASGI, Django runs sync views on one shared thread, so a view
+        blocking for a long poll's whole wait would hold up every other
+        request of the process. The view is asked for an immediate answer
+        (``wait=0``) and, if it had nothing new, asked again once the
+        conversation has an event; the waiting happens here, on the loop.
+        """
+        wait = long_poll_wait(params.get("wait", [None])[0])
+        immediate = {**scope, "query_string": urlencode({**params, "wait": ["0"]}, doseq=True).encode()}
+        body = await read_body(receive)
+        if body is None:
+            return
+
+        # subscribe before asking, so a message saved in between still wakes us
+        async with self.hub.subscribe(conversation_channel(conversation_id)) as subscription:
+            response = await self.call_application(immediate, body)
+            if wait and nothing_new(response):
+                woken = asyncio.create_task(subscription.get())
+                disconnected = asyncio.create_task(wait_for_disconnect(receive))
+                try:
+                    done, _ = await asyncio.wait(
+                        {woken, disconnected}, timeout=wait, return_when=asyncio.FIRST_COMPLETED
+                    )
+                finally:
+                    woken.cancel()
+                    disconnected.cancel()
+                if disconnected in done:
+                    return
+                if woken in done:
+                    response = await self.call_application(immediate, body)
+        for message in response:
+            await send(message)
+
+    async def authorize(self, scope, conversation_id):
+        """
+        ``(status, user)``: 400 for a Host outside ``ALLOWED_HOSTS``, 401
+        without a valid token, 403 for non-participants.
+        """
+        if not host_allowed(scope):
+            return 400, None
+        user = await authenticate(scope)
+        if user is None:
+            return 401, None
+        if not await self.is_participant(user, conversation_id):
+            return 403, user
+        return 200, user
+
+    @staticmethod
+    async def is_participant(user, conversation_id):
+        return await database_sync_to_async(membership.is_participant)(user, conversation_id)
+
+    async def next_event(self, subscription, user, conversation_id):
+        """
+        The next event to forward, ``""`` if there is nothing to forward (the
+        keepalive interval passed, or the participants changed), or None once
+        ``user`` is no longer a participant.
+        """
+        try:
+            event = await asyncio.wait_for(subscription.get(), KEEPALIVE_SECONDS)
+        except asyncio.TimeoutError:
+            event = ""
+        if event and not is_membership_event(event):
+            return event
+        if not await self.is_participant(user, conversation_id):
+            return None
+        return ""
+
+    async def websocket(self, scope, receive, send, conversation_id):
+        if (await receive())["type"] != "websocket.connect":
+            return
+        code, user = await self.authorize(scope, conversation_id)
+        if code != 200:
+            await send({"type": "websocket.close", "code": 4000 + code})
+            return
+
+        async with self.hub.subscribe(conversation_channel(conversation_id)) as subscription:
+            await send({"type": "websocket.accept"})
+
+            async def forward():
+                while True:
+                    event = await self.next_event(subscription, user, conversation_id)
+                    if event is None:
+                        await send({"type": "websocket.close", "code": 4403})
+                        return
+                    if event:
+                        await send({"type": "websocket.send", "text": event})
+
+            forwarder = asyncio.create_task(forward())
+            try:
+                # incoming frames are ignored; only wait for the client to leave
+                while (await receive())["type"] != "websocket.disconnect":
+                    pass
+            finally:
+                forwarder.cancel()
+                await asyncio.gather(forwarder, return_exceptions=True)
+
+    async def event_stream(self, scope, receive, send, conversation_id):
+        code, user = await self.authorize(scope, conversation_id)
+        if code != 200:
+            detail = {
+                400: "Invalid host.",
+                401: "Authentication required.",
+                403: "Forbidden.",
+            }[code]
+            await send({
+                "type": "http.response.start",
+                "status": code,
+                "headers": [(b"content-type", b"application/json")],
+            })
+            await send({"type": "http.response.body", "body": json.dumps({"detail": detail}).encode()})
+            return
+
+        async with self.hub.subscribe(conversation_channel(conversation_id)) as subscription:
+            await send({
+                "type": "http.response.start",
+                "status": 200,
+                "headers": [
+                    (b"content-type", b"text/event-stream"),
+                    (b"cache-control", b"no-cache"),
+                    (b"x-accel-buffering", b"no"),
+                ],
+            })
+            disconnected = asyncio.create_task(wait_for_disconnect(receive))
+            try:
+                while True:
+                    next_event = asyncio.create_task(
+                        self.next_event(subscription, user, conversation_id)
+                    )
+                    done, _ = await asyncio.wait(
+                        {next_event, disconnected}, return_when=asyncio.FIRST_COMPLETED
+                    )
+                    if next_event not in done:
+                        next_event.cancel()
+                        return
+                    event = next_event.result()
+                    if event is None:
+                        # no longer a participant: end the stream
+                        await send({"type": "http.response.body", "body": b""})
+                        return
+                    if event:
+                        chunk = f"event: message\ndata: {event}\n\n"
+                    else:
+                        chunk = ": keepalive\n\n"
+                    await send({"type": "http.response.body", "body": chunk.encode(), "more_body": True})
+            finally:
+                disconnected.cancel()
@@ -0,0 +1,29 @@
+try:
+    import orjson
+except ImportError:  # optional: fall back to DRF's encoder
+    orjson = None
+
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+
+class FastJSONRenderer(JSONRenderer):
+    """
+    ``JSONRenderer`` backed by orjson when it is installed.
+
+    Output matches DRF's compact, unescaped JSON: datetimes and anything
+    orjson does not know natively (lazy strings, decimals, ...) go through
+    DRF's ``JSONEncoder``. Indented output, requested through the media
+    type, and a missing orjson both fall back to the stock renderer.
+    Non-string keys are converted like the ``json`` module does, e.g. the
+    integer indexes of ``ListField`` errors.
+    """
+
+    options = 0 if orjson is None else orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if orjson is None or data is None:
+            return super().render(data, accepted_media_type, renderer_context)
+        if self.get_indent(accepted_media_type, renderer_context or {}):
+            return super().render(data, accepted_media_type, renderer_context)
+        return orjson.dumps(data, default=JSONEncoder().default, option=self.options)
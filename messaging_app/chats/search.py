@@ -0,0 +1,149 @@
+"""
+Full-text search over message bodies.
+
+On SQLite the index is an FTS5 table keyed by ``message_id`` and kept in
+sync with ``chats_message`` by triggers (migration 0006); on MySQL it is
+an InnoDB FULLTEXT index (migration 0004). Any other database, or a
+SQLite build without FTS5, falls back to ``icontains`` scans.
+
+Queries are split into words and every word must match, as a prefix, so
+``"meet tomor"`` finds "meeting tomorrow".
+"""
+import re
+
+from django.db import connections
+
+from .models import Message
+
+FTS_TABLE = "chats_message_fts"
+MAX_TERMS = 8
+
+_term_re = re.compile(r"\w+")
+_backends = {}
+
+# the triggers created by migration 0006; migrations keep their own copy
+# so later edits here cannot change what an old migration runs
+SQLITE_TRIGGERS = [
+    "CREATE TRIGGER IF NOT EXISTS chats_message_fts_insert AFTER INSERT ON chats_message BEGIN "
+    "INSERT INTO chats_message_fts(message_id, message_body) "
+    "VALUES (new.message_id, new.message_body); "
+    "END",
+    "CREATE TRIGGER IF NOT EXISTS chats_message_fts_delete AFTER DELETE ON chats_message BEGIN "
+    "DELETE FROM chats_message_fts "
+    "WHERE chats_message_fts MATCH 'message_id:\"' || old.message_id || '\"'; "
+    "END",
+    "CREATE TRIGGER IF NOT EXISTS chats_message_fts_update "
+    "AFTER UPDATE OF message_body ON chats_message BEGIN "
+    "UPDATE chats_message_fts SET message_body = new.message_body "
+    "WHERE chats_message_fts MATCH 'message_id:\"' || old.message_id || '\"'; "
+    "END",
+]
+
+
+def search_terms(query):
+    return _term_re.findall(query or "")[:MAX_TERMS]
+
+
+class LikeSearch:
+    """Fallback: every term as a ``LIKE '%term%'`` scan, newest first."""
+
+    def matches(self, queryset, terms):
+        for term in terms:
+            queryset = queryset.filter(message_body__icontains=term)
+        return queryset
+
+    def ranked(self, queryset, terms):
+        return self.matches(queryset, terms).order_by("-sent_at", "-message_id")
+
+
+class SqliteSearch:
+    """FTS5 ``MATCH`` on the ``message_body`` column, ranked by bm25."""
+
+    def expression(self, terms):
+        return "message_body : (" + " ".join(f'"{term}"*' for term in terms) + ")"
+
+    def matches(self, queryset, terms):
+        return queryset.extra(
+            where=[
+                f"{Message._meta.db_table}.message_id IN "
+                f"(SELECT message_id FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s)"
+            ],
+            params=[self.expression(terms)],
+        )
+
+    def ranked(self, queryset, terms):
+        return queryset.extra(
+            select={"search_rank": f"-bm25({FTS_TABLE})"},
+            tables=[FTS_TABLE],
+            where=[
+                f"{FTS_TABLE}.message_id = {Message._meta.db_table}.message_id",
+                f"{FTS_TABLE} MATCH %s",
+            ],
+            params=[self.expression(terms)],
+        ).order_by("-search_rank", "-sent_at")
+
+
+class MysqlSearch:
+    """FULLTEXT ``MATCH ... AGAINST`` in boolean mode, ranked by relevance."""
+
+    match = f"MATCH ({Message._meta.db_table}.message_body) AGAINST (%s IN BOOLEAN MODE)"
+
+    def expression(self, terms):
+        return " ".join(f"+{term}*" for term in terms)
+
+    def matches(self, queryset, terms):
+        return queryset.extra(where=[self.match], params=[self.expression(terms)])
+
+    def ranked(self, queryset, terms):
+        expression = self.expression(terms)
+        return queryset.extra(
+            select={"search_rank": self.match},
+            select_params=[expression],
+            where=[self.match],
+            params=[expression],
+        ).order_by("-search_rank", "-sent_at")
+
+
+def search_backend(using="default"):
+    """The search implementation for database ``using``, detected once."""
+    backend = _backends.get(using)
+    if backend is None:
+        connection = connections[using]
+        if connection.vendor == "mysql":
+            backend = MysqlSearch()
+        elif connection.vendor == "sqlite" and FTS_TABLE in connection.introspection.table_names():
+            backend = SqliteSearch()
+        else:
+            backend = LikeSearch()
+        _backends[using] = backend
+    return backend
+
+
+def install_sqlite_triggers(using="default", **kwargs):
+    """
+    ``post_migrate`` receiver: recreate the FTS triggers if a migration
+    rebuilt ``chats_message`` (which drops them). The index is keyed by
+    ``message_id``, so its rows stay valid across rebuilds.
+    """
+    connection = connections[using]
+    if connection.vendor != "sqlite" or FTS_TABLE not in connection.introspection.table_names():
+        return
+    with connection.cursor() as cursor:
+        for statement in SQLITE_TRIGGERS:
+            cursor.execute(statement)
+
+
+def filter_messages(queryset, query):
+    """Restrict ``queryset`` to messages matching ``query``, keeping its ordering."""
+    terms = search_terms(query)
+    if not terms:
+        return queryset
+    return search_backend(queryset.db).matches(queryset, terms)
+
+
+def search_messages(queryset, query):
+    """Messages matching ``query``, best match first."""
+    terms = search_terms(query)
+    if not terms:
+        return queryset.none()
+    return search_backend(queryset.db).ranked(queryset, terms)
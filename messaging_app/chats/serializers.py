@@ -1,5 +1,5 @@
 from rest_framework import serializers
-from .models import User, Conversation, Message
+from .models import User, Conversation, Message, InboxEntry
 
 
 class UserSerializer(serializers.ModelSerializer):
@@ -30,7 +30,7 @@ class MessageSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Message
-        fields = ["id", "conversation", "sender", "message_body", "sent_at"]
+        fields = ["message_id", "conversation", "sender", "message_body", "sent_at"]
 
     def validate_message_body(self, value):
         """Ensure message body is not empty or only whitespace."""
@@ -39,6 +39,26 @@ class MessageSerializer(serializers.ModelSerializer):
         return value
 
 
+class BulkMessageItemSerializer(serializers.Serializer):
+    """
+    One message of a bulk send. Validated without database lookups;
+    conversation membership is checked for the whole batch at once.
+    """
+
+    conversation = serializers.UUIDField()
+    message_body = serializers.CharField()
+
+    validate_message_body = MessageSerializer.validate_message_body
+
+
+class BulkReadSerializer(serializers.Serializer):
+    """Conversations to mark as read in one request."""
+
+    conversations = serializers.ListField(
+        child=serializers.UUIDField(), allow_empty=False, max_length=1000
+    )
+
+
 class ConversationSerializer(serializers.ModelSerializer):
     """
     Serializer for the Conversation model.
@@ -54,7 +74,7 @@ class ConversationSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Conversation
-        fields = ["id", "participants", "created_at", "messages", "last_message"]
+        fields = ["conversation_id", "participants", "created_at", "messages", "last_message"]
 
     def get_last_message(self, obj):
         """Return the serialized last message or None if no messages exist."""
@@ -62,3 +82,48 @@ class ConversationSerializer(serializers.ModelSerializer):
         if not last:
             return None
         return MessageSerializer(last).data
+
+
+class ConversationListSerializer(serializers.ModelSerializer):
+    """
+    Lean, read-only representation for conversation listings.
+
+    Expects a queryset built with ``with_last_message()`` and
+    ``prefetch_related("participants")``: participants come from the
+    prefetch cache and the last message from annotations, so the listing
+    costs a constant number of queries and never nests full histories.
+    """
+
+    participants = UserSerializer(many=True, read_only=True)
+    last_message = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Conversation
+        fields = ["conversation_id", "participants", "created_at", "last_message"]
+        read_only_fields = fields
+
+    def get_last_message(self, obj):
+        if obj.last_message_id is None:
+            return None
+        return {
+            "message_id": str(obj.last_message_id),
+            "conversation": str(obj.conversation_id),
+            "sender": obj.last_message_sender,
+            "message_body": obj.last_message_body,
+            "sent_at": serializers.DateTimeField().to_representation(obj.last_message_sent_at),
+        }
+
+
+class InboxEntrySerializer(serializers.ModelSerializer):
+    """
+    Read-only inbox row. Expects ``select_related("last_message__sender")``
+    so a whole inbox page is served by one query.
+    """
+
+    conversation_id = serializers.UUIDField(read_only=True)
+    last_message = MessageSerializer(read_only=True)
+
+    class Meta:
+        model = InboxEntry
+        fields = ["conversation_id", "last_message", "last_activity_at", "unread_count"]
+        read_only_fields = fields
@@ -0,0 +1,232 @@
+"""
+Keep ``InboxEntry`` rows in step with messages and participants.
+
+Every change is applied incrementally with a constant number of queries
+per write, so the inbox never has to be rebuilt from the messages table.
+"""
+from django.db import models, transaction
+from django.db.models.functions import Coalesce
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from . import conditional, fragments, membership, realtime
+from .models import Conversation, InboxEntry, Message, User
+
+
+def latest_message(conversation_id):
+    return (
+        Message.objects.filter(conversation_id=conversation_id)
+        .order_by("-sent_at", "-message_id")
+        .first()
+    )
+
+
+def messages_created(sender_id, messages):
+    """
+    New messages from one user: update the inboxes and push them to
+    connected clients. Called by ``post_save``, and directly after
+    ``bulk_create``, which sends no signals.
+    """
+    record_messages(sender_id, messages)
+    touch_conversations({message.conversation_id for message in messages})
+    realtime.publish_messages(messages)
+
+
+def touch_conversations(conversation_ids):
+    """Change the conditional-GET validators now, and again once committed."""
+    for conversation_id in conversation_ids:
+        conditional.touch(conversation_id)
+    transaction.on_commit(lambda: [conditional.touch(pk) for pk in conversation_ids])
+
+
+def record_messages(sender_id, messages):
+    """Bump the conversations to the top of every participant's inbox, one UPDATE each."""
+    by_conversation = {}
+    for message in messages:
+        by_conversation.setdefault(message.conversation_id, []).append(message)
+    for conversation_id, batch in by_conversation.items():
+        last = max(batch, key=lambda message: message.sent_at)
+        InboxEntry.objects.filter(conversation_id=conversation_id).update(
+            last_message=last,
+            last_activity_at=last.sent_at,
+            # sending a message implies the sender has read the conversation
+            unread_count=models.Case(
+                models.When(user_id=sender_id, then=0),
+                default=models.F("unread_count") + len(batch),
+            ),
+            last_read_at=models.Case(
+                models.When(user_id=sender_id, then=models.Value(last.sent_at)),
+                default=models.F("last_read_at"),
+            ),
+        )
+
+
+def forget_message(message):
+    """A deleted message: drop it from unread counts and fall back to the previous one."""
+    entries = InboxEntry.objects.filter(conversation_id=message.conversation_id)
+    entries.exclude(user_id=message.sender_id).filter(unread_count__gt=0).filter(
+        models.Q(last_read_at__isnull=True) | models.Q(last_read_at__lt=message.sent_at)
+    ).update(unread_count=models.F("unread_count") - 1)
+
+    # SET_NULL has already cleared entries that pointed at the deleted message
+    orphaned = entries.filter(last_message__isnull=True)
+    if not orphaned.exists():
+        return
+    previous = latest_message(message.conversation_id)
+    if previous is not None:
+        orphaned.update(last_message=previous, last_activity_at=previous.sent_at)
+
+
+def refresh_inbox(conversation_ids):
+    """
+    Recompute the last message and unread counts of every entry of
+    ``conversation_ids`` from the messages table: three UPDATEs, however
+    many messages were removed.
+    """
+    conversation = models.OuterRef("conversation")
+    messages = Message.objects.filter(conversation=conversation)
+    latest = messages.order_by("-sent_at", "-message_id")
+    entries = InboxEntry.objects.filter(conversation_id__in=conversation_ids)
+    entries.update(
+        last_message=models.Subquery(latest.values("message_id")[:1]),
+        last_activity_at=Coalesce(
+            models.Subquery(latest.values("sent_at")[:1]),
+            models.Subquery(
+                Conversation.objects.filter(pk=conversation).values("created_at")[:1]
+            ),
+        ),
+    )
+
+    def unread(unseen):
+        counts = (
+            unseen.exclude(sender=models.OuterRef("user"))
+            .order_by()
+            .values("conversation")
+            .annotate(count=models.Count("pk"))
+            .values("count")
+        )
+        return Coalesce(models.Subquery(counts), 0)
+
+    entries.filter(last_read_at__isnull=True).update(unread_count=unread(messages))
+    entries.filter(last_read_at__isnull=False).update(
+        unread_count=unread(messages.filter(sent_at__gt=models.OuterRef("last_read_at")))
+    )
+
+
+def deleted_directly(origin):
+    """Was a message deletion started on messages, rather than cascaded from a parent?"""
+    if origin is None:
+        return True
+    model = origin.model if isinstance(origin, models.QuerySet) else type(origin)
+    return model is Message
+
+
+def add_participants(conversation, user_ids):
+    last = latest_message(conversation.pk)
+    InboxEntry.objects.bulk_create(
+        [
+            InboxEntry(
+                user_id=user_id,
+                conversation=conversation,
+                last_message=last,
+                last_activity_at=last.sent_at if last else conversation.created_at,
+            )
+            for user_id in user_ids
+        ],
+        ignore_conflicts=True,
+    )
+
+
+def mark_read(user, conversation_ids, read_at):
+    return InboxEntry.objects.filter(user=user, conversation_id__in=conversation_ids).update(
+        unread_count=0, last_read_at=read_at
+    )
+
+
+@receiver(post_save, sender=Message)
+def message_saved(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    if created:
+        messages_created(instance.sender_id, [instance])
+    else:
+        # post_save runs before Message.save reads the new version back
+        instance.refresh_version()
+        fragments.forget(instance, version=instance.version - 1)
+        touch_conversations([instance.conversation_id])
+
+
+@receiver(post_delete, sender=Message)
+def message_deleted(sender, instance, origin=None, **kwargs):
+    # messages cascaded from a conversation or user are handled once for
+    # the whole deletion by the receivers below, not row by row
+    if not deleted_directly(origin):
+        return
+    forget_message(instance)
+    fragments.forget(instance)
+    touch_conversations([instance.conversation_id])
+
+
+def invalidate_membership(user_ids):
+    """Drop cached memberships now, and again once the change is committed."""
+    user_ids = list(user_ids)
+    membership.invalidate(user_ids)
+    transaction.on_commit(lambda: membership.invalidate(user_ids))
+
+
+@receiver(pre_delete, sender=Conversation)
+def conversation_deleted(sender, instance, **kwargs):
+    # its messages and inbox entries go with it
+    invalidate_membership(instance.participants.values_list("pk", flat=True))
+    realtime.publish_participants_changed([instance.pk])
+
+
+@receiver(pre_delete, sender=User)
+def user_deleting(sender, instance, **kwargs):
+    instance._chats_message_conversations = set(
+        Message.objects.filter(sender=instance).values_list("conversation_id", flat=True).distinct()
+    )
+
+
+@receiver(post_delete, sender=User)
+def user_deleted(sender, instance, **kwargs):
+    conversation_ids = getattr(instance, "_chats_message_conversations", None)
+    if conversation_ids:
+        refresh_inbox(conversation_ids)
+        touch_conversations(conversation_ids)
+
+
+@receiver(m2m_changed, sender=Conversation.participants.through)
+def participants_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action in ("post_add", "post_remove"):
+        invalidate_membership([instance.pk] if reverse else pk_set)
+    elif action == "pre_clear":
+        # clear() runs in a transaction, so the on_commit pass sees the result
+        if reverse:
+            invalidate_membership([instance.pk])
+            realtime.publish_participants_changed(
+                list(instance.conversations.values_list("pk", flat=True))
+            )
+        else:
+            invalidate_membership(instance.participants.values_list("pk", flat=True))
+            realtime.publish_participants_changed([instance.pk])
+
+    if action == "post_add":
+        if reverse:
+            # user.conversations.add(...)
+            for conversation in Conversation.objects.filter(pk__in=pk_set):
+                add_participants(conversation, [instance.pk])
+        else:
+            add_participants(instance, pk_set)
+    elif action == "post_remove":
+        if reverse:
+            InboxEntry.objects.filter(user=instance, conversation_id__in=pk_set).delete()
+        else:
+            InboxEntry.objects.filter(conversation=instance, user_id__in=pk_set).delete()
+        # open streams re-check membership, closing those of removed users
+        realtime.publish_participants_changed(pk_set if reverse else [instance.pk])
+    elif action == "post_clear":
+        if reverse:
+            InboxEntry.objects.filter(user=instance).delete()
+        else:
+            InboxEntry.objects.filter(conversation=instance).delete()
@@ -1,3 +1,980 @@
-from django.test import TestCase
+import asyncio
+import base64
+import datetime
+import json
+import threading
+import time
+import unittest
+from unittest import mock
+from urllib.parse import parse_qs
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+
+from django.core.cache.backends.db import DatabaseCache
+from django.db import connection, connections
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.utils.http import http_date
+from django.urls import reverse
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from . import membership
+from .checks import check_shared_broker, check_shared_cache
+from .fast_serializers import ConversationListValuesSerializer, MessageValuesSerializer
+from .models import Conversation, InboxEntry, Message, User
+from .pagination import after, before
+from .renderers import FastJSONRenderer
+from .serializers import ConversationListSerializer, MessageSerializer
+from .realtime import RealtimeRouter, conversation_channel, hub
+from .search import SqliteSearch, install_sqlite_triggers, search_backend, search_messages
+from . import views
+from .views import BULK_CHUNK_SIZE, BULK_MAX_MESSAGES
+
+
+class ConversationListQueryCountTests(TestCase):
+    """The conversation listing must not issue queries per conversation."""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username="alice", password="pass")
+        self.other = User.objects.create_user(username="bob", password="pass")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def make_conversations(self, count):
+        for i in range(count):
+            conversation = Conversation.objects.create()
+            conversation.participants.add(self.user, self.other)
+            Message.objects.create(
+                sender=self.other, conversation=conversation, message_body=f"hello {i}"
+            )
+
+    def test_query_count_is_constant(self):
+        self.make_conversations(2)
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse("conversation-list"))
+        self.assertEqual(len(response.json()), 2)
+
+        self.make_conversations(20)
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse("conversation-list"))
+        self.assertEqual(len(response.json()), 22)
+
+    def test_last_message_comes_from_annotation(self):
+        conversation = Conversation.objects.create()
+        conversation.participants.add(self.user, self.other)
+        Message.objects.create(sender=self.user, conversation=conversation, message_body="first")
+        last = Message.objects.create(
+            sender=self.other, conversation=conversation, message_body="second"
+        )
+
+        data = self.client.get(reverse("conversation-list")).json()[0]
+        self.assertNotIn("messages", data)
+        self.assertEqual(data["last_message"]["message_id"], str(last.message_id))
+        self.assertEqual(data["last_message"]["sender"], "bob")
+        self.assertEqual(data["last_message"]["message_body"], "second")
+
+
+class InboxSignalTests(TestCase):
+    """The signal handlers keep ``InboxEntry`` rows and counters in step."""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username="alice", password="pass")
+        self.other = User.objects.create_user(username="bob", password="pass")
+        self.conversation = Conversation.objects.create()
+        self.conversation.participants.add(self.user, self.other)
+
+    def send(self, sender, body="hi"):
+        return Message.objects.create(
+            sender=sender, conversation=self.conversation, message_body=body
+        )
+
+    def entry(self, user):
+        return InboxEntry.objects.get(user=user, conversation=self.conversation)
+
+    def test_unread_count_on_create(self):
+        self.send(self.other)
+        last = self.send(self.other)
+        self.assertEqual(self.entry(self.user).unread_count, 2)
+        self.assertEqual(self.entry(self.user).last_message, last)
+        self.assertEqual(self.entry(self.other).unread_count, 0)
+
+        # replying marks the conversation read for the sender
+        self.send(self.user)
+        self.assertEqual(self.entry(self.user).unread_count, 0)
+        self.assertEqual(self.entry(self.other).unread_count, 1)
+
+    def test_unread_count_on_delete(self):
+        first = self.send(self.other, "first")
+        last = self.send(self.other, "second")
+        last.delete()
+        entry = self.entry(self.user)
+        self.assertEqual(entry.unread_count, 1)
+        self.assertEqual(entry.last_message, first)
+        self.assertEqual(entry.last_activity_at, first.sent_at)
+
+    def test_unread_count_on_read(self):
+        self.send(self.other)
+        client = APIClient()
+        client.force_authenticate(self.user)
+        response = client.post(reverse("conversation-read", args=[self.conversation.pk]))
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(self.entry(self.user).unread_count, 0)
+
+        self.send(self.other)
+        self.assertEqual(self.entry(self.user).unread_count, 1)
+
+    def test_rows_follow_participants(self):
+        last = self.send(self.other)
+        carol = User.objects.create_user(username="carol", password="pass")
+        self.conversation.participants.add(carol)
+        self.assertEqual(self.entry(carol).last_message, last)
+
+        self.conversation.participants.remove(carol)
+        self.assertFalse(InboxEntry.objects.filter(user=carol).exists())
+
+        carol.conversations.add(self.conversation)
+        self.assertTrue(InboxEntry.objects.filter(user=carol).exists())
+        carol.conversations.remove(self.conversation)
+        self.assertFalse(InboxEntry.objects.filter(user=carol).exists())
+
+        self.conversation.participants.clear()
+        self.assertFalse(InboxEntry.objects.filter(conversation=self.conversation).exists())
+
+    def test_conversation_delete_is_not_per_message(self):
+        def delete_with(count):
+            conversation = Conversation.objects.create()
+            conversation.participants.add(self.user, self.other)
+            for i in range(count):
+                Message.objects.create(
+                    sender=self.other, conversation=conversation, message_body=f"m{i}"
+                )
+            with CaptureQueriesContext(connection) as queries:
+                conversation.delete()
+            return len(queries)
+
+        self.assertEqual(delete_with(2), delete_with(30))
+
+    def test_user_delete_refreshes_inbox(self):
+        own = self.send(self.user, "mine")
+        self.send(self.other)
+        self.send(self.other)
+        self.assertEqual(self.entry(self.user).unread_count, 2)
+
+        self.other.delete()
+        entry = self.entry(self.user)
+        self.assertEqual(entry.unread_count, 0)
+        self.assertEqual(entry.last_message, own)
+
+
+class MessageListPermissionTests(TestCase):
+    """Only participants may read or post a conversation's messages."""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username="alice", password="pass")
+        self.outsider = User.objects.create_user(username="eve", password="pass")
+        self.conversation = Conversation.objects.create()
+        self.conversation.participants.add(self.user)
+        self.url = reverse("conversation-messages", args=[self.conversation.pk])
+        self.client = APIClient()
+
+    def test_participant_can_post(self):
+        self.client.force_authenticate(self.user)
+        response = self.client.post(self.url, {"message_body": "hi"}, format="json")
+        self.assertEqual(response.status_code, 201)
+
+    def test_non_participant_cannot_post(self):
+        self.client.force_authenticate(self.outsider)
+        response = self.client.post(self.url, {"message_body": "hi"}, format="json")
+        self.assertEqual(response.status_code, 403)
+        self.assertFalse(Message.objects.exists())
+
+    def test_non_participant_cannot_read(self):
+        self.client.force_authenticate(self.outsider)
+        self.assertEqual(self.client.get(self.url).status_code, 403)
+
+
+class MembershipTests(TestCase):
+    """Authorization takes one query, and cached memberships follow participant changes."""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username="alice", password="pass")
+        self.other = User.objects.create_user(username="bob", password="pass")
+        self.conversation = Conversation.objects.create()
+        self.conversation.participants.add(self.user, self.other)
+        self.message = Message.objects.create(
+            sender=self.other, conversation=self.conversation, message_body="hi"
+        )
+        self.client = APIClient()
+
+    def ids(self, user):
+        return membership.conversation_ids(user.pk)
+
+    def test_cache_follows_add_remove_and_clear(self):
+        second = Conversation.objects.create()
+        self.assertEqual(self.ids(self.user), {self.conversation.pk})
+
+        second.participants.add(self.user)
+        self.assertEqual(self.ids(self.user), {self.conversation.pk, second.pk})
+        self.conversation.participants.remove(self.user)
+        self.assertEqual(self.ids(self.user), {second.pk})
+        second.participants.clear()
+        self.assertEqual(self.ids(self.user), set())
+
+        # the same changes made from the user's side
+        self.user.conversations.add(self.conversation, second)
+        self.assertEqual(self.ids(self.user), {self.conversation.pk, second.pk})
+        self.user.conversations.remove(second)
+        self.assertEqual(self.ids(self.user), {self.conversation.pk})
+        self.assertEqual(self.ids(self.other), {self.conversation.pk})
+        self.user.conversations.clear()
+        self.assertEqual(self.ids(self.user), set())
+        self.assertEqual(self.ids(self.other), {self.conversation.pk})
+
+    def test_authorization_is_one_query(self):
+        outsider = User.objects.create_user(username="eve", password="pass")
+        self.client.force_authenticate(outsider)
+        messages_url = reverse("conversation-messages", args=[self.conversation.pk])
+        detail_url = reverse("message-detail", args=[self.message.pk])
+        for method, url in [
+            (self.client.get, messages_url),
+            (self.client.post, messages_url),
+            (self.client.get, detail_url),
+            (self.client.delete, detail_url),
+        ]:
+            with self.assertNumQueries(1):
+                self.assertEqual(method(url, {"message_body": "x"}).status_code, 403)
+
+        # a participant's message and membership load together; the second query is the sender
+        self.client.force_authenticate(self.user)
+        with self.assertNumQueries(2):
+            self.assertEqual(self.client.get(detail_url).status_code, 200)
+
+    def test_removed_participant_is_refused_on_next_request(self):
+        url = reverse("conversation-messages", args=[self.conversation.pk])
+        self.client.force_authenticate(self.user)
+        self.assertEqual(self.client.get(url).status_code, 200)
+        self.assertTrue(membership.is_participant(self.user, self.conversation.pk))
+
+        self.conversation.participants.remove(self.user)
+        self.assertEqual(self.client.get(url).status_code, 403)
+        self.assertEqual(self.client.post(url, {"message_body": "x"}).status_code, 403)
+        self.assertFalse(membership.is_participant(self.user, self.conversation.pk))
+
+        self.conversation.participants.add(self.user)
+        self.assertEqual(self.client.get(url).status_code, 200)
+        self.assertTrue(membership.is_participant(self.user, self.conversation.pk))
+
+
+class MessageCursorPaginationTests(TestCase):
+    """Cursor links walk a conversation without gaps or repeats, even across equal sent_at."""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username="alice", password="pass")
+        self.conversation = Conversation.objects.create()
+        self.conversation.participants.add(self.user)
+        Message.objects.bulk_create(
+            Message(sender=self.user, conversation=self.conversation, message_body=f"m{i}")
+            for i in range(25)
+        )
+        # five messages share each timestamp, so pages split inside a tie
+        start = timezone.now()
+        for i, message in enumerate(Message.objects.order_by("message_id")):
+            Message.objects.filter(pk=message.pk).update(
+                sent_at=start - datetime.timedelta(seconds=i // 5)
+            )
+        self.expected = [
+            str(pk)
+            for pk in Message.objects.order_by("-sent_at", "-message_id").values_list(
+                "message_id", flat=True
+            )
+        ]
+        self.url = reverse("conversation-messages", args=[self.conversation.pk])
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def page(self, url, **params):
+        response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def ids(self, page):
+        return [message["message_id"] for message in page["results"]]
+
+    def test_next_and_previous_links_cover_every_message_once(self):
+        pages = [self.page(self.url, page_size=7)]
+        while pages[-1]["next"]:
+            pages.append(self.page(pages[-1]["next"]))
+        self.assertEqual([len(page["results"]) for page in pages], [7, 7, 7, 4])
+        self.assertEqual([i for page in pages for i in self.ids(page)], self.expected)
+        self.assertIsNone(pages[0]["previous"])
+
+        # walking back from the last page returns the same pages in reverse
+        page = pages[-1]
+        for expected in reversed(pages[:-1]):
+            page = self.page(page["previous"])
+            self.assertEqual(self.ids(page), self.ids(expected))
+
+    def test_count_only_on_request(self):
+        self.assertNotIn("count", self.page(self.url))
+        self.assertEqual(self.page(self.url, count="true")["count"], 25)
+
+    def test_tampered_cursor_is_not_found(self):
+        token = base64.urlsafe_b64encode(json.dumps({"t": "yesterday", "id": "1"}).encode())
+        for cursor in ("not-a-cursor", token.decode()):
+            response = self.client.get(self.url, {"cursor": cursor})
+            self.assertEqual(response.status_code, 404)
+
+
+class MessageBulkCreateTests(TestCase):
+    """Bulk sends validate items independently and write messages and inbox rows in chunks."""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username="alice", password="pass")
+        self.other = User.objects.create_user(username="bob", password="pass")
+        self.conversation = Conversation.objects.create()
+        self.conversation.participants.add(self.user, self.other)
+        self.foreign = Conversation.objects.create()
+        self.foreign.participants.add(self.other)
+        self.url = reverse("message-bulk-create")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def item(self, body="hi", conversation=None):
+        return {
+            "conversation": str((conversation or self.conversation).pk),
+            "message_body": body,
+        }
+
+    def test_all_created(self):
+        response = self.client.post(self.url, [self.item("a"), self.item("b")], format="json")
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual([item["index"] for item in response.json()["created"]], [0, 1])
+        self.assertEqual(response.json()["errors"], [])
+        self.assertEqual(Message.objects.count(), 2)
+
+    def test_partial_success_lists_errors(self):
+        items = [self.item("a"), self.item(""), self.item("c", self.foreign), {"message_body": "d"}]
+        response = self.client.post(self.url, {"messages": items}, format="json")
+        self.assertEqual(response.status_code, 207)
+        body = response.json()
+        self.assertEqual([item["index"] for item in body["created"]], [0])
+        self.assertEqual([error["index"] for error in body["errors"]], [1, 2, 3])
+        self.assertIn("message_body", body["errors"][0]["errors"])
+        self.assertIn("conversation", body["errors"][1]["errors"])
+        self.assertIn("conversation", body["errors"][2]["errors"])
+        self.assertEqual(list(Message.objects.values_list("message_body", flat=True)), ["a"])
+
+    def test_empty_and_oversized_requests(self):
+        for data in ([], {"messages": []}, [self.item()] * (BULK_MAX_MESSAGES + 1)):
+            response = self.client.post(self.url, data, format="json")
+            self.assertEqual(response.status_code, 400)
+        self.assertFalse(Message.objects.exists())
+
+    def test_non_participant_rejected(self):
+        response = self.client.post(self.url, [self.item(conversation=self.foreign)], format="json")
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()["errors"][0]["index"], 0)
+        self.assertFalse(Message.objects.exists())
+
+    def test_more_than_one_chunk(self):
+        count = BULK_CHUNK_SIZE + 100
+        items = [self.item(f"m{i}") for i in range(count)]
+        response = self.client.post(self.url, items, format="json")
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(response.json()["created"]), count)
+        self.assertEqual(Message.objects.filter(conversation=self.conversation).count(), count)
+        received = InboxEntry.objects.get(user=self.other, conversation=self.conversation)
+        self.assertEqual(received.unread_count, count)
+        self.assertEqual(received.last_message.message_body, f"m{count - 1}")
+        sent = InboxEntry.objects.get(user=self.user, conversation=self.conversation)
+        self.assertEqual(sent.unread_count, 0)
+
+
+@unittest.skipUnless(connection.vendor in ("sqlite", "mysql"), "EXPLAIN output is backend specific")
+class MessageQueryPlanTests(TestCase):
+    """Message access paths must be served by the composite indexes."""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username="alice", password="pass")
+        self.conversation = Conversation.objects.create()
+        self.conversation.participants.add(self.user)
+        Message.objects.bulk_create(
+            Message(sender=self.user, conversation=self.conversation, message_body=f"m{i}")
+            for i in range(50)
+        )
+
+    def assertUsesIndex(self, queryset, index):
+        plan = queryset.explain()
+        self.assertIn(index, plan)
+        # the index must also provide the ordering
+        if connection.vendor == "sqlite":
+            self.assertNotIn("TEMP B-TREE", plan)
+        else:
+            self.assertNotIn("filesort", plan)
+
+    def assertSeeksRange(self, queryset, index, condition):
+        """
+        ``index`` must be entered as a range on ``sent_at``, not walked from
+        the start of the equality prefix. ``condition`` is the SQLite form
+        of the range, e.g. ``"sent_at<"``.
+        """
+        self.assertUsesIndex(queryset, index)
+        if connection.vendor == "sqlite":
+            search = [line for line in queryset.explain().splitlines() if index in line]
+            self.assertIn(condition, search[0])
+        else:
+            tables = []
+
+            def collect(node):
+                if isinstance(node, dict):
+                    if "table_name" in node:
+                        tables.append(node)
+                    for value in node.values():
+                        collect(value)
+                elif isinstance(node, list):
+                    for value in node:
+                        collect(value)
+
+            collect(json.loads(queryset.explain(format="json")))
+            table = next(table for table in tables if table.get("key") == index)
+            self.assertEqual(table["access_type"], "range")
+
+    def test_conversation_page_uses_index(self):
+        page = Message.objects.filter(conversation=self.conversation).order_by(
+            "-sent_at", "-message_id"
+        )[:21]
+        self.assertUsesIndex(page, "msg_conversation_sent_idx")
+
+    def test_conversation_keyset_page_seeks_index(self):
+        last = Message.objects.filter(conversation=self.conversation)[10]
+        older = (
+            Message.objects.filter(conversation=self.conversation)
+            .filter(before(last.sent_at, last.message_id))
+            .order_by("-sent_at", "-message_id")[:21]
+        )
+        self.assertSeeksRange(older, "msg_conversation_sent_idx", "sent_at<")
+        newer = (
+            Message.objects.filter(conversation=self.conversation)
+            .filter(after(last.sent_at, last.message_id))
+            .order_by("sent_at", "message_id")[:21]
+        )
+        self.assertSeeksRange(newer, "msg_conversation_sent_idx", "sent_at>")
+
+    def test_sender_range_uses_index(self):
+        now = timezone.now()
+        messages = Message.objects.filter(
+            sender=self.user,
+            sent_at__gte=now - datetime.timedelta(days=1),
+            sent_at__lte=now,
+        ).order_by("sent_at")
+        self.assertSeeksRange(messages, "msg_sender_sent_idx", "sent_at>")
+
+
+class MessageSearchTests(TestCase):
+    """The search index follows message creates, edits and deletes."""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username="alice", password="pass")
+        self.conversation = Conversation.objects.create()
+        self.conversation.participants.add(self.user)
+
+    def search(self, query):
+        return list(search_messages(Message.objects.all(), query))
+
+    def test_index_follows_writes(self):
+        message = Message.objects.create(
+            sender=self.user, conversation=self.conversation, message_body="meeting tomorrow"
+        )
+        self.assertEqual(self.search("meet tomor"), [message])
+
+        message.message_body = "lunch today"
+        message.save()
+        self.assertEqual(self.search("meeting"), [])
+        self.assertEqual(self.search("lunch"), [message])
+
+        message.delete()
+        self.assertEqual(self.search("lunch"), [])
+
+    def test_message_ids_are_not_matched(self):
+        message = Message.objects.create(
+            sender=self.user, conversation=self.conversation, message_body="hello"
+        )
+        self.assertEqual(self.search(message.message_id.hex), [])
+
+    @unittest.skipUnless(connection.vendor == "sqlite", "SQLite FTS5 triggers")
+    def test_triggers_are_reinstalled_after_migrate(self):
+        if not isinstance(search_backend(), SqliteSearch):
+            self.skipTest("SQLite built without FTS5")
+        with connection.cursor() as cursor:
+            cursor.execute("DROP TRIGGER chats_message_fts_insert")
+        install_sqlite_triggers()
+        message = Message.objects.create(
+            sender=self.user, conversation=self.conversation, message_body="rebuilt"
+        )
+        self.assertEqual(self.search("rebuilt"), [message])
+
+
+class RealtimePushTests(TestCase):
+    """New messages are pushed to participants over WebSockets and SSE."""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username="alice", password="pass")
+        self.other = User.objects.create_user(username="bob", password="pass")
+        self.outsider = User.objects.create_user(username="eve", password="pass")
+        self.conversation = Conversation.objects.create()
+        self.conversation.participants.add(self.user, self.other)
+        self.router = RealtimeRouter(application=None)
+
+    def scope(self, kind, path, user, host=b"testserver"):
+        token = str(AccessToken.for_user(user))
+        return {
+            "type": kind,
+            "method": "GET",
+            "path": path,
+            "query_string": f"token={token}".encode(),
+            "headers": [(b"host", host)],
+        }
+
+    def send_message(self, body):
+        with self.captureOnCommitCallbacks(execute=True):
+            return Message.objects.create(
+                sender=self.other, conversation=self.conversation, message_body=body
+            )
+
+    async def test_websocket_receives_new_messages(self):
+        incoming, outgoing = asyncio.Queue(), asyncio.Queue()
+        path = f"/ws/conversations/{self.conversation.pk}/"
+        await incoming.put({"type": "websocket.connect"})
+        task = asyncio.create_task(
+            self.router(self.scope("websocket", path, self.user), incoming.get, outgoing.put)
+        )
+        self.assertEqual((await outgoing.get())["type"], "websocket.accept")
+
+        message = await sync_to_async(self.send_message)("hello")
+        frame = await asyncio.wait_for(outgoing.get(), 1)
+        event = json.loads(frame["text"])
+        self.assertEqual(event["type"], "message.created")
+        self.assertEqual(event["message"]["message_id"], str(message.message_id))
+        self.assertEqual(event["message"]["message_body"], "hello")
+
+        await incoming.put({"type": "websocket.disconnect"})
+        await asyncio.wait_for(task, 1)
+        self.assertEqual(hub.subscriber_count(conversation_channel(self.conversation.pk)), 0)
+
+    def test_messages_without_listeners_are_not_serialized(self):
+        with mock.patch.object(MessageSerializer, "to_representation") as serialize:
+            self.send_message("nobody is listening")
+        serialize.assert_not_called()
+
+    async def test_websocket_rejects_non_participants(self):
+        incoming, outgoing = asyncio.Queue(), asyncio.Queue()
+        path = f"/ws/conversations/{self.conversation.pk}/"
+        await incoming.put({"type": "websocket.connect"})
+        await self.router(self.scope("websocket", path, self.outsider), incoming.get, outgoing.put)
+        self.assertEqual(await outgoing.get(), {"type": "websocket.close", "code": 4403})
+
+    @override_settings(ALLOWED_HOSTS=["chat.example.com"])
+    async def test_unknown_host_is_refused(self):
+        incoming, outgoing = asyncio.Queue(), asyncio.Queue()
+        path = f"/ws/conversations/{self.conversation.pk}/"
+        scope = self.scope("websocket", path, self.user, host=b"evil.example.com")
+        await incoming.put({"type": "websocket.connect"})
+        await self.router(scope, incoming.get, outgoing.put)
+        self.assertEqual(await outgoing.get(), {"type": "websocket.close", "code": 4400})
+
+        path = f"/api/conversations/{self.conversation.pk}/events/"
+        scope = self.scope("http", path, self.user, host=b"evil.example.com")
+        await self.router(scope, incoming.get, outgoing.put)
+        self.assertEqual((await outgoing.get())["status"], 400)
+        self.assertIn(b"Invalid host", (await outgoing.get())["body"])
+
+        # the configured host is let through to the membership check
+        scope = self.scope("http", path, self.outsider, host=b"chat.example.com:8000")
+        await self.router(scope, incoming.get, outgoing.put)
+        self.assertEqual((await outgoing.get())["status"], 403)
+
+    async def test_event_stream_receives_new_messages(self):
+        incoming, outgoing = asyncio.Queue(), asyncio.Queue()
+        path = f"/api/conversations/{self.conversation.pk}/events/"
+        await incoming.put({"type": "http.request", "body": b"", "more_body": False})
+        task = asyncio.create_task(
+            self.router(self.scope("http", path, self.user), incoming.get, outgoing.put)
+        )
+        start = await outgoing.get()
+        self.assertEqual(start["status"], 200)
+        self.assertIn((b"content-type", b"text/event-stream"), start["headers"])
+
+        await sync_to_async(self.send_message)("over sse")
+        chunk = (await asyncio.wait_for(outgoing.get(), 1))["body"].decode()
+        self.assertTrue(chunk.startswith("event: message\ndata: "))
+        self.assertEqual(json.loads(chunk.split("data: ", 1)[1])["message"]["message_body"], "over sse")
+
+        await incoming.put({"type": "http.disconnect"})
+        await asyncio.wait_for(task, 1)
+
+    def remove_participant(self, user):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.conversation.participants.remove(user)
+
+    async def test_websocket_closed_when_participant_removed(self):
+        incoming, outgoing = asyncio.Queue(), asyncio.Queue()
+        path = f"/ws/conversations/{self.conversation.pk}/"
+        await incoming.put({"type": "websocket.connect"})
+        task = asyncio.create_task(
+            self.router(self.scope("websocket", path, self.user), incoming.get, outgoing.put)
+        )
+        self.assertEqual((await outgoing.get())["type"], "websocket.accept")
+
+        await sync_to_async(self.remove_participant)(self.user)
+        frame = await asyncio.wait_for(outgoing.get(), 1)
+        self.assertEqual(frame, {"type": "websocket.close", "code": 4403})
+
+        await incoming.put({"type": "websocket.disconnect"})
+        await asyncio.wait_for(task, 1)
+
+    async def test_event_stream_ends_when_participant_removed(self):
+        incoming, outgoing = asyncio.Queue(), asyncio.Queue()
+        path = f"/api/conversations/{self.conversation.pk}/events/"
+        await incoming.put({"type": "http.request", "body": b"", "more_body": False})
+        task = asyncio.create_task(
+            self.router(self.scope("http", path, self.user), incoming.get, outgoing.put)
+        )
+        self.assertEqual((await outgoing.get())["status"], 200)
+
+        # other participants stay connected
+        await sync_to_async(self.remove_participant)(self.other)
+        self.assertEqual((await asyncio.wait_for(outgoing.get(), 1))["body"], b": keepalive\n\n")
+
+        await sync_to_async(self.remove_participant)(self.user)
+        last = await asyncio.wait_for(outgoing.get(), 1)
+        self.assertFalse(last.get("more_body", False))
+        await asyncio.wait_for(task, 1)
+
+
+class ConditionalGetTests(TestCase):
+    """Message lists answer 304 until a message is created, edited or deleted."""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username="alice", password="pass")
+        self.conversation = Conversation.objects.create()
+        self.conversation.participants.add(self.user)
+        self.older = self.send("older")
+        self.newer = self.send("newer")
+        self.url = reverse("conversation-messages", args=[self.conversation.pk])
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def send(self, body):
+        return Message.objects.create(
+            sender=self.user, conversation=self.conversation, message_body=body
+        )
+
+    def assertChanged(self, etag):
+        """The old ETag no longer matches; returns the new one."""
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+        self.assertEqual(
+            self.client.get(self.url, HTTP_IF_NONE_MATCH=response["ETag"]).status_code, 304
+        )
+        return response["ETag"]
+
+    def test_not_modified(self):
+        etag = self.client.get(self.url)["ETag"]
+        # membership, the newest message and the change marker; nothing is written
+        with self.assertNumQueries(3):
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response["ETag"], etag)
+
+    def test_if_modified_since_is_not_trusted(self):
+        response = self.client.get(self.url)
+        self.assertNotIn("Last-Modified", response)
+        # whole-second dates cannot tell two writes in the same second apart
+        self.send("same second")
+        later = http_date(time.time() + 60)
+        self.assertEqual(self.client.get(self.url, HTTP_IF_MODIFIED_SINCE=later).status_code, 200)
+
+    def test_changes_on_create_edit_and_delete(self):
+        etag = self.client.get(self.url)["ETag"]
+        self.send("newest")
+        etag = self.assertChanged(etag)
+
+        # neither changes the newest message
+        self.older.message_body = "edited"
+        self.older.save()
+        etag = self.assertChanged(etag)
+        self.older.delete()
+        self.assertChanged(etag)
+
+
+@override_settings(
+    CACHES={
+        "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+        "fragments": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "fragments"},
+    }
+)
+class MessageFragmentCacheTests(TestCase):
+    """Message pages are assembled from serialized messages cached per version."""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username="alice", password="pass")
+        self.conversation = Conversation.objects.create()
+        self.conversation.participants.add(self.user)
+        self.messages = [
+            Message.objects.create(
+                sender=self.user, conversation=self.conversation, message_body=f"m{i}"
+            )
+            for i in range(3)
+        ]
+        self.url = reverse("conversation-messages", args=[self.conversation.pk])
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def bodies(self):
+        return [message["message_body"] for message in self.client.get(self.url).json()["results"]]
+
+    def test_warm_page_does_not_load_messages(self):
+        self.assertEqual(self.bodies(), ["m2", "m1", "m0"])
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.bodies(), ["m2", "m1", "m0"])
+        message_queries = [query["sql"] for query in queries if "chats_message" in query["sql"]]
+        # only the page query (ids, sent_at, version) and the ETag lookup
+        self.assertFalse([sql for sql in message_queries if "message_body" in sql])
+
+    def test_edit_bumps_version_and_page_shows_new_body(self):
+        self.bodies()
+        message = self.messages[1]
+        response = self.client.patch(
+            reverse("message-detail", args=[message.pk]), {"message_body": "edited"}, format="json"
+        )
+        self.assertEqual(response.status_code, 200)
+        message.refresh_from_db()
+        self.assertEqual(message.version, 2)
+        self.assertEqual(self.bodies(), ["m2", "edited", "m0"])
+
+    def test_deleted_message_disappears(self):
+        self.bodies()
+        self.messages[1].delete()
+        self.assertEqual(self.bodies(), ["m2", "m0"])
+
+    def test_stale_instances_get_distinct_versions(self):
+        first = Message.objects.get(pk=self.messages[1].pk)
+        second = Message.objects.get(pk=self.messages[1].pk)
+        first.message_body = "first"
+        first.save()
+        second.message_body = "second"
+        second.save()
+        self.assertEqual((first.version, second.version), (2, 3))
+        self.assertEqual(self.bodies(), ["m2", "second", "m0"])
+
+    def test_queryset_update_bumps_version(self):
+        self.bodies()
+        Message.objects.filter(pk=self.messages[1].pk).update(message_body="bulk")
+        self.assertEqual(Message.objects.get(pk=self.messages[1].pk).version, 2)
+        self.assertEqual(self.bodies(), ["m2", "bulk", "m0"])
+
+    def test_database_cache_stores_no_fragments(self):
+        database_cache = {"BACKEND": "django.core.cache.backends.db.DatabaseCache", "LOCATION": "chats_cache"}
+        with self.settings(CACHES={"default": database_cache}), \
+                mock.patch.object(DatabaseCache, "set_many") as set_many:
+            self.assertEqual(self.bodies(), ["m2", "m1", "m0"])
+            self.messages[1].message_body = "edited"
+            self.messages[1].save()
+            self.assertEqual(self.bodies(), ["m2", "edited", "m0"])
+        set_many.assert_not_called()
+
+
+class LocalCacheCheckTests(SimpleTestCase):
+    @override_settings(
+        CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+    )
+    def test_local_memory_cache_is_an_error(self):
+        self.assertEqual([error.id for error in check_shared_cache(None)], ["chats.E001"])
+        with self.settings(CHATS_ALLOW_LOCAL_CACHE=True):
+            self.assertEqual(check_shared_cache(None), [])
+
+    def test_configured_cache_is_shared(self):
+        self.assertEqual(check_shared_cache(None), [])
+
+
+class SharedBrokerCheckTests(SimpleTestCase):
+    @override_settings(DEBUG=False, CHATS_REALTIME_BROKER="chats.realtime.InMemoryBroker")
+    def test_in_memory_broker_warns_outside_debug(self):
+        self.assertEqual([message.id for message in check_shared_broker(None)], ["chats.W001"])
+
+    @override_settings(DEBUG=True, CHATS_REALTIME_BROKER="chats.realtime.InMemoryBroker")
+    def test_in_memory_broker_is_fine_in_debug(self):
+        self.assertEqual(check_shared_broker(None), [])
+
+    @override_settings(DEBUG=False, CHATS_REALTIME_BROKER="myproject.brokers.RedisBroker")
+    def test_shared_broker(self):
+        self.assertEqual(check_shared_broker(None), [])
+
+
+class LongPollTests(TransactionTestCase):
+    """``?since=`` blocks until a new message arrives, then returns it."""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username="alice", password="pass")
+        self.other = User.objects.create_user(username="bob", password="pass")
+        self.conversation = Conversation.objects.create()
+        self.conversation.participants.add(self.user, self.other)
+        self.url = reverse("conversation-messages", args=[self.conversation.pk])
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def send_later(self, delay, body):
+        def send():
+            try:
+                Message.objects.create(
+                    sender=self.other, conversation=self.conversation, message_body=body
+                )
+            finally:
+                connections.close_all()
+
+        timer = threading.Timer(delay, send)
+        timer.start()
+        self.addCleanup(timer.join)
+
+    def test_woken_by_new_message(self):
+        Message.objects.create(sender=self.other, conversation=self.conversation, message_body="old")
+        since = self.client.get(self.url).json()["since"]
+
+        self.send_later(0.3, "new")
+        start = time.monotonic()
+        response = self.client.get(self.url, {"since": since, "wait": 10})
+        self.assertLess(time.monotonic() - start, 5)
+        self.assertEqual(response.status_code, 200)
+        body = response.json()
+        self.assertEqual([message["message_body"] for message in body["results"]], ["new"])
+        self.assertNotEqual(body["since"], since)
+
+    def test_times_out_with_not_modified(self):
+        Message.objects.create(sender=self.other, conversation=self.conversation, message_body="old")
+        since = self.client.get(self.url).json()["since"]
+        params = {"since": since, "wait": 0.1}
+        response = self.client.get(self.url, params)
+        self.assertEqual(response.json()["results"], [])
+        response = self.client.get(self.url, params, HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(response.status_code, 304)
+
+
+    def test_waiting_polls_are_capped(self):
+        Message.objects.create(sender=self.other, conversation=self.conversation, message_body="old")
+        since = self.client.get(self.url).json()["since"]
+        exhausted = threading.BoundedSemaphore(1)
+        exhausted.acquire()
+        with mock.patch.object(views, "long_poll_slots", exhausted):
+            start = time.monotonic()
+            response = self.client.get(self.url, {"since": since, "wait": 10})
+            self.assertLess(time.monotonic() - start, 5)
+            self.assertEqual(response.status_code, 503)
+            self.assertEqual(response["Retry-After"], str(views.LONG_POLL_RETRY_AFTER))
+
+            # a poll with something to return never waits, so needs no slot
+            Message.objects.create(sender=self.other, conversation=self.conversation, message_body="new")
+            response = self.client.get(self.url, {"since": since, "wait": 10})
+            self.assertEqual(response.status_code, 200)
+
+
+class RouterLongPollTests(SimpleTestCase):
+    """Under ASGI long polls wait in the router and the view is only asked for wait=0."""
+
+    def setUp(self):
+        self.conversation_id = "5c9a1f0e-4b9e-4d6f-9a53-0c1d2e3f4a5b"
+        self.calls = []
+        self.router = RealtimeRouter(self.application)
+
+    async def application(self, scope, receive, send):
+        """Stands in for Django: empty until a message has been announced."""
+        self.calls.append(parse_qs(scope["query_string"].decode()))
+        results = ["new"] if len(self.calls) > 1 else []
+        await send({
+            "type": "http.response.start",
+            "status": 200,
+            "headers": [(b"content-type", b"application/json")],
+        })
+        await send({"type": "http.response.body", "body": json.dumps({"results": results}).encode()})
+
+    async def poll(self, wait):
+        incoming, outgoing = asyncio.Queue(), asyncio.Queue()
+        await incoming.put({"type": "http.request", "body": b"", "more_body": False})
+        scope = {
+            "type": "http",
+            "method": "GET",
+            "path": f"/api/conversations/{self.conversation_id}/messages/",
+            "query_string": f"since=abc&wait={wait}".encode(),
+            "headers": [],
+        }
+        await self.router(scope, incoming.get, outgoing.put)
+        await outgoing.get()
+        return json.loads((await outgoing.get())["body"])["results"]
+
+    async def test_woken_by_event(self):
+        channel = conversation_channel(self.conversation_id)
+        loop = asyncio.get_running_loop()
+        loop.call_later(0.2, hub.deliver, channel, json.dumps({"type": "message.created"}))
+        start = time.monotonic()
+        self.assertEqual(await self.poll(10), ["new"])
+        self.assertLess(time.monotonic() - start, 5)
+        self.assertEqual([call["wait"] for call in self.calls], [["0"], ["0"]])
+        self.assertEqual(hub.subscriber_count(channel), 0)
+
+    async def test_times_out_with_first_answer(self):
+        self.assertEqual(await self.poll(0.1), [])
+        self.assertEqual(len(self.calls), 1)
+
+
+class FastSerializerTests(TestCase):
+    """The .values() serializers and orjson renderer emit the same JSON as DRF."""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username="alice", password="pass")
+        self.other = User.objects.create_user(username="bob", password="pass", phone_number="555")
+        for i in range(3):
+            conversation = Conversation.objects.create()
+            conversation.participants.add(self.user, self.other)
+            if i:
+                Message.objects.create(
+                    sender=self.other, conversation=conversation, message_body=f"héllo {i} ✓"
+                )
+        Conversation.objects.create().participants.add(self.user)
+
+    def assertSameJSON(self, expected, actual):
+        self.assertEqual(JSONRenderer().render(expected), FastJSONRenderer().render(actual))
+
+    def test_messages_match_message_serializer(self):
+        messages = Message.objects.order_by("-sent_at", "-message_id")
+        self.assertSameJSON(
+            MessageSerializer(messages, many=True).data,
+            MessageValuesSerializer.serialize(MessageValuesSerializer.values(messages)),
+        )
+
+    def test_conversations_match_list_serializer(self):
+        conversations = (
+            Conversation.objects.filter(participants=self.user)
+            .with_last_message()
+            .order_by("created_at")
+        )
+        expected = ConversationListSerializer(
+            conversations.prefetch_related("participants"), many=True
+        ).data
+        with self.assertNumQueries(2):
+            actual = ConversationListValuesSerializer.serialize(
+                ConversationListValuesSerializer.values(conversations)
+            )
+        self.assertSameJSON(expected, actual)
+
+    def test_error_with_integer_keys_renders(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        response = client.post(
+            reverse("conversation-bulk-read"), {"conversations": ["nope"]}, format="json"
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("0", response.json()["conversations"])
+        self.assertSameJSON(response.data, response.data)
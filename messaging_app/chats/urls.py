@@ -1,7 +1,17 @@
 from django.urls import path
 from .auth import CustomTokenObtainPairView, CustomTokenRefreshView
  
-from .views import conversation_detail, conversation_list_create, message_list_create, message_detail
+from .views import (
+    conversation_bulk_mark_read,
+    conversation_detail,
+    conversation_list_create,
+    conversation_mark_read,
+    inbox,
+    message_bulk_create,
+    message_detail,
+    message_list_create,
+    message_search,
+)
 urlpatterns = [
     path('api/token/', CustomTokenObtainPairView.as_view(), name='token_obtain_pair'),
     path('api/token/refresh/', CustomTokenRefreshView.as_view(), name='token_refresh'),
@@ -16,6 +26,15 @@ urlpatterns = [
         conversation_detail,
         name="conversation-detail",
     ),
+    path(
+        "conversations/<uuid:conversation_id>/read/",
+        conversation_mark_read,
+        name="conversation-read",
+    ),
+    path("conversations/read/", conversation_bulk_mark_read, name="conversation-bulk-read"),
+    path("inbox/", inbox, name="inbox"),
     path("messages/", message_list_create, name="message-list"),
+    path("messages/bulk/", message_bulk_create, name="message-bulk-create"),
+    path("messages/search/", message_search, name="message-search"),
     path("messages/<uuid:message_id>/", message_detail, name="message-detail"),
 ]
@@ -1,3 +1,7 @@
+import threading
+
+from django.db import transaction
+from django.utils import timezone
 from rest_framework import status
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import IsAuthenticated
@@ -5,10 +9,21 @@ from rest_framework.response import Response
 
 from chats.permissions import IsParticipantOfConversation
 
-from .models import Conversation, Message
-from .serializers import ConversationSerializer, MessageSerializer
+from . import conditional, fragments, realtime
+
+from .fast_serializers import ConversationListValuesSerializer
+from .models import Conversation, InboxEntry, Message
+from .serializers import (
+    BulkMessageItemSerializer,
+    BulkReadSerializer,
+    ConversationSerializer,
+    InboxEntrySerializer,
+    MessageSerializer,
+)
+from .signals import mark_read, messages_created
 from .filters import MessageFilter
-from .pagination import MessagePagination
+from .pagination import MessageCursorPagination
+from .search import search_messages
 
 
 # CRUD for Conversation
@@ -17,9 +32,9 @@ from .pagination import MessagePagination
 def conversation_list_create(request):
     """List all conversations for user, or create a new one."""
     if request.method == "GET":
-        conversations = Conversation.objects.filter(participants=request.user)
-        serializer = ConversationSerializer(conversations, many=True)
-        return Response(serializer.data)
+        conversations = Conversation.objects.filter(participants=request.user).with_last_message()
+        rows = ConversationListValuesSerializer.values(conversations)
+        return Response(ConversationListValuesSerializer.serialize(rows))
 
     elif request.method == "POST":
         serializer = ConversationSerializer(data=request.data)
@@ -38,13 +53,15 @@ def conversation_list_create(request):
 def conversation_detail(request, conversation_id):
     """Retrieve, update, or delete a conversation."""
     try:
-        conversation = Conversation.objects.get(conversation_id=conversation_id)
+        conversation = Conversation.objects.with_membership(request.user).get(
+            conversation_id=conversation_id
+        )
     except Conversation.DoesNotExist:
         return Response(
             {"detail": "Conversation not found."}, status=status.HTTP_404_NOT_FOUND
         )
     if not IsParticipantOfConversation().has_object_permission(
-        request.user, None, conversation
+        request, None, conversation
     ):
         return Response({"detail": "Forbidden."}, status=status.HTTP_403_FORBIDDEN)
 
@@ -66,6 +83,43 @@ def conversation_detail(request, conversation_id):
         return Response(status=status.HTTP_204_NO_CONTENT)
 
 
+# Inbox
+@api_view(["GET"])
+@permission_classes([IsAuthenticated])
+def inbox(request):
+    """The user's conversations, most recently active first, with unread counts."""
+    entries = (
+        InboxEntry.objects.filter(user=request.user)
+        .select_related("last_message__sender")
+        .order_by("-last_activity_at")
+    )
+    return Response(InboxEntrySerializer(entries, many=True).data)
+
+
+@api_view(["POST"])
+@permission_classes([IsAuthenticated])
+def conversation_mark_read(request, conversation_id):
+    """Reset the user's unread count for a conversation."""
+    if not mark_read(request.user, [conversation_id], timezone.now()):
+        return Response(
+            {"detail": "Conversation not found."}, status=status.HTTP_404_NOT_FOUND
+        )
+    return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+@api_view(["POST"])
+@permission_classes([IsAuthenticated])
+def conversation_bulk_mark_read(request):
+    """Reset the user's unread counts for many conversations with one UPDATE."""
+    serializer = BulkReadSerializer(data=request.data)
+    if not serializer.is_valid():
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+    updated = mark_read(
+        request.user, serializer.validated_data["conversations"], timezone.now()
+    )
+    return Response({"updated": updated})
+
+
 # CRUD for Message
 @api_view(["GET", "POST"])
 @permission_classes([IsAuthenticated])
@@ -74,19 +128,30 @@ def message_list_create(request, conversation_id=None):
     # If conversation_id is provided, ensure user is a participant
     if conversation_id:
         try:
-            conversation = Conversation.objects.get(conversation_id=conversation_id)
+            conversation = Conversation.objects.with_membership(request.user).get(
+                conversation_id=conversation_id
+            )
         except Conversation.DoesNotExist:
             return Response(
                 {"detail": "Conversation not found."},
                 status=status.HTTP_404_NOT_FOUND,
             )
 
-        if not IsParticipantOfConversation().has_object_permission(
-            request.user, None, conversation
-        ):
+        # reading and posting both require membership
+        if not conversation.is_participant:
             return Response({"detail": "Forbidden."}, status=status.HTTP_403_FORBIDDEN)
 
     if request.method == "GET":
+        since = request.query_params.get("since")
+        # --- Conditional GET: answer 304 before querying the page ---
+        if conversation_id and since is None:
+            etag = conditional.etag(request, conversation_id)
+            not_modified = conditional.not_modified(request, etag)
+            if not_modified is not None:
+                for header, value in conditional.http_headers(etag).items():
+                    not_modified[header] = value
+                return not_modified
+
         messages = Message.objects.filter(
             conversation__conversation_id=conversation_id
         )
@@ -95,13 +160,19 @@ def message_list_create(request, conversation_id=None):
         if filterset.is_valid():
             messages = filterset.qs
 
-        # --- Pagination ---
-        paginator = MessagePagination()
-        paginated_messages = paginator.paginate_queryset(messages, request)
+        paginator = MessageCursorPagination()
+        if conversation_id and since is not None:
+            # --- Long poll: messages after ``since``, waiting for new ones ---
+            return message_long_poll(request, conversation_id, paginator, messages, since)
 
-        # Serialize the paginated messages
-        serializer = MessageSerializer(paginated_messages, many=True)
-        return paginator.get_paginated_response(serializer.data)
+        # --- Pagination (keyset over sent_at, message_id) ---
+        # page ids and versions only, serialized messages come from the fragment cache
+        rows = paginator.paginate_queryset(fragments.page_values(messages), request)
+        response = paginator.get_paginated_response(fragments.serialize_page(rows))
+        if conversation_id:
+            for header, value in conditional.http_headers(etag).items():
+                response[header] = value
+        return response
 
     elif request.method == "POST":
         data = request.data.copy()
@@ -115,12 +186,167 @@ def message_list_create(request, conversation_id=None):
 
 
 
+# long polls blocked in a view at once, per process. Each holds a worker
+# thread, so this only applies to WSGI servers; under ASGI the waiting is
+# done by chats.realtime.RealtimeRouter and the view always gets wait=0
+LONG_POLL_MAX_BLOCKED = 8
+LONG_POLL_RETRY_AFTER = 2
+
+long_poll_slots = threading.BoundedSemaphore(LONG_POLL_MAX_BLOCKED)
+
+
+def message_long_poll(request, conversation_id, paginator, messages, since):
+    """
+    Messages newer than the ``since`` token. If there are none, block for
+    up to ``wait`` seconds (default ``realtime.LONG_POLL_DEFAULT_WAIT``,
+    at most ``realtime.LONG_POLL_MAX_WAIT``) until a new message in the
+    conversation wakes the request. The response carries the ``since``
+    token for the next poll; an unchanged empty result is ``304`` for a
+    matching ``If-None-Match``. When ``LONG_POLL_MAX_BLOCKED`` polls are
+    already waiting the answer is ``503`` with ``Retry-After``.
+    """
+    wait = realtime.long_poll_wait(request.query_params.get("wait"))
+
+    # register before querying, so a message committed in between still wakes us
+    with realtime.hub.waiter(realtime.conversation_channel(conversation_id)) as woken:
+        messages = fragments.page_values(messages)
+        rows = paginator.paginate_since(messages, request, since)
+        if not rows and wait:
+            if not long_poll_slots.acquire(blocking=False):
+                response = Response(
+                    {"detail": "Too many waiting requests."},
+                    status=status.HTTP_503_SERVICE_UNAVAILABLE,
+                )
+                response["Retry-After"] = str(LONG_POLL_RETRY_AFTER)
+                return response
+            try:
+                if woken.wait(wait):
+                    rows = paginator.paginate_since(messages, request, since)
+            finally:
+                long_poll_slots.release()
+
+    etag = conditional.etag(request, conversation_id)
+    response = None
+    if not rows:
+        response = conditional.not_modified(request, etag)
+    if response is None:
+        response = paginator.get_paginated_response(fragments.serialize_page(rows))
+    for header, value in conditional.http_headers(etag).items():
+        response[header] = value
+    return response
+
+
+BULK_MAX_MESSAGES = 1000
+BULK_CHUNK_SIZE = 500
+
+
+@api_view(["POST"])
+@permission_classes([IsAuthenticated])
+def message_bulk_create(request):
+    """
+    Send up to ``BULK_MAX_MESSAGES`` messages, possibly to many conversations.
+
+    Accepts a list of ``{"conversation", "message_body"}`` objects (or
+    ``{"messages": [...]}``). Items are validated independently; membership
+    of every referenced conversation is checked with one query and valid
+    items are inserted with ``bulk_create`` in chunks of
+    ``BULK_CHUNK_SIZE``. The response lists the created messages and the
+    errors of the rejected items, each with its index in the request.
+    """
+    items = request.data.get("messages") if isinstance(request.data, dict) else request.data
+    if not isinstance(items, list) or not items:
+        return Response(
+            {"detail": "Expected a non-empty list of messages."},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+    if len(items) > BULK_MAX_MESSAGES:
+        return Response(
+            {"detail": f"At most {BULK_MAX_MESSAGES} messages per request."},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+
+    errors = []
+    valid = []
+    for index, item in enumerate(items):
+        serializer = BulkMessageItemSerializer(data=item)
+        if serializer.is_valid():
+            valid.append((index, serializer.validated_data))
+        else:
+            errors.append({"index": index, "errors": serializer.errors})
+
+    member_of = set(
+        Conversation.participants.through.objects.filter(
+            user=request.user,
+            conversation_id__in={data["conversation"] for _, data in valid},
+        ).values_list("conversation_id", flat=True)
+    )
+    indexes = []
+    messages = []
+    for index, data in valid:
+        if data["conversation"] not in member_of:
+            errors.append(
+                {"index": index, "errors": {"conversation": ["Not a participant of this conversation."]}}
+            )
+            continue
+        indexes.append(index)
+        messages.append(
+            Message(
+                sender=request.user,
+                conversation_id=data["conversation"],
+                message_body=data["message_body"],
+            )
+        )
+
+    if messages:
+        with transaction.atomic():
+            Message.objects.bulk_create(messages, batch_size=BULK_CHUNK_SIZE)
+            # bulk_create sends no post_save
+            messages_created(request.user.pk, messages)
+
+    created = [
+        {"index": index, "message_id": message.message_id, "sent_at": message.sent_at}
+        for index, message in zip(indexes, messages)
+    ]
+    errors.sort(key=lambda error: error["index"])
+    if not created:
+        code = status.HTTP_400_BAD_REQUEST
+    elif errors:
+        code = status.HTTP_207_MULTI_STATUS
+    else:
+        code = status.HTTP_201_CREATED
+    return Response({"created": created, "errors": errors}, status=code)
+
+
+@api_view(["GET"])
+@permission_classes([IsAuthenticated])
+def message_search(request):
+    """
+    Full-text search over the user's messages, best match first.
+
+    ``q`` is the query, ``conversation`` optionally restricts it to one
+    conversation and ``limit`` (default 20, at most 100) caps the results.
+    """
+    try:
+        limit = max(1, min(int(request.query_params.get("limit", 20)), 100))
+    except ValueError:
+        limit = 20
+    messages = Message.objects.filter(conversation__participants=request.user)
+    conversation_id = request.query_params.get("conversation")
+    if conversation_id:
+        filterset = MessageFilter({"conversation": conversation_id}, queryset=messages)
+        if not filterset.is_valid():
+            return Response(filterset.errors, status=status.HTTP_400_BAD_REQUEST)
+        messages = filterset.qs
+    results = search_messages(messages.select_related("sender"), request.query_params.get("q"))
+    return Response({"results": MessageSerializer(results[:limit], many=True).data})
+
+
 @api_view(["GET", "PUT", "PATCH", "DELETE"])
 @permission_classes([IsAuthenticated])
 def message_detail(request, message_id):
     """Retrieve, update, or delete a message."""
     try:
-        message = Message.objects.get(message_id=message_id)
+        message = Message.objects.with_membership(request.user).get(message_id=message_id)
     except Message.DoesNotExist:
         return Response(
             {"detail": "Message not found."}, status=status.HTTP_404_NOT_FOUND
@@ -129,8 +355,8 @@ def message_detail(request, message_id):
     # --- Permission Check ---
     conversation_permission = IsParticipantOfConversation()
     if (
-        request.user != message.sender
-        and not conversation_permission.has_object_permission(request.user, None, message.conversation)
+        request.user.pk != message.sender_id
+        and not conversation_permission.has_object_permission(request, None, message)
     ):
         return Response({"detail": "Forbidden."}, status=status.HTTP_403_FORBIDDEN)
     
@@ -13,4 +13,9 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'messaging_app.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# imported after setup: serves the WebSocket/SSE push endpoints, Django the rest
+from chats.realtime import RealtimeRouter  # noqa: E402
+
+application = RealtimeRouter(django_application)
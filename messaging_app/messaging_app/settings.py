@@ -93,6 +93,41 @@ DATABASES = {
     }
 }
 
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+# The chats app keeps membership versions and conditional-GET markers in
+# the default cache, so every worker process must share it (a local-memory
+# cache fails the chats.E001 check). Serialized messages go to the
+# "fragments" cache so their volume cannot evict those keys.
+# Set REDIS_URL in deployments. Without it the database cache is used
+# (`python manage.py createcachetable`); it counts its table on every
+# write and culls arbitrary keys past MAX_ENTRIES, so keep that limit well
+# above the number of users and conversations. Serialized messages are
+# not cached in it at all (see chats.fragments).
+
+REDIS_URL = os.environ.get('REDIS_URL')
+
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+        },
+        'fragments': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ.get('REDIS_FRAGMENTS_URL', REDIS_URL),
+            'KEY_PREFIX': 'fragments',
+        },
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+            'LOCATION': 'chats_cache',
+            'OPTIONS': {'MAX_ENTRIES': 100000, 'CULL_FREQUENCY': 10},
+        },
+    }
+
 AUTH_USER_MODEL = 'chats.User'
 
 REST_FRAMEWORK = {
@@ -104,6 +139,10 @@ REST_FRAMEWORK = {
         "rest_framework.authentication.SessionAuthentication",
         "rest_framework_simplejwt.authentication.JWTAuthentication",
     ],
+    "DEFAULT_RENDERER_CLASSES": [
+        "chats.renderers.FastJSONRenderer",
+        "rest_framework.renderers.BrowsableAPIRenderer",
+    ],
     "DEFAULT_FILTER_BACKENDS": [
         "django_filters.rest_framework.DjangoFilterBackend"
     ],
@@ -115,8 +154,17 @@ SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(minutes=30),
     'REFRESH_TOKEN_LIFETIME': timedelta(days=1),
     'AUTH_HEADER_TYPES': ('Bearer',),
+    'USER_ID_FIELD': 'user_id',
 }
 
+# Transport for realtime message events between ASGI processes, see
+# chats.realtime. The in-memory broker only reaches the process that saved
+# a message: with several workers, WebSockets and event streams elsewhere
+# miss it and long polls elsewhere return only when their wait runs out, so
+# multi-worker deployments need a shared broker (chats.W001 warns outside
+# DEBUG).
+CHATS_REALTIME_BROKER = 'chats.realtime.InMemoryBroker'
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
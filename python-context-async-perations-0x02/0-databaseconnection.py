@@ -1,22 +1,135 @@
+import os
+import re
+import sys
+import keyword
 import sqlite3
+import functools
+import dataclasses
+from collections import namedtuple
+from urllib.request import pathname2url
+
+
+@functools.lru_cache(maxsize=128)
+def _field_names(description):
+    """Column names made safe for use as attribute names."""
+    names = []
+    for index, column in enumerate(description):
+        name = re.sub(r"\W", "_", column[0])
+        if (
+            not name.isidentifier()
+            or keyword.iskeyword(name)
+            or name.startswith("_")
+            or name in names
+        ):
+            name = f"col{index}"
+        names.append(name)
+    return tuple(names)
+
+
+@functools.lru_cache(maxsize=128)
+def _namedtuple_type(fields):
+    return namedtuple("Row", fields)
+
+
+@functools.lru_cache(maxsize=128)
+def _dataclass_type(fields):
+    return dataclasses.make_dataclass("Row", fields, slots=True)
+
+
+def namedtuple_factory(cursor, row):
+    return _namedtuple_type(_field_names(cursor.description))(*row)
+
+
+def dict_factory(cursor, row):
+    return {column[0]: value for column, value in zip(cursor.description, row)}
+
+
+def dataclass_factory(cursor, row):
+    """Rows as ``__slots__`` dataclass instances: attribute access, small footprint."""
+    return _dataclass_type(_field_names(cursor.description))(*row)
+
+
+ROW_FACTORIES = {
+    "tuple": None,
+    "namedtuple": namedtuple_factory,
+    "dict": dict_factory,
+    "dataclass": dataclass_factory,
+}
+
+
+def resolve_row_factory(row_factory):
+    """Accept a name from ROW_FACTORIES, a callable, or None for plain tuples."""
+    if row_factory is None or callable(row_factory):
+        return row_factory
+    try:
+        return ROW_FACTORIES[row_factory]
+    except KeyError:
+        raise ValueError(
+            f"unknown row factory {row_factory!r}, expected one of {sorted(ROW_FACTORIES)}"
+        ) from None
+
+
+def stream_rows(cursor, batch_size=500):
+    """
+    Yield the rows of an executed cursor lazily, ``batch_size`` at a time.
+
+    Only one batch is held in memory, so large scans stay flat. The
+    generator must be consumed before the connection is closed.
+    """
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            return
+        yield from rows
+
+
+# PRAGMA profiles and read/write statement routing are shared with the
+# connection pool of python-decorators-0x01/1-with_db_connection.py
+sys.path.append(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "python-decorators-0x01")
+)
+pooling = __import__("1-with_db_connection")
+PRAGMA_PROFILES = pooling.PRAGMA_PROFILES
+apply_pragmas = pooling.apply_pragmas
+is_read_statement = pooling.is_read_statement
+enable_wal = pooling.enable_wal
+
+
+def read_only_uri(db_name):
+    return f"file:{pathname2url(os.path.abspath(db_name))}?mode=ro"
+
 
 class DatabaseConnection:
-    def __init__(self, db_name):
+    def __init__(self, db_name, row_factory=None, read_only=False, profile=None):
         self.db_name = db_name
+        self.row_factory = resolve_row_factory(row_factory)
+        self.read_only = read_only
+        self.profile = profile
         self.conn = None
-        
+
     def __enter__(self):
-        self.conn = sqlite3.connect(self.db_name)
+        if self.read_only:
+            self.conn = sqlite3.connect(read_only_uri(self.db_name), uri=True)
+        else:
+            self.conn = sqlite3.connect(self.db_name)
+        apply_pragmas(self.conn, self.profile)
+        self.conn.row_factory = self.row_factory
         return self.conn.cursor()
-    
+
     def __exit__(self, exc_type, exc_val, exc_tb):
         if self.conn:
             self.conn.commit()
             self.conn.close()
-            
+
 
 if __name__ == "__main__":
     with DatabaseConnection("users.db") as cursor:
         cursor.execute("SELECT * FROM users")
         results = cursor.fetchall()
-        print(results)
\ No newline at end of file
+        print(results)
+
+    # stream the same scan lazily as slotted dataclass rows
+    with DatabaseConnection("users.db", row_factory="dataclass") as cursor:
+        cursor.execute("SELECT * FROM users")
+        for user in stream_rows(cursor, batch_size=2):
+            print(user)
@@ -1,29 +1,214 @@
+import re
+import queue
 import sqlite3
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+# row factories and lazy fetchmany iteration, see Task 0
+databaseconnection = __import__("0-databaseconnection")
+
+# string literals, quoted identifiers and comments can contain a literal "?"
+_NOT_PLACEHOLDER_RE = re.compile(r"'(?:[^']|'')*'|\"(?:[^\"]|\"\")*\"|--[^\n]*|/\*.*?\*/", re.S)
+_PLACEHOLDER_RE = re.compile(r"\?\d*|[:@$][A-Za-z_]\w*")
+
+
+class PreparedQuery:
+    """
+    A query parsed once and reused by ``QueryExecutor``.
+
+    Keeping one canonical SQL string per query means sqlite3's own
+    statement cache (sized by ``cached_statements``) always hits, so the
+    statement is compiled once per connection, and bad parameter counts
+    are rejected before reaching SQLite.
+    """
+
+    __slots__ = ("sql", "placeholders", "named", "uses")
+
+    def __init__(self, sql):
+        self.sql = sql.strip()
+        found = _PLACEHOLDER_RE.findall(_NOT_PLACEHOLDER_RE.sub("", self.sql))
+        self.named = any(p[0] in ":@$" for p in found)
+        numbered = [int(p[1:]) for p in found if p.startswith("?") and len(p) > 1]
+        self.placeholders = max(numbered) if numbered else sum(p == "?" for p in found)
+        self.uses = 0
+
+    def check(self, params):
+        if self.named or isinstance(params, dict):
+            return
+        if len(params) != self.placeholders:
+            raise sqlite3.ProgrammingError(
+                f"query expects {self.placeholders} parameter(s), got {len(params)}: {self.sql}"
+            )
+
+
+class QueryExecutor:
+    """
+    Reusable, parameterized query runner over one connection.
+
+    ``execute`` returns all rows, ``iter`` streams them with fetchmany and
+    ``executemany`` runs a statement over many parameter sets. Queries are
+    kept in an LRU of ``PreparedQuery`` objects of size ``max_prepared``.
+    """
+
+    def __init__(self, db_name, cached_statements=256, max_prepared=256, row_factory=None,
+                 profile=None, **connect_kwargs):
+        self.conn = sqlite3.connect(db_name, cached_statements=cached_statements, **connect_kwargs)
+        databaseconnection.apply_pragmas(self.conn, profile)
+        self.conn.row_factory = databaseconnection.resolve_row_factory(row_factory)
+        self.max_prepared = max_prepared
+        self._prepared = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def prepare(self, sql):
+        prepared = self._prepared.get(sql)
+        if prepared is None:
+            self.misses += 1
+            prepared = self._prepared[sql] = PreparedQuery(sql)
+            if len(self._prepared) > self.max_prepared:
+                self._prepared.popitem(last=False)
+        else:
+            self.hits += 1
+            self._prepared.move_to_end(sql)
+        prepared.uses += 1
+        return prepared
+
+    def _cursor(self, sql, params):
+        prepared = self.prepare(sql)
+        params = () if params is None else params
+        prepared.check(params)
+        return self.conn.execute(prepared.sql, params)
+
+    def execute(self, sql, params=None):
+        return self._cursor(sql, params).fetchall()
+
+    def iter(self, sql, params=None, batch_size=500):
+        return databaseconnection.stream_rows(self._cursor(sql, params), batch_size)
+
+    def executemany(self, sql, seq_of_params):
+        prepared = self.prepare(sql)
+        return self.conn.executemany(prepared.sql, seq_of_params).rowcount
+
+    def commit(self):
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.conn.commit()
+        else:
+            self.conn.rollback()
+        self.conn.close()
+
+
+class RoutedExecutor:
+    """
+    ``QueryExecutor`` interface over a WAL database split into one writer
+    and ``readers`` read-only connections.
+
+    Read statements go to whichever reader is free and never wait for the
+    writer; everything else is serialized on the writer and committed.
+    Safe to share between threads.
+    """
+
+    def __init__(self, db_name, readers=4, **executor_kwargs):
+        self.journal_mode = databaseconnection.enable_wal(db_name)
+        executor_kwargs.setdefault("check_same_thread", False)
+        self.writer = QueryExecutor(db_name, **executor_kwargs)
+        self._write_lock = threading.Lock()
+        self._readers = queue.LifoQueue()
+        for _ in range(readers):
+            self._readers.put(
+                QueryExecutor(databaseconnection.read_only_uri(db_name), uri=True, **executor_kwargs)
+            )
+
+    @contextmanager
+    def reader(self):
+        executor = self._readers.get()
+        try:
+            yield executor
+        finally:
+            self._readers.put(executor)
+
+    def execute(self, sql, params=None):
+        """Rows for read statements, the affected row count for writes."""
+        if databaseconnection.is_read_statement(sql):
+            with self.reader() as executor:
+                return executor.execute(sql, params)
+        with self._write_lock:
+            try:
+                cursor = self.writer._cursor(sql, params)
+                self.writer.commit()
+            except BaseException:
+                self.writer.conn.rollback()
+                raise
+            return cursor.rowcount
+
+    def executemany(self, sql, seq_of_params):
+        with self._write_lock:
+            try:
+                rowcount = self.writer.executemany(sql, seq_of_params)
+                self.writer.commit()
+            except BaseException:
+                self.writer.conn.rollback()
+                raise
+            return rowcount
+
+    def iter(self, sql, params=None, batch_size=500):
+        """Stream a read statement; the reader is held until the generator finishes."""
+        with self.reader() as executor:
+            yield from executor.iter(sql, params, batch_size)
+
+    def close(self):
+        self.writer.close()
+        while not self._readers.empty():
+            self._readers.get_nowait().close()
+
 
 class ExecuteQuery:
-    def __init__(self, db_name, query, params = None):
+    """
+    Run ``query`` and hand back its rows.
+
+    By default all rows are fetched into a list. With ``stream=True`` the
+    context yields a generator reading ``batch_size`` rows at a time,
+    which must be consumed inside the ``with`` block.
+    """
+
+    def __init__(self, db_name, query, params = None, stream=False, batch_size=500, row_factory=None,
+                 profile=None):
         self.db_name = db_name
         self.query = query
         self.params = params or []
-        self.conn = None
-        self.cursor = None
-        
+        self.stream = stream
+        self.batch_size = batch_size
+        self.row_factory = row_factory
+        self.profile = profile
+        self.executor = None
+
     def __enter__(self):
-        self.conn = sqlite3.connect(self.db_name)
-        self.cursor = self.conn.cursor()
-        
-        if self.params:
-            self.cursor.execute(self.query)
-        else:
-            self.cursor.execute(self.query)
-        return self.cursor.fetchall()
-    
+        self.executor = QueryExecutor(self.db_name, row_factory=self.row_factory, profile=self.profile)
+        if self.stream:
+            return self.executor.iter(self.query, self.params, self.batch_size)
+        return self.executor.execute(self.query, self.params)
+
     def __exit__(self, exc_type, exc_val, exc_tb):
-        if self.conn:
-            self.conn.commit()
-            self.conn.close()
-            
+        if self.executor:
+            self.executor.commit()
+            self.executor.close()
+
 if __name__ == "__main__":
     query = "SELECT * FROM users WHERE age > ?"
     with ExecuteQuery("users.db", query, (25,)) as results:
         print(results)
+
+    # one executor, many parameterized runs of the same compiled statement
+    with QueryExecutor("users.db", row_factory="namedtuple") as executor:
+        for age in (20, 30, 40):
+            print(age, [user.name for user in executor.iter(query, (age,))])
+        print(f"prepared cache: {executor.hits} hits, {executor.misses} misses")
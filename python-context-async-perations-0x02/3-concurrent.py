@@ -1,22 +1,147 @@
 import aiosqlite
 import asyncio
+import sqlite3
+from contextlib import asynccontextmanager
 
-async def async_fetch_users():
-    async with aiosqlite.connect("users.db") as db:
-        async with db.execute("SELECT * FROM users") as cursor:
-            return await cursor.fetchall()
 
-async def async_fetch_older_users():
-    async with aiosqlite.connect("users.db") as db:
-        async with db.execute("SELECT * FROM users WHERE age > 40") as cursor:
-            return await cursor.fetchall()
+class AsyncPool:
+    """
+    Reusable aiosqlite connections with bounded concurrency.
+
+    At most ``max_size`` connections exist and are checked out at once;
+    further callers wait (up to ``acquire_timeout`` seconds). Each query
+    run through ``fetchall`` is limited to ``query_timeout`` seconds.
+    Release is shielded from cancellation, and a connection whose query
+    was cancelled midway is interrupted and closed instead of reused.
+    """
+
+    def __init__(self, db_name, max_size=8, acquire_timeout=None, query_timeout=None):
+        self.db_name = db_name
+        self.max_size = max_size
+        self.acquire_timeout = acquire_timeout
+        self.query_timeout = query_timeout
+        self._idle = []
+        self._slots = asyncio.Semaphore(max_size)
+        self._closed = False
+
+    async def acquire(self):
+        await asyncio.wait_for(self._slots.acquire(), self.acquire_timeout)
+        try:
+            if self._closed:
+                raise RuntimeError("pool is closed")
+            if self._idle:
+                return self._idle.pop()
+            return await aiosqlite.connect(self.db_name)
+        except BaseException:
+            self._slots.release()
+            raise
+
+    async def release(self, conn, discard=False):
+        try:
+            if discard or self._closed:
+                await conn.interrupt()
+                await conn.close()
+            else:
+                if conn.in_transaction:
+                    await conn.rollback()
+                self._idle.append(conn)
+        except (sqlite3.Error, ValueError):
+            await conn.close()
+        finally:
+            self._slots.release()
+
+    @asynccontextmanager
+    async def connection(self):
+        conn = await self.acquire()
+        discard = False
+        try:
+            yield conn
+        except (asyncio.CancelledError, asyncio.TimeoutError):
+            # the query may still be running in aiosqlite's worker thread
+            discard = True
+            raise
+        finally:
+            await asyncio.shield(self.release(conn, discard))
+
+    async def fetchall(self, query, params=(), timeout=None):
+        timeout = self.query_timeout if timeout is None else timeout
+        async with self.connection() as conn:
+            async def run():
+                async with conn.execute(query, params) as cursor:
+                    return await cursor.fetchall()
+
+            return await asyncio.wait_for(run(), timeout)
+
+    async def close(self):
+        self._closed = True
+        idle, self._idle = self._idle, []
+        for conn in idle:
+            await conn.close()
+
+
+async def run_queries(pool, queries, concurrency=None, return_exceptions=False):
+    """
+    Run ``queries`` (SQL strings or ``(sql, params)`` pairs) on ``pool``.
+
+    At most ``concurrency`` queries (default: the pool size) run at once,
+    using that many worker tasks rather than one task per query. Yields
+    ``(index, rows)`` in completion order; with ``return_exceptions`` a
+    failed query yields ``(index, exception)`` instead of raising.
+    """
+    concurrency = min(concurrency or pool.max_size, pool.max_size)
+    pending = asyncio.Queue()
+    for index, query in enumerate(queries):
+        pending.put_nowait((index, (query, ()) if isinstance(query, str) else query))
+    total = pending.qsize()
+    results = asyncio.Queue()
+
+    async def worker():
+        while True:
+            try:
+                index, (sql, params) = pending.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            try:
+                await results.put((index, await pool.fetchall(sql, params)))
+            except Exception as e:
+                await results.put((index, e))
+
+    workers = [asyncio.create_task(worker()) for _ in range(concurrency)]
+    try:
+        for _ in range(total):
+            index, outcome = await results.get()
+            if isinstance(outcome, Exception) and not return_exceptions:
+                raise outcome
+            yield index, outcome
+    finally:
+        for task in workers:
+            task.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+
+
+async def async_fetch_users(pool):
+    return await pool.fetchall("SELECT * FROM users")
+
+async def async_fetch_older_users(pool):
+    return await pool.fetchall("SELECT * FROM users WHERE age > ?", (40,))
 
 async def fetch_concurrently():
-    all_users, older_users = await asyncio.gather(
-        async_fetch_users(), async_fetch_older_users()
-    )
-    print("All users: ", all_users)
-    print("Users older than 40: ", older_users)
+    pool = AsyncPool("users.db", max_size=4, query_timeout=5)
+    try:
+        all_users, older_users = await asyncio.gather(
+            async_fetch_users(pool), async_fetch_older_users(pool)
+        )
+        print("All users: ", all_users)
+        print("Users older than 40: ", older_users)
+
+        # hundreds of report queries, never more than 4 connections open
+        reports = [("SELECT COUNT(*) FROM users WHERE age > ?", (age,)) for age in range(200)]
+        done = 0
+        async for _, rows in run_queries(pool, reports):
+            done += 1
+        print(f"{done} report queries completed")
+    finally:
+        await pool.close()
 
 if __name__ == "__main__":
     asyncio.run(fetch_concurrently())
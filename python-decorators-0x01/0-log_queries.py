@@ -1,17 +1,182 @@
+import re
+import json
+import queue
+import atexit
+import random
 import sqlite3
+import hashlib
+import logging
 import functools
-from datetime import datetime
-
-def log_queries(func):
-    @functools.wraps(func)
-    def wrapper(*args, **kwargs):
-        query = (
-            kwargs.get("query") if "query" in kwargs else (args[0] if args else None)
-        )
-        print(f"[{datetime.now()}] Executing query: {query}")
-        return func(*args, **kwargs)
-
-    return wrapper
+import threading
+import time
+import inspect
+from logging.handlers import QueueHandler, QueueListener
+
+logger = logging.getLogger("queries")
+logger.setLevel(logging.INFO)
+logger.propagate = False
+
+# defaults for every @log_queries function, see configure_query_logging()
+settings = {"sample_rate": 1.0, "slow_query_ms": None}
+
+# callables receiving every query record, sampled or not (see Task 5)
+query_observers = []
+
+_listener = None
+_listener_lock = threading.Lock()
+
+LITERAL_RE = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+WHITESPACE_RE = re.compile(r"\s+")
+IN_LIST_RE = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+
+
+def normalize_sql(query):
+    """Strip literals and collapse whitespace so equivalent queries match."""
+    query = LITERAL_RE.sub("?", query or "")
+    # "IN (1, 2, 3)" and "IN (4, 5)" are the same query shape
+    query = IN_LIST_RE.sub("(...)", query)
+    return WHITESPACE_RE.sub(" ", query).strip().upper()
+
+
+def fingerprint(query):
+    return hashlib.blake2b(normalize_sql(query).encode(), digest_size=8).hexdigest()
+
+
+def params_hash(params):
+    if params is None:
+        return None
+    return hashlib.blake2b(repr(params).encode(), digest_size=8).hexdigest()
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        return json.dumps(getattr(record, "query", {"message": record.getMessage()}))
+
+
+def configure_query_logging(handler=None, sample_rate=None, slow_query_ms=None):
+    """
+    Route query records through a background thread to ``handler``.
+
+    Callers only enqueue records; formatting and I/O happen on the
+    listener thread. ``sample_rate`` is the fraction of successful,
+    fast queries that get logged; queries slower than ``slow_query_ms``
+    and failed queries are always logged.
+    """
+    global _listener
+    if sample_rate is not None:
+        settings["sample_rate"] = sample_rate
+    if slow_query_ms is not None:
+        settings["slow_query_ms"] = slow_query_ms
+    with _listener_lock:
+        if _listener is not None and handler is None:
+            return
+        if _listener is not None:
+            _listener.stop()
+            logger.handlers.clear()
+        if handler is None:
+            handler = logging.StreamHandler()
+        if handler.formatter is None:
+            handler.setFormatter(JsonFormatter())
+        records = queue.SimpleQueue()
+        logger.addHandler(QueueHandler(records))
+        _listener = QueueListener(records, handler)
+        _listener.start()
+
+
+@atexit.register
+def _flush_query_log():
+    if _listener is not None:
+        _listener.stop()
+
+
+def observe_queries(observer):
+    """Register ``observer(record)`` to see every query, regardless of sampling."""
+    query_observers.append(observer)
+    return observer
+
+
+def _should_log(duration_ns, error, sample_rate, slow_query_ms):
+    if error is not None:
+        return True
+    if slow_query_ms is not None and duration_ns >= slow_query_ms * 1_000_000:
+        return True
+    return sample_rate >= 1.0 or random.random() < sample_rate
+
+
+def _record_query(func, query, params, result, error, duration_ns, sample_rate, slow_query_ms):
+    rate = settings["sample_rate"] if sample_rate is None else sample_rate
+    slow = settings["slow_query_ms"] if slow_query_ms is None else slow_query_ms
+    log = _should_log(duration_ns, error, rate, slow)
+    if not (log or query_observers):
+        return
+    normalized = normalize_sql(query)
+    record = {
+        "ts": time.time(),
+        "function": func.__qualname__,
+        "fingerprint": fingerprint(normalized),
+        "query": normalized,
+        "params_hash": params_hash(params),
+        "duration_ns": duration_ns,
+        "rows": len(result) if isinstance(result, (list, tuple)) else None,
+        "error": None if error is None else f"{type(error).__name__}: {error}",
+        "slow": slow is not None and duration_ns >= slow * 1_000_000,
+    }
+    for observer in query_observers:
+        observer(record)
+    if log:
+        if _listener is None:
+            configure_query_logging()
+        logger.info("query", extra={"query": record})
+
+
+def _query_of(args, kwargs):
+    return kwargs.get("query") if "query" in kwargs else (args[0] if args else None)
+
+
+def log_queries(func=None, *, sample_rate=None, slow_query_ms=None):
+    def decorator(func):
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                error = None
+                result = None
+                start = time.perf_counter_ns()
+                try:
+                    result = await func(*args, **kwargs)
+                    return result
+                except Exception as e:
+                    error = e
+                    raise
+                finally:
+                    _record_query(
+                        func, _query_of(args, kwargs), kwargs.get("params"), result,
+                        error, time.perf_counter_ns() - start, sample_rate, slow_query_ms,
+                    )
+
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            error = None
+            result = None
+            start = time.perf_counter_ns()
+            try:
+                result = func(*args, **kwargs)
+                return result
+            except Exception as e:
+                error = e
+                raise
+            finally:
+                _record_query(
+                    func, _query_of(args, kwargs), kwargs.get("params"), result,
+                    error, time.perf_counter_ns() - start, sample_rate, slow_query_ms,
+                )
+
+        return wrapper
+
+    if func is None:
+        return decorator
+    return decorator(func)
 
 
 @log_queries
@@ -1,18 +1,542 @@
+import os
+import re
 import sqlite3
+import asyncio
+import inspect
 import functools
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager, asynccontextmanager
+from urllib.request import pathname2url
 
+try:
+    import aiosqlite
+except ImportError:  # only needed by the async variants
+    aiosqlite = None
+
+
+# PRAGMAs applied, in order, to every new connection of a profile
+PRAGMA_PROFILES = {
+    "default": {},
+    # every commit reaches disk before returning
+    "durable": {
+        "journal_mode": "WAL",
+        "synchronous": "FULL",
+        "busy_timeout": 5000,
+    },
+    # initial loads and migrations: speed over crash safety
+    "fast-bulk-load": {
+        "journal_mode": "MEMORY",
+        "synchronous": "OFF",
+        "cache_size": -262144,  # 256 MiB
+        "temp_store": "MEMORY",
+        "busy_timeout": 30000,
+    },
+    # many readers, occasional writers; reads served from mapped pages
+    "read-mostly": {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "cache_size": -65536,  # 64 MiB
+        "mmap_size": 268435456,  # 256 MiB
+        "temp_store": "MEMORY",
+        "busy_timeout": 5000,
+    },
+}
+
+PRAGMA_NAME_RE = re.compile(r"^[a-z_]+$")
+PRAGMA_VALUE_RE = re.compile(r"^(?:-?\d+|[A-Za-z_]+)$")
+
+
+def pragma_statements(profile):
+    """``PRAGMA`` statements for a profile name or a ``{pragma: value}`` dict."""
+    if profile is None:
+        return []
+    if isinstance(profile, str):
+        try:
+            profile = PRAGMA_PROFILES[profile]
+        except KeyError:
+            raise ValueError(
+                f"unknown PRAGMA profile {profile!r}, expected one of {sorted(PRAGMA_PROFILES)}"
+            ) from None
+    statements = []
+    for name, value in profile.items():
+        if not PRAGMA_NAME_RE.match(name) or not PRAGMA_VALUE_RE.match(str(value)):
+            raise ValueError(f"invalid PRAGMA {name}={value!r}")
+        statements.append(f"PRAGMA {name}={value}")
+    return statements
+
+
+def apply_pragmas(conn, profile):
+    for statement in pragma_statements(profile):
+        conn.execute(statement).fetchall()
+    return conn
+
+
+class ConnectionPool:
+    """
+    Bounded, thread-safe pool of sqlite3 connections.
+
+    Connections are opened lazily up to ``max_size``; ``min_size`` of them
+    are kept open even when idle, the rest are closed once they have been
+    idle for longer than ``idle_timeout`` seconds. Every checkout runs a
+    cheap health check and transparently replaces broken connections.
+    ``profile`` names a ``PRAGMA_PROFILES`` entry (or is a dict of
+    PRAGMAs) applied to each new connection. With ``thread_affinity`` a
+    thread keeps reusing the same connection instead of returning it to
+    the shared idle queue; long-lived worker threads should call
+    ``release_thread()`` before they exit.
+    """
+
+    def __init__(
+        self,
+        database="users.db",
+        min_size=1,
+        max_size=5,
+        idle_timeout=300.0,
+        checkout_timeout=None,
+        thread_affinity=False,
+        profile=None,
+        **connect_kwargs,
+    ):
+        if min_size < 0 or max_size < 1 or min_size > max_size:
+            raise ValueError("expected 0 <= min_size <= max_size and max_size >= 1")
+        self.database = database
+        self.min_size = min_size
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.checkout_timeout = checkout_timeout
+        self.thread_affinity = thread_affinity
+        self.pragmas = pragma_statements(profile)
+        # connections are handed between threads, sqlite3 must allow that
+        connect_kwargs.setdefault("check_same_thread", False)
+        self.connect_kwargs = connect_kwargs
+
+        self._lock = threading.Condition()
+        self._idle = deque()  # (conn, last_used) pairs, most recent on the right
+        self._size = 0  # open connections, idle or checked out
+        self._local = threading.local()
+        self._closed = False
+
+    def _connect(self):
+        conn = sqlite3.connect(self.database, **self.connect_kwargs)
+        for statement in self.pragmas:
+            conn.execute(statement).fetchall()
+        return conn
+
+    @staticmethod
+    def _is_healthy(conn):
+        try:
+            conn.execute("SELECT 1").fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+
+    def _discard(self, conn):
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+        with self._lock:
+            self._size -= 1
+            self._lock.notify()
+
+    def _prune_idle(self, now):
+        """Close connections idle past ``idle_timeout``, keeping ``min_size``."""
+        stale = []
+        while (
+            self._size > self.min_size
+            and self._idle
+            and now - self._idle[0][1] >= self.idle_timeout
+        ):
+            stale.append(self._idle.popleft()[0])
+            self._size -= 1
+        return stale
+
+    def acquire(self):
+        """Check out a connection, blocking while the pool is exhausted."""
+        if self.thread_affinity:
+            conn = getattr(self._local, "conn", None)
+            if conn is not None:
+                if self._is_healthy(conn):
+                    self._local.depth += 1
+                    return conn
+                self._local.conn = None
+                self._discard(conn)
+
+        deadline = (
+            None
+            if self.checkout_timeout is None
+            else time.monotonic() + self.checkout_timeout
+        )
+        while True:
+            conn = None
+            with self._lock:
+                if self._closed:
+                    raise RuntimeError("connection pool is closed")
+                while not self._idle and self._size >= self.max_size:
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        raise TimeoutError(
+                            f"no connection available within {self.checkout_timeout}s"
+                        )
+                    self._lock.wait(remaining)
+                    if self._closed:
+                        raise RuntimeError("connection pool is closed")
+                if self._idle:
+                    conn = self._idle.pop()[0]
+                else:
+                    self._size += 1
+
+            if conn is None:
+                try:
+                    conn = self._connect()
+                except Exception:
+                    with self._lock:
+                        self._size -= 1
+                        self._lock.notify()
+                    raise
+            elif not self._is_healthy(conn):
+                self._discard(conn)
+                continue
+
+            if self.thread_affinity:
+                self._local.conn = conn
+                self._local.depth = 1
+            return conn
+
+    def release(self, conn):
+        """Return a connection to the pool, rolling back any open transaction."""
+        if self.thread_affinity and getattr(self._local, "conn", None) is conn:
+            self._local.depth -= 1
+            if self._local.depth > 0:
+                return
+            # keep the connection bound to this thread between calls
+            if conn.in_transaction:
+                conn.rollback()
+            return
 
-def with_db_connection(func):
-    @functools.wraps(func)
-    def wrapper(*args, **kwargs):
-        conn = sqlite3.connect("users.db")
         try:
-            result = func(conn, *args, **kwargs)
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            self._discard(conn)
+            return
+
+        now = time.monotonic()
+        with self._lock:
+            if self._closed:
+                stale = [conn]
+                self._size -= 1
+            else:
+                self._idle.append((conn, now))
+                stale = self._prune_idle(now)
+            self._lock.notify()
+        for stale_conn in stale:
+            stale_conn.close()
+
+    def release_thread(self):
+        """Give back the connection pinned to the calling thread, if any."""
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            self._local.conn = None
+            self._local.depth = 0
+            self.release(conn)
+
+    @contextmanager
+    def connection(self):
+        conn = self.acquire()
+        try:
+            yield conn
         finally:
+            self.release(conn)
+
+    def close(self):
+        """Close every idle connection and refuse further checkouts."""
+        with self._lock:
+            self._closed = True
+            idle, self._idle = self._idle, deque()
+            self._size -= len(idle)
+            self._lock.notify_all()
+        for conn, _ in idle:
             conn.close()
-        return result
 
-    return wrapper
+    @property
+    def size(self):
+        return self._size
+
+    @property
+    def idle(self):
+        return len(self._idle)
+
+
+class AsyncConnectionPool:
+    """
+    asyncio counterpart of ``ConnectionPool`` backed by aiosqlite.
+
+    Checkouts wait without blocking the event loop, and a checkout that is
+    cancelled while connecting or waiting never leaks a slot. The pool
+    must only be used from one event loop.
+
+    Every aiosqlite connection runs in its own non-daemon thread, so the
+    interpreter cannot exit while the pool holds one: ``await close()``
+    before the loop ends, or use ``min_size=0, idle_timeout=0`` to close
+    connections as soon as they are released.
+    """
+
+    def __init__(
+        self,
+        database="users.db",
+        min_size=1,
+        max_size=5,
+        idle_timeout=300.0,
+        checkout_timeout=None,
+        profile=None,
+        **connect_kwargs,
+    ):
+        if min_size < 0 or max_size < 1 or min_size > max_size:
+            raise ValueError("expected 0 <= min_size <= max_size and max_size >= 1")
+        self.database = database
+        self.min_size = min_size
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.checkout_timeout = checkout_timeout
+        self.pragmas = pragma_statements(profile)
+        self.connect_kwargs = connect_kwargs
+        self._idle = deque()  # (conn, last_used) pairs, most recent on the right
+        self._size = 0
+        self._cond = None
+        self._closed = False
+
+    @property
+    def _condition(self):
+        # created lazily so the pool can be built outside a running loop
+        if self._cond is None:
+            self._cond = asyncio.Condition()
+        return self._cond
+
+    async def _connect(self):
+        if aiosqlite is None:
+            raise RuntimeError("aiosqlite is required for async database access")
+        conn = await aiosqlite.connect(self.database, **self.connect_kwargs)
+        for statement in self.pragmas:
+            async with conn.execute(statement) as cursor:
+                await cursor.fetchall()
+        return conn
+
+    @staticmethod
+    async def _is_healthy(conn):
+        try:
+            async with conn.execute("SELECT 1") as cursor:
+                await cursor.fetchone()
+            return True
+        except (sqlite3.Error, ValueError):
+            return False
+
+    async def _discard(self, conn):
+        self._size -= 1
+        try:
+            await conn.close()
+        except (sqlite3.Error, ValueError):
+            pass
+        finally:
+            async with self._condition:
+                self._condition.notify()
+
+    async def _wait_for_slot(self):
+        async with self._condition:
+            while not self._closed and not self._idle and self._size >= self.max_size:
+                await self._condition.wait()
+            if self._closed:
+                raise RuntimeError("connection pool is closed")
+            if self._idle:
+                return self._idle.pop()[0]
+            self._size += 1
+            return None
+
+    async def acquire(self):
+        """Check out a connection, waiting while the pool is exhausted."""
+        while True:
+            conn = await asyncio.wait_for(self._wait_for_slot(), self.checkout_timeout)
+            if conn is None:
+                try:
+                    return await self._connect()
+                except BaseException:
+                    self._size -= 1
+                    async with self._condition:
+                        self._condition.notify()
+                    raise
+            if await self._is_healthy(conn):
+                return conn
+            await self._discard(conn)
+
+    async def release(self, conn):
+        """Return a connection, rolling back any open transaction."""
+        try:
+            if conn.in_transaction:
+                await conn.rollback()
+        except (sqlite3.Error, ValueError):
+            await self._discard(conn)
+            return
+
+        now = time.monotonic()
+        stale = []
+        async with self._condition:
+            if self._closed:
+                stale.append(conn)
+                self._size -= 1
+            else:
+                self._idle.append((conn, now))
+                while (
+                    self._size > self.min_size
+                    and self._idle
+                    and now - self._idle[0][1] >= self.idle_timeout
+                ):
+                    stale.append(self._idle.popleft()[0])
+                    self._size -= 1
+            self._condition.notify()
+        for stale_conn in stale:
+            await stale_conn.close()
+
+    @asynccontextmanager
+    async def connection(self):
+        conn = await self.acquire()
+        try:
+            yield conn
+        finally:
+            # shield so a cancelled caller still hands the connection back
+            await asyncio.shield(self.release(conn))
+
+    async def close(self):
+        async with self._condition:
+            self._closed = True
+            idle, self._idle = self._idle, deque()
+            self._size -= len(idle)
+            self._condition.notify_all()
+        for conn, _ in idle:
+            await conn.close()
+
+    @property
+    def size(self):
+        return self._size
+
+    @property
+    def idle(self):
+        return len(self._idle)
+
+
+SQL_COMMENT_RE = re.compile(r"--[^\n]*|/\*.*?\*/", re.S)
+WRITE_KEYWORD_RE = re.compile(r"\b(?:INSERT|UPDATE|DELETE|REPLACE|CREATE|DROP|ALTER)\b", re.I)
+
+
+def is_read_statement(sql):
+    """True when ``sql`` only reads, so a read-only connection can run it."""
+    sql = SQL_COMMENT_RE.sub(" ", sql or "").strip()
+    keyword = sql.split(None, 1)[0].upper() if sql else ""
+    if keyword in ("SELECT", "VALUES", "EXPLAIN"):
+        return True
+    # a CTE can front an INSERT/UPDATE/DELETE
+    return keyword == "WITH" and not WRITE_KEYWORD_RE.search(sql)
+
+
+def enable_wal(database):
+    """Switch ``database`` to write-ahead logging; the mode is stored in the file."""
+    conn = sqlite3.connect(database)
+    try:
+        return conn.execute("PRAGMA journal_mode=WAL").fetchone()[0]
+    finally:
+        conn.close()
+
+
+class ReadWriteRouter:
+    """
+    WAL-mode database behind one writer and a pool of read-only readers.
+
+    In WAL mode readers see the last committed snapshot and never wait on
+    the writer, so reads scale with ``readers`` while writes go through a
+    single connection (which also avoids SQLITE_BUSY between our own
+    writers). Readers open the file with a ``mode=ro`` URI. Pass
+    ``pool_class=AsyncConnectionPool`` to route coroutine functions.
+    """
+
+    def __init__(self, database="users.db", readers=4, pool_class=ConnectionPool, **pool_kwargs):
+        self.database = database
+        self.journal_mode = enable_wal(database)
+        self.writer = pool_class(database, min_size=1, max_size=1, **pool_kwargs)
+        read_uri = f"file:{pathname2url(os.path.abspath(database))}?mode=ro"
+        self.readers = pool_class(read_uri, max_size=readers, uri=True, **pool_kwargs)
+
+    def pool_for(self, sql=None, readonly=None):
+        """The reader pool for read statements (or ``readonly=True``), else the writer."""
+        if readonly is None:
+            readonly = sql is not None and is_read_statement(sql)
+        return self.readers if readonly else self.writer
+
+    def execute(self, sql, params=()):
+        """Run one statement on the right pool; rows for reads, rowcount for writes."""
+        pool = self.pool_for(sql)
+        with pool.connection() as conn:
+            cursor = conn.execute(sql, params)
+            if pool is self.readers:
+                return cursor.fetchall()
+            conn.commit()
+            return cursor.rowcount
+
+    def close(self):
+        self.writer.close()
+        self.readers.close()
+
+
+# shared by every decorated function that does not bring its own pool
+default_pool = ConnectionPool("users.db")
+# keeps no idle connections, whose threads would block interpreter exit
+default_async_pool = AsyncConnectionPool("users.db", min_size=0, idle_timeout=0)
+
+
+def with_db_connection(func=None, *, pool=None, readonly=None):
+    """
+    Pass a pooled connection as the first argument of ``func``.
+
+    Usable bare (``@with_db_connection``) or with a specific pool
+    (``@with_db_connection(pool=my_pool)``). Coroutine functions get an
+    aiosqlite connection from an ``AsyncConnectionPool`` instead.
+
+    With a ``ReadWriteRouter`` as ``pool`` the call goes to a read-only
+    connection when ``readonly=True`` or when its ``query`` argument is a
+    read statement, and to the writer otherwise.
+    """
+
+    def choose(default, args, kwargs):
+        conn_pool = default if pool is None else pool
+        if hasattr(conn_pool, "pool_for"):
+            query = kwargs.get("query") or next((a for a in args if isinstance(a, str)), None)
+            conn_pool = conn_pool.pool_for(query, readonly)
+        return conn_pool
+
+    def decorator(func):
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                conn_pool = choose(default_async_pool, args, kwargs)
+                async with conn_pool.connection() as conn:
+                    return await func(conn, *args, **kwargs)
+
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            conn_pool = choose(default_pool, args, kwargs)
+            conn = conn_pool.acquire()
+            try:
+                return func(conn, *args, **kwargs)
+            finally:
+                conn_pool.release(conn)
+
+        return wrapper
+
+    if func is None:
+        return decorator
+    return decorator(func)
 
 
 @with_db_connection
@@ -22,6 +546,34 @@ def get_user_by_id(conn, user_id):
     return cursor.fetchone()
 
 
+@with_db_connection
+async def async_get_user_by_id(conn, user_id):
+    async with conn.execute("SELECT * FROM users WHERE id = ?", (user_id,)) as cursor:
+        return await cursor.fetchone()
+
+
 if __name__ == "__main__":
     user = get_user_by_id(user_id=1)
     print(user)
+
+    # an exhausted pool gives up after checkout_timeout instead of hanging
+    demo_pool = ConnectionPool(":memory:", max_size=1, checkout_timeout=0.1)
+    held = demo_pool.acquire()
+    started = time.monotonic()
+    try:
+        demo_pool.acquire()
+    except TimeoutError:
+        waited = time.monotonic() - started
+    else:
+        raise AssertionError("checkout should have timed out")
+    assert 0.1 <= waited < 1.0, waited
+    # returning the connection frees the slot for the next checkout
+    demo_pool.release(held)
+    with demo_pool.connection() as conn:
+        assert conn is held
+    demo_pool.close()
+    print(f"checkout timed out after {waited:.2f}s")
+
+    # the default async pool closes connections on release so the script can exit
+    print(asyncio.run(async_get_user_by_id(user_id=1)))
+    assert default_async_pool.size == 0
@@ -1,37 +1,249 @@
+import re
+import time
+import queue
 import sqlite3
+import inspect
 import functools
+import itertools
+import threading
+from concurrent.futures import Future
 
 
-def with_db_connection(func):
-    @functools.wraps(func)
-    def wrapper(*args, **kwargs):
-        conn = sqlite3.connect("users.db")
-        try:
-            result = func(conn, *args, **kwargs)
-        finally:
-            conn.close()
-        return result
+# pooled connections, see Task 1
+with_db_connection = __import__("1-with_db_connection").with_db_connection
 
-    return wrapper
+# callables invoked with the set of table names written by each committed transaction
+commit_listeners = []
+
+WRITE_TABLE_RE = re.compile(
+    r"^\s*(?:INSERT(?:\s+OR\s+\w+)?\s+INTO|REPLACE\s+INTO|UPDATE(?:\s+OR\s+\w+)?|DELETE\s+FROM)"
+    r"\s+[\"'`\[]?(\w+)",
+    re.IGNORECASE,
+)
+
+
+def written_table(statement):
+    """Return the lower-cased table a write statement targets, or None."""
+    match = WRITE_TABLE_RE.match(statement)
+    return match.group(1).lower() if match else None
+
+
+def on_commit(listener):
+    """Register ``listener(tables)`` to run after every committed write."""
+    commit_listeners.append(listener)
+    return listener
+
+
+def _tracer(touched):
+    def trace(statement):
+        table = written_table(statement)
+        if table:
+            touched.add(table)
+
+    return trace
+
+
+def notify_commit(touched):
+    """Tell every ``on_commit`` listener which tables a commit wrote."""
+    if touched:
+        for listener in commit_listeners:
+            listener(touched)
+
+
+_savepoint_ids = itertools.count(1)
 
 
 def transactional(func):
+    """
+    Run ``func`` in a transaction on the connection it receives.
+
+    The outermost call issues ``BEGIN`` and commits; calls nested inside
+    it use a SAVEPOINT instead, so an inner failure only undoes the inner
+    work. Failures are rolled back and re-raised.
+    """
+    if inspect.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def async_wrapper(conn, *args, **kwargs):
+            if conn.in_transaction:
+                savepoint = f"sp_{next(_savepoint_ids)}"
+                await conn.execute(f"SAVEPOINT {savepoint}")
+                try:
+                    result = await func(conn, *args, **kwargs)
+                except BaseException:
+                    await conn.execute(f"ROLLBACK TO {savepoint}")
+                    await conn.execute(f"RELEASE {savepoint}")
+                    raise
+                await conn.execute(f"RELEASE {savepoint}")
+                return result
+
+            touched = set()
+            await conn.set_trace_callback(_tracer(touched))
+            try:
+                await conn.execute("BEGIN")
+                result = await func(conn, *args, **kwargs)
+                await conn.commit()
+                print("Transaction committed")
+            except BaseException as e:
+                await conn.rollback()
+                print("Transaction failed:", e)
+                raise
+            finally:
+                await conn.set_trace_callback(None)
+            notify_commit(touched)
+            return result
+
+        return async_wrapper
+
     @functools.wraps(func)
     def wrapper(conn, *args, **kwargs):
+        if conn.in_transaction:
+            savepoint = f"sp_{next(_savepoint_ids)}"
+            conn.execute(f"SAVEPOINT {savepoint}")
+            try:
+                result = func(conn, *args, **kwargs)
+            except BaseException:
+                conn.execute(f"ROLLBACK TO {savepoint}")
+                conn.execute(f"RELEASE {savepoint}")
+                raise
+            conn.execute(f"RELEASE {savepoint}")
+            return result
+
+        touched = set()
+        conn.set_trace_callback(_tracer(touched))
         try:
+            conn.execute("BEGIN")
             result = func(conn, *args, **kwargs)
             conn.commit()
             print("Transaction committed")
-            return result
-        except Exception as e:
+        except BaseException as e:
             conn.rollback()
             print("Transaction failed:", e)
+            raise
         finally:
-            conn.close()
+            conn.set_trace_callback(None)
+
+        notify_commit(touched)
+        return result
 
     return wrapper
 
 
+class CommitBatcher:
+    """
+    Group many small writes into a few large transactions.
+
+    Functions wrapped with ``batched`` are queued instead of run; a writer
+    thread with its own connection runs them back to back, each inside a
+    SAVEPOINT so one failing write does not discard the others, and
+    commits once ``max_batch_size`` writes are pending or the oldest has
+    waited ``max_latency`` seconds. SQLite pays one fsync per commit, so
+    this is far cheaper than committing every row. Each call returns a
+    ``concurrent.futures.Future`` resolved after its batch commits.
+    """
+
+    def __init__(self, database="users.db", max_batch_size=500, max_latency=0.05, **connect_kwargs):
+        self.database = database
+        self.max_batch_size = max_batch_size
+        self.max_latency = max_latency
+        connect_kwargs.setdefault("check_same_thread", False)
+        self.connect_kwargs = connect_kwargs
+        self._queue = queue.Queue()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self.batches = 0
+        self.writes = 0
+
+    def _ensure_started(self):
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+
+    def submit(self, func, *args, **kwargs):
+        """Queue ``func(conn, *args, **kwargs)`` and return its Future."""
+        self._ensure_started()
+        future = Future()
+        self._queue.put((future, func, args, kwargs))
+        return future
+
+    def batched(self, func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            return self.submit(func, *args, **kwargs)
+
+        return wrapper
+
+    def flush(self):
+        """Commit everything queued so far and wait for it."""
+        self.submit(lambda conn: None).result()
+
+    def close(self):
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        conn = sqlite3.connect(self.database, **self.connect_kwargs)
+        try:
+            while True:
+                item = self._queue.get()
+                if item is None:
+                    return
+                batch = [item]
+                deadline = time.monotonic() + self.max_latency
+                stop = False
+                while len(batch) < self.max_batch_size:
+                    remaining = deadline - time.monotonic()
+                    try:
+                        if remaining > 0:
+                            item = self._queue.get(timeout=remaining)
+                        else:
+                            item = self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if item is None:
+                        stop = True
+                        break
+                    batch.append(item)
+                self._commit_batch(conn, batch)
+                if stop:
+                    return
+        finally:
+            conn.close()
+
+    def _commit_batch(self, conn, batch):
+        touched = set()
+        conn.set_trace_callback(_tracer(touched))
+        outcomes = []
+        try:
+            conn.execute("BEGIN")
+            for future, func, args, kwargs in batch:
+                if not future.set_running_or_notify_cancel():
+                    continue
+                try:
+                    outcomes.append((future, True, transactional(func)(conn, *args, **kwargs)))
+                except Exception as e:
+                    outcomes.append((future, False, e))
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            for future, *_ in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        finally:
+            conn.set_trace_callback(None)
+        self.batches += 1
+        self.writes += len(outcomes)
+        notify_commit(touched)
+        for future, ok, value in outcomes:
+            if ok:
+                future.set_result(value)
+            else:
+                future.set_exception(value)
+
+
 @with_db_connection
 @transactional
 def update_user_email(conn, user_id, new_email):
@@ -41,4 +253,36 @@ def update_user_email(conn, user_id, new_email):
 
 
 if __name__ == "__main__":
+    import os
+    import tempfile
+
+    # a failing write in a batch is undone alone, the rest of the batch commits
+    with tempfile.TemporaryDirectory() as tmp:
+        database = os.path.join(tmp, "batch.db")
+        setup = sqlite3.connect(database)
+        setup.execute("CREATE TABLE events (id INTEGER PRIMARY KEY, name TEXT NOT NULL)")
+        setup.close()
+
+        batcher = CommitBatcher(database, max_latency=0.5)
+
+        @batcher.batched
+        def add_event(conn, name):
+            conn.execute("INSERT INTO events (name) VALUES (?)", (name,))
+            if name == "bad":
+                # fails after its own insert, which the savepoint rolls back
+                conn.execute("INSERT INTO events (name) VALUES (NULL)")
+
+        futures = [add_event(name) for name in ("first", "bad", "last")]
+        batcher.flush()
+        batcher.close()
+        assert futures[0].result() is None and futures[2].result() is None
+        assert isinstance(futures[1].exception(), sqlite3.IntegrityError)
+        assert batcher.batches == 1, batcher.batches
+
+        check = sqlite3.connect(database)
+        names = [row[0] for row in check.execute("SELECT name FROM events ORDER BY id")]
+        check.close()
+        assert names == ["first", "last"], names
+        print("Batched writes committed:", names)
+
     update_user_email(user_id=1, new_email="Crawford_Cartwright@hotmail.com")
@@ -1,38 +1,128 @@
 import time
+import random
+import asyncio
+import inspect
 import sqlite3
 import functools
+import threading
 
 
-def with_db_connection(func):
-    @functools.wraps(func)
-    def wrapper(*args, **kwargs):
-        conn = sqlite3.connect("users.db")
-        try:
-            result = func(conn, *args, **kwargs)
-        finally:
-            conn.close()
-        return result
+# pooled connections, see Task 1
+with_db_connection = __import__("1-with_db_connection").with_db_connection
 
-    return wrapper
+TRANSIENT_MESSAGES = ("database is locked", "database table is locked", "database is busy")
 
 
-def retry_on_failure(retries=3, delay=1):
+def is_transient(exc):
+    """True for errors worth retrying: SQLite lock/busy contention."""
+    return isinstance(exc, sqlite3.OperationalError) and any(
+        message in str(exc).lower() for message in TRANSIENT_MESSAGES
+    )
+
+
+class RetryBudget:
+    """
+    Token bucket shared by every caller that may retry.
+
+    Each retry spends one token; tokens refill at ``refill_per_second`` up
+    to ``capacity``. When the database stays locked the bucket drains and
+    callers fail fast instead of piling more retries on top of it.
+    """
+
+    def __init__(self, capacity=10, refill_per_second=2.0):
+        self.capacity = capacity
+        self.refill_per_second = refill_per_second
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def try_spend(self):
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(
+                self.capacity,
+                self._tokens + (now - self._updated) * self.refill_per_second,
+            )
+            self._updated = now
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
+
+    @property
+    def tokens(self):
+        return self._tokens
+
+
+# shared across threads unless a decorator is given its own budget
+default_budget = RetryBudget()
+
+
+def retry_on_failure(
+    retries=3,
+    delay=1,
+    max_delay=30,
+    max_elapsed=None,
+    retry_if=is_transient,
+    budget=None,
+):
+    """
+    Retry ``func`` on transient errors with exponential backoff and full jitter.
+
+    The n-th retry sleeps a random time in ``[0, min(max_delay, delay * 2**n)]``.
+    Errors rejected by ``retry_if`` are raised immediately, and so is the
+    last error once ``retries`` attempts, ``max_elapsed`` seconds or the
+    shared retry ``budget`` run out.
+    """
+    def backoff(error, attempt, start):
+        """Seconds to sleep before the next attempt, or None to give up."""
+        if not retry_if(error):
+            return None
+        print(f"attempt {attempt} failed: {error}")
+        if attempt >= retries:
+            print("All attempts failed")
+            return None
+        sleep_for = random.uniform(0, min(max_delay, delay * 2 ** (attempt - 1)))
+        if max_elapsed is not None and time.monotonic() - start + sleep_for > max_elapsed:
+            print(f"Giving up after {time.monotonic() - start:.2f} seconds")
+            return None
+        if not (default_budget if budget is None else budget).try_spend():
+            print("Retry budget exhausted")
+            return None
+        print(f"Retrying in {sleep_for:.2f} seconds..")
+        return sleep_for
+
     def decorator(func):
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                start = time.monotonic()
+                attempt = 0
+                while True:
+                    try:
+                        return await func(*args, **kwargs)
+                    except Exception as e:
+                        attempt += 1
+                        sleep_for = backoff(e, attempt, start)
+                        if sleep_for is None:
+                            raise
+                    await asyncio.sleep(sleep_for)
+
+            return async_wrapper
+
         @functools.wraps(func)
         def wrapper(*args, **kwargs):
+            start = time.monotonic()
             attempt = 0
-            while attempt < retries:
+            while True:
                 try:
                     return func(*args, **kwargs)
                 except Exception as e:
                     attempt += 1
-                    print(f"attempt {attempt} failed: {e}")
-                    if attempt < retries:
-                        print(f"Retrying in {delay} seconds..")
-                        time.sleep(delay)
-                    else:
-                        print("All attempts failed")
+                    sleep_for = backoff(e, attempt, start)
+                    if sleep_for is None:
                         raise
+                time.sleep(sleep_for)
 
         return wrapper
     return decorator
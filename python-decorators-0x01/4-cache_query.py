@@ -1,37 +1,408 @@
+import re
+import sys
 import sqlite3
+import time
+import asyncio
+import inspect
+import threading
 import functools
+from collections import OrderedDict
 
-query_cache = {}
+# from Task 1, backed by the shared connection pool
+pooling = __import__("1-with_db_connection")
+with_db_connection = pooling.with_db_connection
+# committed writes report the tables they touched, see Task 2
+transactions = __import__("2-transactional")
 
-# from Task 1
-def with_db_connection(func):
-    @functools.wraps(func)
-    def wrapper(*args, **kwargs):
-        conn = sqlite3.connect("users.db")
+READ_TABLE_RE = re.compile(r"\b(?:FROM|JOIN)\s+[\"'`\[]?(\w+)", re.IGNORECASE)
+
+
+def read_tables(query):
+    """Lower-cased names of the tables a SELECT reads from."""
+    return frozenset(name.lower() for name in READ_TABLE_RE.findall(query))
+
+
+FRESH, STALE, MISSING = "fresh", "stale", "missing"
+
+
+class Flight:
+    """One in-progress load that concurrent callers for the same key wait on."""
+
+    def __init__(self, generation):
+        self.generation = generation
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+def approximate_size(value):
+    """Rough in-memory size of a result set (rows of scalars) in bytes."""
+    size = sys.getsizeof(value)
+    if isinstance(value, (list, tuple)):
+        for item in value:
+            size += approximate_size(item)
+    elif isinstance(value, dict):
+        for key, item in value.items():
+            size += approximate_size(key) + approximate_size(item)
+    return size
+
+
+class QueryCache:
+    """
+    Thread-safe LRU cache of query results.
+
+    Entries are evicted least-recently-used first once either
+    ``max_entries`` or the approximate ``max_bytes`` budget is exceeded,
+    and expire ``ttl`` seconds after they were stored (``None`` keeps them
+    until evicted or invalidated). Each entry remembers the tables its
+    query reads so writes can drop exactly the affected results.
+
+    Expired entries stay servable for ``stale_while_revalidate`` more
+    seconds through ``get_or_load`` while a single refresh runs.
+    """
+
+    def __init__(
+        self,
+        max_entries=1024,
+        max_bytes=16 * 1024 * 1024,
+        ttl=300.0,
+        stale_while_revalidate=0.0,
+    ):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.stale_while_revalidate = stale_while_revalidate
+        self._entries = OrderedDict()  # key -> (value, size, expires_at, tables)
+        self._bytes = 0
+        self._inflight = {}  # key -> Flight
+        self._async_inflight = {}  # key -> asyncio.Future, for coroutine loaders
+        self._refresh_tasks = set()
+        self._generation = 0  # bumped by invalidation, guards in-flight loads
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+        self.stale_hits = 0
+        self.coalesced = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def _pop(self, key):
+        _, size, _, _ = self._entries.pop(key)
+        self._bytes -= size
+
+    def _lookup(self, key):
+        """Return ``(value, state)``; the caller must hold the lock."""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None, MISSING
+        expires_at = entry[2]
+        now = time.monotonic()
+        if expires_at is None or expires_at > now:
+            self._entries.move_to_end(key)
+            return entry[0], FRESH
+        if expires_at + self.stale_while_revalidate > now:
+            self._entries.move_to_end(key)
+            return entry[0], STALE
+        self._pop(key)
+        self.expirations += 1
+        return None, MISSING
+
+    def get(self, key, default=None):
+        with self._lock:
+            value, state = self._lookup(key)
+            if state == FRESH:
+                self.hits += 1
+                return value
+            self.misses += 1
+            return default
+
+    def get_or_load(self, key, load, ttl=None, tables=frozenset(), background=True):
+        """
+        Return the cached value for ``key``, calling ``load()`` to fill it.
+
+        Concurrent misses for the same key share a single ``load()`` call
+        instead of all hitting the database. A stale entry is returned
+        immediately while one refresh runs, in a daemon thread when
+        ``background`` is true or in the calling thread otherwise.
+        """
+        with self._lock:
+            value, state = self._lookup(key)
+            if state == FRESH:
+                self.hits += 1
+                return value
+            flight = self._inflight.get(key)
+            if state == STALE:
+                self.stale_hits += 1
+                if flight is not None:
+                    return value
+            else:
+                self.misses += 1
+                if flight is not None:
+                    self.coalesced += 1
+            leader = flight is None
+            if leader:
+                flight = self._inflight[key] = Flight(self._generation)
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+        if state == STALE and background:
+            threading.Thread(
+                target=self._run_flight,
+                args=(key, flight, load, ttl, tables, False),
+                daemon=True,
+            ).start()
+            return value
+        return self._run_flight(key, flight, load, ttl, tables)
+
+    async def aget_or_load(self, key, load, ttl=None, tables=frozenset(), background=True):
+        """``get_or_load`` for coroutine loaders: waiters await instead of blocking."""
+        with self._lock:
+            value, state = self._lookup(key)
+            if state == FRESH:
+                self.hits += 1
+                return value
+            flight = self._async_inflight.get(key)
+            if state == STALE:
+                self.stale_hits += 1
+                if flight is not None:
+                    return value
+            else:
+                self.misses += 1
+                if flight is not None:
+                    self.coalesced += 1
+            leader = flight is None
+            if leader:
+                flight = self._async_inflight[key] = asyncio.get_running_loop().create_future()
+                generation = self._generation
+
+        if not leader:
+            # shield: one waiter being cancelled must not cancel the shared load
+            return await asyncio.shield(flight)
+        if state == STALE and background:
+            task = asyncio.ensure_future(
+                self._arun_flight(key, flight, generation, load, ttl, tables, False)
+            )
+            # the event loop only keeps weak references to tasks
+            self._refresh_tasks.add(task)
+            task.add_done_callback(self._refresh_tasks.discard)
+            return value
+        return await self._arun_flight(key, flight, generation, load, ttl, tables)
+
+    async def _arun_flight(self, key, flight, generation, load, ttl, tables, reraise=True):
+        try:
+            value = await load()
+        except BaseException as e:
+            flight.set_exception(e)
+            # mark retrieved so a failure nobody awaited does not warn at exit
+            flight.exception()
+            if reraise:
+                raise
+        else:
+            self.set(key, value, ttl=ttl, tables=tables, generation=generation)
+            flight.set_result(value)
+            return value
+        finally:
+            with self._lock:
+                self._async_inflight.pop(key, None)
+
+    def _run_flight(self, key, flight, load, ttl, tables, reraise=True):
         try:
-            result = func(conn, *args, **kwargs)
+            flight.value = load()
+        except BaseException as e:
+            flight.error = e
+            if reraise:
+                raise
+        else:
+            # skipped when a write invalidated the tables while we were loading
+            self.set(key, flight.value, ttl=ttl, tables=tables, generation=flight.generation)
+            return flight.value
         finally:
-            conn.close()
-        return result
-    return wrapper
+            with self._lock:
+                self._inflight.pop(key, None)
+            flight.done.set()
+
+    @property
+    def generation(self):
+        """Read before loading a value and pass to ``set`` to detect invalidation."""
+        return self._generation
+
+    def set(self, key, value, ttl=None, tables=frozenset(), generation=None):
+        """
+        Store ``value``. With ``generation`` the value is dropped if an
+        invalidation ran since that generation was read, because it may
+        have been loaded from rows a write has since changed.
+        """
+        ttl = self.ttl if ttl is None else ttl
+        size = approximate_size(value)
+        if size > self.max_bytes:
+            return  # would evict everything else and still not fit
+        expires_at = None if ttl is None else time.monotonic() + ttl
+        with self._lock:
+            if generation is not None and generation != self._generation:
+                return
+            if key in self._entries:
+                self._pop(key)
+            self._entries[key] = (value, size, expires_at, frozenset(tables))
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._pop(next(iter(self._entries)))
+                self.evictions += 1
+
+    def invalidate_tables(self, tables):
+        """Drop every entry whose query reads one of ``tables``."""
+        tables = {table.lower() for table in tables}
+        with self._lock:
+            self._generation += 1
+            stale = [key for key, entry in self._entries.items() if entry[3] & tables]
+            for key in stale:
+                self._pop(key)
+            self.invalidations += len(stale)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def __contains__(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry is not None and (entry[2] is None or entry[2] > time.monotonic())
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        """Counters suitable for scraping into a metrics backend."""
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "stale_hits": self.stale_hits,
+                "coalesced": self.coalesced,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations,
+            }
+
+
+query_cache = QueryCache()
+transactions.on_commit(query_cache.invalidate_tables)
+
+
+def freeze(value):
+    """Make bound parameters (lists, dicts) usable as part of a dict key."""
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(item) for item in value)
+    if isinstance(value, dict):
+        return tuple(sorted((key, freeze(item)) for key, item in value.items()))
+    return value
+
+
+def is_connection(value):
+    return isinstance(value, sqlite3.Connection) or (
+        pooling.aiosqlite is not None and isinstance(value, pooling.aiosqlite.Connection)
+    )
+
+
+def cache_key(args, kwargs):
+    """Key a call by its query and bound parameters, skipping the connection."""
+    if args and is_connection(args[0]):
+        args = args[1:]
+    return (freeze(args), freeze(kwargs))
+
+
+def call_tables(args, kwargs):
+    """Tables read by the ``query`` argument of a call, if it has one."""
+    query = kwargs.get("query") or next((arg for arg in args if isinstance(arg, str)), "")
+    return read_tables(query)
+
 
 # Cache decorator
-def cache_query(func):
-    @functools.wraps(func)
-    def wrapper(*args, **kwargs):
-        query = kwargs.get("query")
-        if query in query_cache:
-            return query_cache[query]
-        result = func(*args, **kwargs)
-        query_cache[query] = result
-        return result
-    return wrapper
+def cache_query(func=None, *, cache=None, ttl=None, single_flight=True, tables=None):
+    """
+    Cache results of ``func`` in ``cache`` (the module ``query_cache`` by default).
+
+    Entries are invalidated through the tables they read, taken from the
+    ``query`` argument or, for functions with their SQL hard-coded, from
+    ``tables``. A call whose tables cannot be determined is not cached,
+    since no write would ever invalidate it.
+
+    With ``single_flight`` concurrent misses for one key run the query
+    once. Stale entries are refreshed in the background only when the
+    decorator sits outside ``with_db_connection``; a borrowed connection
+    cannot outlive the call, so otherwise the refreshing caller waits.
+    """
+    fixed_tables = None if tables is None else frozenset(t.lower() for t in tables)
+
+    def decorator(func):
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                store = query_cache if cache is None else cache
+                read = call_tables(args, kwargs) if fixed_tables is None else fixed_tables
+                if not read:
+                    return await func(*args, **kwargs)
+                key = (func.__qualname__,) + cache_key(args, kwargs)
+                if single_flight:
+                    return await store.aget_or_load(
+                        key,
+                        lambda: func(*args, **kwargs),
+                        ttl=ttl,
+                        tables=read,
+                        background=not (args and is_connection(args[0])),
+                    )
+                missing = object()
+                result = store.get(key, missing)
+                if result is not missing:
+                    return result
+                generation = store.generation
+                result = await func(*args, **kwargs)
+                store.set(key, result, ttl=ttl, tables=read, generation=generation)
+                return result
+
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            store = query_cache if cache is None else cache
+            read = call_tables(args, kwargs) if fixed_tables is None else fixed_tables
+            if not read:
+                return func(*args, **kwargs)
+            key = (func.__qualname__,) + cache_key(args, kwargs)
+            if single_flight:
+                holds_conn = bool(args) and is_connection(args[0])
+                return store.get_or_load(
+                    key,
+                    lambda: func(*args, **kwargs),
+                    ttl=ttl,
+                    tables=read,
+                    background=not holds_conn,
+                )
+            missing = object()
+            result = store.get(key, missing)
+            if result is not missing:
+                return result
+            generation = store.generation
+            result = func(*args, **kwargs)
+            store.set(key, result, ttl=ttl, tables=read, generation=generation)
+            return result
+        return wrapper
+
+    if func is None:
+        return decorator
+    return decorator(func)
 
 @with_db_connection
 @cache_query
-def fetch_users_with_cache(conn, query):
+def fetch_users_with_cache(conn, query, params=()):
     cursor = conn.cursor()
-    cursor.execute(query)
+    cursor.execute(query, params)
     return cursor.fetchall()
 
 if __name__ == "__main__":
@@ -40,3 +411,102 @@ if __name__ == "__main__":
 
     users_again = fetch_users_with_cache(query="SELECT * FROM users")
     print("✅ Second call (cached):", users_again)
+
+    older = fetch_users_with_cache(query="SELECT * FROM users WHERE age > ?", params=(40,))
+    print("✅ Parameterized call:", older)
+    print("📊 Cache stats:", query_cache.stats())
+
+    # SQL hard-coded in the function: cached only when its tables are named
+    calls = []
+    demo_cache = QueryCache()
+
+    @cache_query(cache=demo_cache)
+    def count_users():
+        calls.append("unnamed")
+        return len(users)
+
+    @cache_query(cache=demo_cache, tables=["users"])
+    def count_users_named():
+        calls.append("named")
+        return len(users)
+
+    for _ in range(2):
+        count_users()
+        count_users_named()
+    assert calls == ["unnamed", "named", "unnamed"], calls
+
+    # a write landing while an uncoalesced load runs keeps its result out
+    @cache_query(cache=demo_cache, single_flight=False, tables=["users"])
+    def load_during_write():
+        demo_cache.invalidate_tables({"users"})
+        return len(users)
+
+    load_during_write()
+    assert len(demo_cache) == 0
+    print("✅ Uncacheable and invalidated loads were not stored")
+
+    # concurrent misses for one key share a single load
+    flight_cache = QueryCache()
+    release = threading.Event()
+    loads = []
+
+    def slow_load():
+        loads.append(1)
+        release.wait(5)
+        return "loaded"
+
+    results = []
+    threads = [
+        threading.Thread(target=lambda: results.append(flight_cache.get_or_load("k", slow_load)))
+        for _ in range(5)
+    ]
+    for thread in threads:
+        thread.start()
+    while flight_cache.coalesced < 4:
+        time.sleep(0.01)
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert len(loads) == 1 and results == ["loaded"] * 5, (loads, results)
+
+    # a failed load raises in the leader and in every waiter, and is not cached
+    release.clear()
+    errors = []
+
+    def failing_load():
+        release.wait(5)
+        raise sqlite3.OperationalError("database is locked")
+
+    def load_or_record():
+        try:
+            flight_cache.get_or_load("broken", failing_load)
+        except sqlite3.OperationalError as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=load_or_record) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    while flight_cache.coalesced < 6:
+        time.sleep(0.01)
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert len(errors) == 3 and "broken" not in flight_cache, errors
+
+    # an expired entry is served stale while one refresh runs
+    swr_cache = QueryCache(ttl=0.05, stale_while_revalidate=5)
+    swr_cache.get_or_load("k", lambda: "old")
+    time.sleep(0.1)
+    refreshed = threading.Event()
+
+    def refresh():
+        refreshed.set()
+        return "new"
+
+    assert swr_cache.get_or_load("k", refresh) == "old"
+    assert refreshed.wait(5)
+    while "k" not in swr_cache:
+        time.sleep(0.01)
+    assert swr_cache.get_or_load("k", refresh) == "new"
+    assert swr_cache.stale_hits == 1
+    print("✅ Single-flight, error fan-out and stale-while-revalidate behave")
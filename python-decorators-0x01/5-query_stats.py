@@ -0,0 +1,230 @@
+"""
+Per-fingerprint query statistics fed by ``log_queries``.
+
+Every call through a ``@log_queries`` function is folded into the
+in-process ``registry``; ``registry.snapshot()`` / ``registry.dump()``
+expose the aggregates and ``python 5-query_stats.py report`` prints the
+most expensive queries from a dump or a JSON-lines query log.
+"""
+import os
+import sys
+import json
+import math
+import atexit
+import argparse
+import threading
+
+log_queries = __import__("0-log_queries")
+
+
+class LatencyHistogram:
+    """
+    Sparse log-linear histogram of durations in nanoseconds.
+
+    Each power of two is split into ``SUB_BUCKETS`` buckets, so reported
+    percentiles are within ~9% of the true value while a fingerprint
+    needs at most a few dozen integer counters.
+    """
+
+    SUB_BUCKETS = 8
+
+    def __init__(self):
+        self.counts = {}
+
+    def _index(self, value):
+        return int(math.log2(max(value, 1)) * self.SUB_BUCKETS)
+
+    def _upper_bound(self, index):
+        return 2 ** ((index + 1) / self.SUB_BUCKETS)
+
+    def add(self, value):
+        index = self._index(value)
+        self.counts[index] = self.counts.get(index, 0) + 1
+
+    def merge(self, other):
+        for index, count in other.counts.items():
+            self.counts[index] = self.counts.get(index, 0) + count
+
+    def percentile(self, pct):
+        total = sum(self.counts.values())
+        if not total:
+            return None
+        rank = math.ceil(total * pct / 100)
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= rank:
+                return int(self._upper_bound(index))
+        return None
+
+    def to_dict(self):
+        return {str(index): count for index, count in self.counts.items()}
+
+    @classmethod
+    def from_dict(cls, data):
+        histogram = cls()
+        histogram.counts = {int(index): count for index, count in data.items()}
+        return histogram
+
+
+class FingerprintStats:
+    def __init__(self, fingerprint, query):
+        self.fingerprint = fingerprint
+        self.query = query
+        self.count = 0
+        self.errors = 0
+        self.total_ns = 0
+        self.max_ns = 0
+        self.rows = 0
+        self.histogram = LatencyHistogram()
+
+    def add(self, duration_ns, rows=None, error=False):
+        self.count += 1
+        self.total_ns += duration_ns
+        self.max_ns = max(self.max_ns, duration_ns)
+        self.rows += rows or 0
+        self.errors += bool(error)
+        self.histogram.add(duration_ns)
+
+    def summary(self):
+        return {
+            "fingerprint": self.fingerprint,
+            "query": self.query,
+            "count": self.count,
+            "errors": self.errors,
+            "rows": self.rows,
+            "total_ms": self.total_ns / 1e6,
+            "mean_ms": self.total_ns / self.count / 1e6 if self.count else None,
+            "p50_ms": _ms(self.histogram.percentile(50)),
+            "p95_ms": _ms(self.histogram.percentile(95)),
+            "p99_ms": _ms(self.histogram.percentile(99)),
+            "max_ms": self.max_ns / 1e6,
+        }
+
+
+def _ms(ns):
+    return None if ns is None else ns / 1e6
+
+
+class QueryStatsRegistry:
+    """Thread-safe map of query fingerprint to rolling ``FingerprintStats``."""
+
+    def __init__(self):
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def record(self, record):
+        """Fold one ``log_queries`` record into the aggregates."""
+        with self._lock:
+            stats = self._stats.get(record["fingerprint"])
+            if stats is None:
+                stats = self._stats[record["fingerprint"]] = FingerprintStats(
+                    record["fingerprint"], record["query"]
+                )
+            stats.add(record["duration_ns"], record.get("rows"), record.get("error"))
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+
+    def snapshot(self, sort="total_ms"):
+        """Per-fingerprint summaries, most expensive first."""
+        with self._lock:
+            summaries = [stats.summary() for stats in self._stats.values()]
+        return sorted(summaries, key=lambda row: row[sort] or 0, reverse=True)
+
+    def dump(self, path):
+        """Write the raw aggregates (histograms included) as JSON."""
+        with self._lock:
+            data = {
+                fp: {
+                    "query": stats.query,
+                    "count": stats.count,
+                    "errors": stats.errors,
+                    "total_ns": stats.total_ns,
+                    "max_ns": stats.max_ns,
+                    "rows": stats.rows,
+                    "histogram": stats.histogram.to_dict(),
+                }
+                for fp, stats in self._stats.items()
+            }
+        with open(path, "w") as f:
+            json.dump({"query_stats": data}, f)
+
+    def load(self, path):
+        """Merge a ``dump()`` file or a JSON-lines ``log_queries`` log."""
+        with open(path) as f:
+            text = f.read()
+        try:
+            data = json.loads(text)
+        except json.JSONDecodeError:
+            data = None
+        if isinstance(data, dict) and "query_stats" in data:
+            self._merge_dump(data["query_stats"])
+            return
+        for line in text.splitlines():
+            line = line.strip()
+            if line.startswith("{"):
+                record = json.loads(line)
+                if "fingerprint" in record:
+                    self.record(record)
+
+    def _merge_dump(self, data):
+        with self._lock:
+            for fp, raw in data.items():
+                stats = self._stats.get(fp)
+                if stats is None:
+                    stats = self._stats[fp] = FingerprintStats(fp, raw["query"])
+                stats.count += raw["count"]
+                stats.errors += raw["errors"]
+                stats.total_ns += raw["total_ns"]
+                stats.max_ns = max(stats.max_ns, raw["max_ns"])
+                stats.rows += raw["rows"]
+                stats.histogram.merge(LatencyHistogram.from_dict(raw["histogram"]))
+
+
+registry = QueryStatsRegistry()
+log_queries.observe_queries(registry.record)
+
+# QUERY_STATS_DUMP=path dumps the aggregates when the process exits
+if os.environ.get("QUERY_STATS_DUMP"):
+    atexit.register(registry.dump, os.environ["QUERY_STATS_DUMP"])
+
+
+def print_report(rows, limit=20, out=sys.stdout):
+    columns = ("count", "total_ms", "mean_ms", "p50_ms", "p95_ms", "p99_ms", "rows")
+    out.write(f"{'fingerprint':<18}" + "".join(f"{c:>11}" for c in columns) + "  query\n")
+    for row in rows[:limit]:
+        cells = "".join(
+            f"{row[c]:>11.3f}" if isinstance(row[c], float) else f"{row[c]!s:>11}"
+            for c in columns
+        )
+        out.write(f"{row['fingerprint']:<18}{cells}  {row['query'][:80]}\n")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Report the most expensive queries.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    report = sub.add_parser("report", help="print aggregates from dumps or query logs")
+    report.add_argument("paths", nargs="+", help="registry dumps or JSON-lines query logs")
+    report.add_argument(
+        "--sort",
+        default="total_ms",
+        choices=["total_ms", "count", "mean_ms", "p95_ms", "p99_ms", "rows"],
+    )
+    report.add_argument("--limit", type=int, default=20)
+    report.add_argument("--json", action="store_true", help="print raw summaries")
+    args = parser.parse_args(argv)
+
+    for path in args.paths:
+        registry.load(path)
+    rows = registry.snapshot(sort=args.sort)
+    if args.json:
+        json.dump(rows[: args.limit], sys.stdout, indent=2)
+        sys.stdout.write("\n")
+    else:
+        print_report(rows, args.limit)
+
+
+if __name__ == "__main__":
+    main()
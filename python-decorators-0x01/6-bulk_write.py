@@ -0,0 +1,171 @@
+"""
+Bulk writes for users.db.
+
+Records are streamed from any iterable in chunks of ``chunk_size``; each
+chunk goes through a single ``executemany`` inside its own transaction,
+so memory stays flat and a failure only loses the chunk in flight.
+Called on a connection that is already inside a transaction, each chunk
+runs in a SAVEPOINT instead and committing is left to the caller.
+"""
+import re
+import time
+import itertools
+
+pooling = __import__("1-with_db_connection")
+transactions = __import__("2-transactional")
+
+IDENTIFIER_RE = re.compile(r"^[A-Za-z_]\w*$")
+
+
+class BulkResult:
+    """
+    Records submitted, rows changed (as reported by ``cursor.rowcount``),
+    chunks committed and wall time of one bulk call.
+    """
+
+    def __init__(self, records=0, rows=0, chunks=0, seconds=0.0):
+        self.records = records
+        self.rows = rows
+        self.chunks = chunks
+        self.seconds = seconds
+
+    @property
+    def rows_per_second(self):
+        return self.rows / self.seconds if self.seconds else 0.0
+
+    def __repr__(self):
+        return (
+            f"BulkResult(records={self.records}, rows={self.rows}, chunks={self.chunks}, "
+            f"seconds={self.seconds:.3f}, rows_per_second={self.rows_per_second:,.0f})"
+        )
+
+
+def _identifier(name):
+    if not IDENTIFIER_RE.match(name):
+        raise ValueError(f"invalid SQL identifier: {name!r}")
+    return name
+
+
+def _values(record, columns):
+    """Bind values for ``columns`` from a mapping or a positional sequence."""
+    if isinstance(record, dict):
+        return tuple(record[column] for column in columns)
+    return tuple(record)
+
+
+def _chunks(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _run_chunked(conn, sql, params, table, chunk_size, progress=None):
+    result = BulkResult()
+    start = time.perf_counter()
+    # the caller's transaction: a failure must not roll back its earlier work
+    nested = conn.in_transaction
+    for chunk in _chunks(params, chunk_size):
+        if nested:
+            savepoint = f"bulk_{next(transactions._savepoint_ids)}"
+            conn.execute(f"SAVEPOINT {savepoint}")
+            try:
+                changed = conn.executemany(sql, chunk).rowcount
+            except BaseException:
+                conn.execute(f"ROLLBACK TO {savepoint}")
+                conn.execute(f"RELEASE {savepoint}")
+                raise
+            conn.execute(f"RELEASE {savepoint}")
+        else:
+            try:
+                conn.execute("BEGIN")
+                changed = conn.executemany(sql, chunk).rowcount
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                raise
+            transactions.notify_commit({table})
+        result.records += len(chunk)
+        result.rows += max(changed, 0)
+        result.chunks += 1
+        result.seconds = time.perf_counter() - start
+        if progress is not None:
+            progress(result)
+    result.seconds = time.perf_counter() - start
+    return result
+
+
+def bulk_upsert(conn, records, columns=("id", "name", "age"), key="id",
+                table="users", chunk_size=5000, progress=None):
+    """Insert ``records``, updating the non-key columns of rows whose ``key`` exists."""
+    table, key = _identifier(table), _identifier(key)
+    columns = [_identifier(column) for column in columns]
+    updates = ", ".join(f"{column} = excluded.{column}" for column in columns if column != key)
+    sql = (
+        f"INSERT INTO {table} ({', '.join(columns)}) "
+        f"VALUES ({', '.join('?' for _ in columns)}) "
+        f"ON CONFLICT({key}) DO "
+        + (f"UPDATE SET {updates}" if updates else "NOTHING")
+    )
+    params = (_values(record, columns) for record in records)
+    return _run_chunked(conn, sql, params, table, chunk_size, progress)
+
+
+def bulk_update(conn, records, columns=("name", "age"), key="id",
+                table="users", chunk_size=5000, progress=None):
+    """
+    Set ``columns`` on the rows matching each record's ``key``.
+
+    Records are mappings, or sequences ordered ``(*columns, key)`` with
+    the key last, e.g. ``("alice", 30, 1)`` for the default columns.
+    """
+    table, key = _identifier(table), _identifier(key)
+    columns = [_identifier(column) for column in columns]
+    sql = (
+        f"UPDATE {table} SET {', '.join(f'{column} = ?' for column in columns)} "
+        f"WHERE {key} = ?"
+    )
+    params = (_values(record, [*columns, key]) for record in records)
+    return _run_chunked(conn, sql, params, table, chunk_size, progress)
+
+
+def bulk_delete(conn, ids, key="id", table="users", chunk_size=5000, progress=None):
+    """Delete the rows whose ``key`` is in ``ids``."""
+    table, key = _identifier(table), _identifier(key)
+    sql = f"DELETE FROM {table} WHERE {key} = ?"
+    params = ((row_id,) for row_id in ids)
+    return _run_chunked(conn, sql, params, table, chunk_size, progress)
+
+
+if __name__ == "__main__":
+    import shutil
+    import tempfile
+
+    # work on a copy so the demo leaves users.db untouched
+    with tempfile.TemporaryDirectory() as tmp:
+        database = shutil.copy("users.db", f"{tmp}/users.db")
+        pool = pooling.ConnectionPool(database)
+        with pool.connection() as conn:
+            rows = ((i, f"user{i}", 18 + i % 60) for i in range(1000, 201000))
+            print("upsert:", bulk_upsert(conn, rows))
+            print("update:", bulk_update(
+                conn, ({"id": i, "name": f"renamed{i}", "age": 30} for i in range(1000, 201000))
+            ))
+            print("delete:", bulk_delete(conn, range(1000, 201000)))
+
+            # inside the caller's transaction a failing chunk keeps the caller's work
+            conn.execute("BEGIN")
+            conn.execute("INSERT INTO users (id, name, age) VALUES (999, 'outer', 40)")
+            bulk_upsert(conn, [(998, "inner", 41)])
+            try:
+                # moves row 3 onto id 2, which is taken
+                bulk_update(conn, [("clash", 1, 2, 3)], columns=("name", "age", "id"))
+            except Exception as e:
+                print("nested chunk rolled back:", e)
+            assert conn.in_transaction
+            conn.commit()
+            names = conn.execute("SELECT name FROM users WHERE id IN (998, 999) ORDER BY id")
+            assert [row[0] for row in names] == ["inner", "outer"]
+        pool.close()
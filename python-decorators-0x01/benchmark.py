@@ -0,0 +1,240 @@
+"""
+Micro-benchmarks for the database decorators.
+
+Run from this directory, e.g. ``python benchmark.py pool --calls 20000``.
+"""
+import argparse
+import functools
+import os
+import random
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+
+pooling = __import__("1-with_db_connection")
+
+
+def connect_per_call(func):
+    """The original Task 1 decorator: one fresh connection per call."""
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        conn = sqlite3.connect("users.db")
+        try:
+            result = func(conn, *args, **kwargs)
+        finally:
+            conn.close()
+        return result
+
+    return wrapper
+
+
+def get_user_by_id(conn, user_id):
+    cursor = conn.cursor()
+    cursor.execute("SELECT * FROM users WHERE id = ?", (user_id,))
+    return cursor.fetchone()
+
+
+def calls_per_second(func, calls, threads=1):
+    """Call ``func(user_id=...)`` ``calls`` times spread over ``threads``."""
+    per_thread = calls // threads
+
+    def worker():
+        for i in range(per_thread):
+            func(user_id=i % 6 + 1)
+
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    start = time.perf_counter()
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    elapsed = time.perf_counter() - start
+    return per_thread * threads / elapsed
+
+
+def bench_pool(args):
+    pool = pooling.ConnectionPool(
+        "users.db", max_size=max(args.threads, 1), thread_affinity=args.affinity
+    )
+    variants = {
+        "connect-per-call": connect_per_call(get_user_by_id),
+        "pooled": pooling.with_db_connection(get_user_by_id, pool=pool),
+    }
+    print(f"{args.calls} calls, {args.threads} thread(s)")
+    baseline = None
+    for name, func in variants.items():
+        rate = calls_per_second(func, args.calls, args.threads)
+        baseline = baseline or rate
+        print(f"  {name:<18} {rate:>12,.0f} calls/s  ({rate / baseline:.1f}x)")
+    pool.close()
+
+
+def seeded_copy(directory, rows):
+    """Copy users.db into ``directory`` and grow it to ``rows`` users."""
+    database = shutil.copy("users.db", os.path.join(directory, "users.db"))
+    conn = sqlite3.connect(database)
+    conn.executemany(
+        "INSERT INTO users (name, age) VALUES (?, ?)",
+        ((f"user{i}", 18 + i % 60) for i in range(rows)),
+    )
+    conn.commit()
+    conn.close()
+    return database
+
+
+def read_write_mix(read_pool, write_pool, readers, seconds, rows):
+    """Point reads from ``readers`` threads while one thread keeps writing."""
+    stop = threading.Event()
+    counts = {"reads": 0, "writes": 0}
+    lock = threading.Lock()
+
+    def reader(seed):
+        done = 0
+        i = seed
+        while not stop.is_set():
+            with read_pool.connection() as conn:
+                conn.execute("SELECT * FROM users WHERE id = ?", (i % rows + 1,)).fetchone()
+            done += 1
+            i += 7919
+        with lock:
+            counts["reads"] += done
+
+    def writer():
+        done = 0
+        while not stop.is_set():
+            with write_pool.connection() as conn:
+                conn.execute("UPDATE users SET age = age + 1 WHERE id = ?", (done % rows + 1,))
+                conn.commit()
+            done += 1
+        counts["writes"] = done
+
+    threads = [threading.Thread(target=reader, args=(n,)) for n in range(readers)]
+    threads.append(threading.Thread(target=writer))
+    for t in threads:
+        t.start()
+    time.sleep(seconds)
+    stop.set()
+    for t in threads:
+        t.join()
+    return counts["reads"] / seconds, counts["writes"] / seconds
+
+
+def bench_wal(args):
+    print(f"{args.readers} reader thread(s) + 1 writer, {args.seconds}s each")
+    with tempfile.TemporaryDirectory() as tmp:
+        database = seeded_copy(tmp, args.rows)
+        shared = pooling.ConnectionPool(database, max_size=args.readers + 1, timeout=30)
+        reads, writes = read_write_mix(shared, shared, args.readers, args.seconds, args.rows)
+        shared.close()
+        print(f"  {'rollback journal':<18} {reads:>12,.0f} reads/s {writes:>10,.0f} writes/s")
+
+        router = pooling.ReadWriteRouter(database, readers=args.readers, timeout=30)
+        reads, writes = read_write_mix(
+            router.readers, router.writer, args.readers, args.seconds, args.rows
+        )
+        router.close()
+        print(f"  {'wal + ro readers':<18} {reads:>12,.0f} reads/s {writes:>10,.0f} writes/s")
+
+
+def profile_workloads(database, profile, rows, seconds):
+    """Throughput of one PRAGMA profile on our read and write workloads."""
+    conn = pooling.apply_pragmas(sqlite3.connect(database), profile)
+    results = {}
+
+    def timed(name, body):
+        start = time.perf_counter()
+        count = body()
+        results[name] = count / (time.perf_counter() - start)
+
+    def point_reads():
+        done = 0
+        deadline = time.perf_counter() + seconds
+        while time.perf_counter() < deadline:
+            for _ in range(100):
+                conn.execute(
+                    "SELECT * FROM users WHERE id = ?", (random.randint(1, rows),)
+                ).fetchone()
+            done += 100
+        return done
+
+    def full_scans():
+        done = 0
+        deadline = time.perf_counter() + seconds
+        while time.perf_counter() < deadline:
+            conn.execute("SELECT age, COUNT(*), MAX(name) FROM users GROUP BY age").fetchall()
+            done += 1
+        return done
+
+    def row_commits():
+        done = 0
+        deadline = time.perf_counter() + seconds
+        while time.perf_counter() < deadline:
+            conn.execute("INSERT INTO users (name, age) VALUES (?, ?)", ("bench", 30))
+            conn.commit()
+            done += 1
+        return done
+
+    def bulk_insert():
+        conn.executemany(
+            "INSERT INTO users (name, age) VALUES (?, ?)",
+            ((f"bulk{i}", 18 + i % 60) for i in range(rows)),
+        )
+        conn.commit()
+        return rows
+
+    timed("point reads/s", point_reads)
+    timed("scans/s", full_scans)
+    timed("row commits/s", row_commits)
+    timed("bulk rows/s", bulk_insert)
+    conn.close()
+    return results
+
+
+def bench_profiles(args):
+    names = args.profile or sorted(pooling.PRAGMA_PROFILES)
+    print(f"{args.rows} seeded rows, {args.seconds}s per timed workload")
+    header = None
+    with tempfile.TemporaryDirectory() as tmp:
+        for name in names:
+            # a fresh copy per profile: journal_mode is persisted in the file
+            workdir = os.path.join(tmp, name)
+            os.mkdir(workdir)
+            database = seeded_copy(workdir, args.rows)
+            results = profile_workloads(database, name, args.rows, args.seconds)
+            if header is None:
+                header = list(results)
+                print(f"  {'profile':<16}" + "".join(f"{column:>16}" for column in header))
+            print(f"  {name:<16}" + "".join(f"{results[c]:>16,.0f}" for c in header))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    sub = parser.add_subparsers(dest="bench", required=True)
+
+    p = sub.add_parser("pool", help="pooled connections vs connect-per-call")
+    p.add_argument("--calls", type=int, default=20000)
+    p.add_argument("--threads", type=int, default=1)
+    p.add_argument("--affinity", action="store_true", help="pin connections to threads")
+    p.set_defaults(run=bench_pool)
+
+    p = sub.add_parser("wal", help="read throughput under concurrent writes")
+    p.add_argument("--readers", type=int, default=4)
+    p.add_argument("--seconds", type=float, default=3.0)
+    p.add_argument("--rows", type=int, default=100000)
+    p.set_defaults(run=bench_wal)
+
+    p = sub.add_parser("profiles", help="read/write workloads under each PRAGMA profile")
+    p.add_argument("--profile", action="append", choices=sorted(pooling.PRAGMA_PROFILES))
+    p.add_argument("--seconds", type=float, default=2.0)
+    p.add_argument("--rows", type=int, default=200000)
+    p.set_defaults(run=bench_profiles)
+
+    args = parser.parse_args()
+    args.run(args)
+
+
+if __name__ == "__main__":
+    main()